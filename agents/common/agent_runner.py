@@ -0,0 +1,319 @@
+"""
+Shared consume → handle → commit loop
+─────────────────────────────────────
+`AgentRunner` polls a consumer on the main thread and runs each message's
+value through `handler(topic, value)` on a thread or process pool, so
+several runs (dates) flow through a stage at the same time.
+
+  * Offsets are committed manually, per partition and in offset order: an
+    offset is only committed once it and every earlier offset of the same
+    partition are done. A crash re-delivers whatever was not finished
+    (at-least-once). A handler that raises is logged and committed past,
+    like the old loops did, so a bad message cannot block its partition.
+  * `on_result(topic, value, result)` runs on the polling thread: Kafka
+    clients are never used from pool workers (and handlers on a process
+    pool only have to return picklable results). When it raises, the output
+    was not produced: the message stays unfinished, which holds back the
+    commits of its partition, and on_result() is retried with backoff
+    (`retry_interval`, doubling up to a minute).
+  * Commits are checkpoints: every `commit_interval` seconds, `checkpoint()`
+    (e.g. flush the producer) runs first, and offsets are only committed
+    when it reports nothing undelivered.
+  * With `max_in_flight` messages being handled, all partitions are paused;
+    they resume as soon as work completes. Polling goes on meanwhile, so the
+    consumer stays in its group.
+  * On SIGTERM / Ctrl-C, polling stops, in-flight work drains and the
+    final offsets are committed. Revoked partitions are drained the same way.
+  * Each message gets a tracing.Trace, current while the handler and
+    on_result() run; its spans go to /runs/<run_id>/timings.json and, as one
+    JSON record per message, to `metrics_topic`.
+  * With a `metrics` (metrics.Metrics), messages, errors, in-flight work and
+    the queue / handle times of each message are recorded there.
+  * With a `startup` (startup.Startup), the first assignment closes the
+    agent's startup report.
+  * With a `run_store` (run_store.RunStore), each message's outcome is
+    recorded as the component's stage of its run in the run index.
+  * With a `reload` (config_reload.ConfigWatcher), a changed config stops
+    new work; once in-flight messages are done it is applied and, on a
+    process pool, the workers are restarted to pick it up.
+
+Settings come from the `runner` config section: `default`, overlaid by the
+agent's entry (workers, pool, max_in_flight, commit_interval).
+"""
+
+import logging, signal, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from pathlib import Path
+from confluent_kafka import KafkaException, TopicPartition
+from agents.common import tracing
+from agents.common.kafka_utils import publish_json
+
+_DEFAULTS = {
+    "workers":         1,
+    "pool":            "thread",        # thread | process
+    "max_in_flight":   None,            # None → 2 × workers
+    "commit_interval": 1.0,
+    "retry_interval":  1.0,             # first on_result() retry, then doubling
+}
+
+
+def _traced(handler, trace: tracing.Trace, topic, value):
+    """Runs on the pool: handler(topic, value) under *trace* → (result, trace)."""
+    trace.add(f"{trace.component}.queue", trace.queued_at, time.time())
+    with tracing.activate(trace), trace.span(f"{trace.component}.handle"):
+        return handler(topic, value), trace
+
+
+class AgentRunner:
+    def __init__(self, consumer, topics, handler, log: logging.Logger, *,
+                 workers: int = 1, pool: str = "thread", max_in_flight: int | None = None,
+                 commit_interval: float = 1.0, retry_interval: float = 1.0,
+                 on_result=None, checkpoint=None, tick=None, tick_interval: float = 1.0,
+                 component: str | None = None, runs_dir: Path = Path("/runs"),
+                 metrics_topic: str | None = None, metrics=None, startup=None, reload=None,
+                 run_store=None):
+        self.consumer        = consumer
+        self.topics          = topics
+        self.handler         = handler
+        self.log             = log
+        self.workers         = int(workers)
+        self.pool            = pool
+        self.max_in_flight   = int(max_in_flight or 2 * self.workers)
+        self.commit_interval = float(commit_interval)
+        self.retry_interval  = float(retry_interval)
+        self.on_result       = on_result
+        self.checkpoint      = checkpoint
+        self.tick            = tick
+        self.tick_interval   = tick_interval
+        self.component       = component or log.name
+        self.runs_dir        = Path(runs_dir)
+        self.metrics_topic   = metrics_topic
+        self.metrics         = metrics
+        self.startup         = startup
+        self.reload          = reload
+        self.run_store       = run_store
+
+        self._futures     = {}              # future → (tp, entry, topic, value)
+        self._pending     = {}              # (topic, partition) → deque of [offset, done]
+        self._committable = {}              # (topic, partition) → next offset to commit
+        self._unpublished = []              # handled, on_result() failed: [due, delay, tp, entry, topic, value, result, trace]
+        self._paused      = False
+        self._stopping    = False
+        self._last_commit = self._last_tick = self._last_reload = 0.0
+        self._reloading   = None            # (changed files, since, in flight) while draining
+
+    @classmethod
+    def from_config(cls, cfg: dict | None, name: str, consumer, topics, handler,
+                    log: logging.Logger, **hooks) -> "AgentRunner":
+        cfg = cfg or {}
+        settings = {**_DEFAULTS, **cfg.get("default", {}), **cfg.get(name, {})}
+        return cls(consumer, topics, handler, log, component=name, **settings, **hooks)
+
+    def stop(self, *_):
+        self._stopping = True
+
+    # ─── Main loop ────────────────────────────────────────────────────────────
+    def run(self):
+        self.consumer.subscribe(self.topics, on_assign=self._on_assign, on_revoke=self._on_revoke)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)    # elsewhere, whoever started us calls stop()
+        self.log.info("Running with %s %s worker(s), at most %s message(s) in flight",
+                      self.workers, self.pool, self.max_in_flight)
+
+        self._executor = self._new_executor()
+        try:
+            try:
+                while not self._stopping:
+                    self._step()
+            except KeyboardInterrupt:
+                pass
+            if self._futures:
+                self.log.info("Draining %s in-flight message(s)", len(self._futures))
+            wait(list(self._futures))
+            self._reap()
+            self._publish_pending(force=True)   # last try; what still fails is re-delivered
+        finally:
+            self._executor.shutdown()
+        self._commit(force=True)
+        self.consumer.close()
+
+    def _new_executor(self):
+        executor = ProcessPoolExecutor if self.pool == "process" else ThreadPoolExecutor
+        return executor(max_workers=self.workers)
+
+    def _step(self):
+        self._reap()
+        self._publish_pending()
+        self._flow()
+        self._commit()
+
+        now = time.monotonic()
+        if self.tick is not None and now - self._last_tick >= self.tick_interval:
+            self._last_tick = now
+            self.tick()
+        if self.reload is not None:
+            self._check_reload(now)
+
+        msg = self.consumer.poll(0.1 if self._futures else 1.0)
+        if msg is None:
+            return
+        if msg.error():
+            self.log.error(msg.error())
+            return
+
+        self.log.debug("Message received %s [%s] @%s", msg.topic(), msg.partition(), msg.offset())
+        tp    = (msg.topic(), msg.partition())
+        entry = [msg.offset(), False]
+        self._pending.setdefault(tp, deque()).append(entry)
+        trace = tracing.Trace.from_message(msg, self.component)
+        future = self._executor.submit(_traced, self.handler, trace, msg.topic(), msg.value())
+        self._futures[future] = (tp, entry, msg.topic(), msg.value())
+        if self.metrics is not None:
+            self.metrics.set("in_flight", len(self._futures))
+
+    def _reap(self):
+        for future in [f for f in self._futures if f.done()]:
+            tp, entry, topic, value = self._futures.pop(future)
+            try:
+                result, trace = future.result()
+            except Exception as exc:
+                # the handler failed: logged and committed past (skip)
+                self.log.error("Message %s [%s] @%s failed: %s", *tp, entry[0], exc, exc_info=exc)
+                run_id = value.get("run_id") if isinstance(value, dict) else None
+                if self.run_store is not None and run_id:
+                    self.run_store.stage(run_id, self.component, "failed", error=str(exc))
+                if self.metrics is not None:
+                    self.metrics.inc("errors")
+                self._finish(entry)
+                continue
+            if self.metrics is not None:
+                self._observe(trace)
+            item = [0.0, self.retry_interval, tp, entry, topic, value, result, trace]
+            if not self._publish(item):
+                self._unpublished.append(item)
+
+    def _publish(self, item) -> bool:
+        """on_result() of a handled message; on failure it waits in _unpublished, unfinished."""
+        _, delay, tp, entry, topic, value, result, trace = item
+        try:
+            with tracing.activate(trace):
+                if self.on_result is not None:
+                    self.on_result(topic, value, result)
+        except Exception as exc:
+            self.log.error("Output of message %s [%s] @%s failed, retry in %.0fs: %s",
+                           *tp, entry[0], delay, exc, exc_info=exc)
+            if self.metrics is not None:
+                self.metrics.inc("errors")
+            item[0], item[1] = time.monotonic() + delay, min(delay * 2, 60.0)
+            return False
+        self._record(trace)
+        self._finish(entry)
+        return True
+
+    def _publish_pending(self, force: bool = False):
+        """Retry the on_result() calls that are due (*force*: all of them, once)."""
+        now = time.monotonic()
+        self._unpublished = [item for item in self._unpublished
+                             if not ((force or item[0] <= now) and self._publish(item))]
+
+    def _finish(self, entry):
+        entry[1] = True
+        if self.metrics is not None:
+            self.metrics.inc("messages")
+            self.metrics.set("in_flight", len(self._futures))
+
+    def _observe(self, trace: tracing.Trace):
+        """Queue and handle times of a finished message."""
+        for span in trace.spans:
+            kind = span["name"].rpartition(".")[2]
+            if span["component"] == self.component and kind in ("queue", "handle"):
+                self.metrics.observe(kind, span["end"] - span["start"])
+
+    def _record(self, trace: tracing.Trace):
+        if not trace.run_id or not trace.spans:
+            return
+        timings = {}
+        try:
+            timings = tracing.write_timings(self.runs_dir / trace.run_id, trace)
+        except OSError as exc:
+            self.log.warning("Could not write timings of %s: %s", trace.run_id, exc)
+        if self.run_store is not None:
+            handle = next((s["ms"] for s in trace.spans if s["name"] == f"{self.component}.handle"), None)
+            self.run_store.stage(trace.run_id, self.component, "done", handle, total_ms=timings.get("total_ms"))
+        if self.metrics_topic:
+            publish_json(self.metrics_topic,
+                         {"type": "spans", "run_id": trace.run_id, "t0": trace.t0,
+                          "component": self.component, "spans": trace.spans},
+                         key=trace.run_id)
+
+    def _check_reload(self, now: float):
+        """Config changed → no new work; applied once in-flight messages are done."""
+        if self._reloading is None:
+            if now - self._last_reload < self.reload.interval:
+                return
+            self._last_reload = now
+            changed = self.reload.changed()
+            if not changed:
+                return
+            self._reloading = (changed, now, len(self._futures))
+            if self._futures:
+                self.log.info("Config changed, waiting for %s in-flight message(s)", len(self._futures))
+            self._flow()
+        if self._futures:
+            return
+        changed, since, in_flight = self._reloading
+        if self.reload.reload(changed, time.monotonic() - since, in_flight) and self.pool == "process":
+            self._executor.shutdown()       # workers hold the old module state
+            self._executor = self._new_executor()
+        self._reloading = None
+
+    def _flow(self):
+        """Pause all partitions while the pool is saturated (or a reload waits)."""
+        busy = (len(self._futures) + len(self._unpublished) >= self.max_in_flight
+                or self._reloading is not None)
+        if busy != self._paused:
+            assignment = self.consumer.assignment()
+            (self.consumer.pause if busy else self.consumer.resume)(assignment)
+            self._paused = busy
+
+    # ─── Offsets ──────────────────────────────────────────────────────────────
+    def _commit(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_commit < self.commit_interval:
+            return
+        self._last_commit = now
+
+        for tp, entries in self._pending.items():
+            while entries and entries[0][1]:
+                self._committable[tp] = entries.popleft()[0] + 1
+        if not self._committable:
+            return
+        if self.checkpoint is not None and self.checkpoint():
+            return                          # outputs not delivered yet: retry later
+
+        offsets = [TopicPartition(t, p, o) for (t, p), o in self._committable.items()]
+        try:
+            self.consumer.commit(offsets=offsets, asynchronous=False)
+            self._committable.clear()
+        except KafkaException as exc:
+            self.log.warning("Offset commit failed, will retry: %s", exc)
+
+    def _on_assign(self, consumer, partitions):
+        self._paused = False                # a new assignment starts unpaused
+        if self.startup is not None and not self.startup.reported:
+            self.startup.mark("assigned")
+            self.startup.report(self.log, self.metrics)
+
+    def _on_revoke(self, consumer, partitions):
+        """Finish and commit the work of revoked partitions before giving them up."""
+        revoked = {(p.topic, p.partition) for p in partitions}
+        wait([f for f, (tp, *_) in self._futures.items() if tp in revoked])
+        self._reap()
+        self._publish_pending(force=True)
+        self._commit(force=True)
+        # outputs still failing: the partition's next owner handles these messages again
+        self._unpublished = [i for i in self._unpublished if i[2] not in revoked]
+        for tp in revoked:
+            self._pending.pop(tp, None)
+            self._committable.pop(tp, None)
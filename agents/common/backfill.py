@@ -0,0 +1,156 @@
+"""
+Date-range backfills
+────────────────────
+A backfill command (`Cmd` with an `end_date`) is expanded by the query agent
+into one `Cmd` per date, all tagged with the same `backfill_id`. They then
+flow through the stages like any other run, as many at once as the agents'
+worker pools allow.
+
+Dates whose results can no longer change (see QueryCache.expiry) and that
+were already fetched are not fetched again: the backfill reuses their run.
+The web builder coalesces the sitemaps of a backfill into a single site,
+built once every date has arrived, from the stage directory:
+
+    <root>/<backfill_id>/backfill.json   ← {start, end, collection, total}
+    <root>/<backfill_id>/<date>.json     ← {"run_id": …} per staged date
+    <root>/seen-<collection>.json        ← {date: run_id} of fetched dates
+"""
+
+import json, os, threading, time
+from datetime import date, timedelta
+from pathlib import Path
+
+_lock = threading.Lock()
+
+
+def date_range(start: str, end: str) -> list[str]:
+    """ISO dates from *start* to *end*, both included."""
+    first, last = date.fromisoformat(start), date.fromisoformat(end)
+    return [(first + timedelta(days=n)).isoformat() for n in range((last - first).days + 1)]
+
+
+def _write_json(path: Path, obj):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    tmp.write_text(json.dumps(obj))
+    os.replace(tmp, path)
+
+
+# ─── Fetched dates ────────────────────────────────────────────────────────────
+class SeenDates:
+    """Per collection: the latest run that fetched each date."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, collection: str) -> Path:
+        return self.root / f"seen-{collection}.json"
+
+    def load(self, collection: str) -> dict:
+        try:
+            return json.loads(self._path(collection).read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def mark(self, collection: str, day: str, run_id: str):
+        with _lock:
+            seen = self.load(collection)
+            seen[day] = run_id
+            _write_json(self._path(collection), seen)
+
+
+# ─── Stage directory ──────────────────────────────────────────────────────────
+def create_stage(root: Path, backfill_id: str, meta: dict, reused: dict):
+    """Record the backfill and the dates it reuses ({date: run_id})."""
+    stage = Path(root) / backfill_id
+    stage.mkdir(parents=True, exist_ok=True)
+    for day, run_id in reused.items():
+        _write_json(stage / f"{day}.json", {"run_id": run_id})
+    _write_json(stage / "backfill.json", meta)
+
+
+def stage_date(root: Path, backfill_id: str, day: str, run_id: str) -> tuple[int, int] | None:
+    """
+    Stage one date of *backfill_id*; returns (staged dates, total), or None
+    when the backfill is already being built (late arrival).
+    """
+    stage = Path(root) / backfill_id
+    try:
+        total = json.loads((stage / "backfill.json").read_text())["total"]
+        _write_json(stage / f"{day}.json", {"run_id": run_id})
+    except FileNotFoundError:               # claimed (renamed) meanwhile
+        return None
+    return len(list(stage.glob("????-??-??.json"))), total
+
+
+def staged_dates(stage: Path) -> dict:
+    """{date: run_id} of every date staged so far."""
+    return {p.stem: json.loads(p.read_text())["run_id"]
+            for p in stage.glob("????-??-??.json")}
+
+
+def referenced_runs(root: Path) -> set[str]:
+    """Runs whose files backfills still read: fetched dates, staged ones and those being built."""
+    runs = set()
+    for seen in Path(root).glob("seen-*.json"):
+        try:
+            runs.update(json.loads(seen.read_text()).values())
+        except (FileNotFoundError, ValueError):
+            pass
+    for stage in Path(root).glob("*/"):
+        try:
+            runs.update(staged_dates(stage).values())
+        except (FileNotFoundError, ValueError):
+            pass                            # claimed or rewritten meanwhile
+    return runs
+
+
+def claim(root: Path, backfill_id: str) -> Path | None:
+    """Take the stage directory for building; only one caller wins."""
+    claimed = Path(root) / f".{backfill_id}.building"
+    try:
+        os.rename(Path(root) / backfill_id, claimed)
+    except FileNotFoundError:
+        return None
+    return claimed
+
+
+def ready(root: Path, after: float) -> list[str]:
+    """
+    Backfills to build: complete ones (e.g. every date was reused) and those
+    that got no new date for *after* seconds (some date failed upstream).
+    """
+    cutoff = time.time() - after               # a staged date touches the directory
+    out = []
+    for meta in Path(root).glob("*/backfill.json"):
+        stage = meta.parent
+        try:
+            total = json.loads(meta.read_text())["total"]
+            if stage.stat().st_mtime < cutoff or len(list(stage.glob("????-??-??.json"))) >= total:
+                out.append(stage.name)
+        except (FileNotFoundError, ValueError):
+            continue                        # claimed or being written
+    return out
+
+
+# ─── Progress ─────────────────────────────────────────────────────────────────
+class Progress:
+    """Dates completed per backfill, and the rate since the first one started."""
+
+    def __init__(self):
+        self._runs = {}                     # backfill_id → [done, total, started]
+        self._lock = threading.Lock()
+
+    def start(self, backfill_id: str, total: int):
+        with self._lock:
+            self._runs.setdefault(backfill_id, [0, total, time.monotonic()])
+
+    def done(self, backfill_id: str) -> tuple[int, int, float]:
+        """Count one date; returns (done, total (0: unknown), dates per minute)."""
+        with self._lock:
+            run = self._runs.setdefault(backfill_id, [0, 0, time.monotonic()])
+            run[0] += 1
+            rate = run[0] / max(time.monotonic() - run[2], 1e-6) * 60
+            if run[0] == run[1]:
+                del self._runs[backfill_id]
+            return run[0], run[1], rate
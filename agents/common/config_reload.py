@@ -0,0 +1,111 @@
+"""
+Hot reload of the configuration
+───────────────────────────────
+`ConfigWatcher` watches base_config.yaml, plus files the config points to
+(e.g. the XSLT), by content hash. The AgentRunner polls it between
+messages. On a change it stops taking new messages, lets in-flight work
+finish, then calls the agent's `configure(cfg)`. That function builds
+everything it needs from *cfg* first (compiling the stylesheet, for
+instance), so an invalid config raises before anything is swapped, and the
+agent carries on with the old config.
+
+Sections read only when an agent starts (RESTART_ONLY: clients, topics,
+pools, logging) keep their running values; a change there is logged as
+needing a restart.
+
+    Config reloaded (sparql_queries, raw_to_sitemap.xslt) 2140 ms after the change:
+    612 ms draining 1 message(s), 35 ms to apply
+"""
+
+import hashlib, time, yaml
+from pathlib import Path
+
+RESTART_ONLY = ("kafka", "runs_dir", "topics", "logging", "runner", "metrics",
+                "consumers", "producers", "payload_store", "run_store")
+
+
+class ConfigWatcher:
+    def __init__(self, path: str | Path, config: dict, configure, log, *,
+                 files=None, interval: float = 2.0):
+        self.path      = Path(path)
+        self.config    = config             # as last applied
+        self.configure = configure
+        self.log       = log
+        self.files     = files or (lambda cfg: [])
+        self.interval  = float(interval)
+        self._seen     = self._snapshot(config)     # path → (stat key, sha256)
+
+    @classmethod
+    def from_config(cls, path, config: dict, configure, log, **kwargs) -> "ConfigWatcher":
+        interval = (config.get("config_reload") or {}).get("interval", 2.0)
+        return cls(path, config, configure, log, interval=interval, **kwargs)
+
+    def _paths(self, config: dict) -> list[Path]:
+        return [self.path, *map(Path, self.files(config))]
+
+    @staticmethod
+    def _stat(path: Path):
+        try:
+            st = path.stat()
+            return st.st_mtime_ns, st.st_size, st.st_ino
+        except OSError:
+            return None
+
+    @staticmethod
+    def _digest(path: Path) -> str | None:
+        try:
+            return hashlib.sha256(path.read_bytes()).hexdigest()
+        except OSError:
+            return None
+
+    def _snapshot(self, config: dict) -> dict:
+        return {p: (self._stat(p), self._digest(p)) for p in self._paths(config)}
+
+    def changed(self) -> list[Path]:
+        """Watched files whose content differs from what was last applied."""
+        out = []
+        for path, (stat, digest) in self._seen.items():
+            now = self._stat(path)
+            if now != stat:
+                if self._digest(path) != digest:
+                    out.append(path)
+                else:
+                    self._seen[path] = (now, digest)    # touched, same content
+        return out
+
+    def reload(self, changed: list[Path], drained: float = 0.0, waited_for: int = 0) -> bool:
+        """Load, validate and apply the config; False (old config kept) when invalid."""
+        t0 = time.time()
+        try:
+            new = yaml.safe_load(self.path.read_text())
+            if not isinstance(new, dict):
+                raise ValueError(f"{self.path} does not hold a mapping")
+            sections = sorted(k for k in new.keys() | self.config.keys()
+                              if new.get(k) != self.config.get(k))
+            restart  = [k for k in sections if k in RESTART_ONLY]
+            for k in RESTART_ONLY:          # running values win
+                if k in self.config:
+                    new[k] = self.config[k]
+                else:
+                    new.pop(k, None)
+            self.configure(new)
+        except Exception as exc:
+            self.log.error("Config reload failed, keeping the running config: %s", exc)
+            # retried when a watched file changes again
+            self._seen.update({p: (self._stat(p), self._digest(p)) for p in changed})
+            return False
+
+        self.config = new
+        self._seen  = self._snapshot(new)
+        applied     = time.time()
+        since       = max((st[0] / 1e9 for st in map(self._stat, changed) if st), default=t0)
+        what        = [k for k in sections if k not in restart] + \
+                      [p.name for p in changed if p != self.path]
+        self.log.info("Config reloaded (%s) %.0f ms after the change: "
+                      "%.0f ms draining %s message(s), %.0f ms to apply",
+                      ", ".join(what) or "no change", (applied - since) * 1000,
+                      drained * 1000, waited_for, (applied - t0) * 1000)
+        if restart:
+            self.log.warning("Config sections %s changed: restart the agent to apply them",
+                             ", ".join(restart))
+        return True
@@ -0,0 +1,68 @@
+"""
+Pre-grouped JSON data feed for Eleventy
+───────────────────────────────────────
+Python already parses the sitemap, so the web builder hands Eleventy the
+records grouped the way the templates render them, instead of sitemap.xml:
+
+    sitemap.json = {"maps": [{"issued": …, "collection": …,
+                              "items": {<docType>: [{"loc", "num", "title"}, …]}}, …]}
+
+Grouping follows the `hierarchy` of the query: the first two levels make the
+pages, the third the sections of a page. With `split`, each collection goes to
+its own `sitemap-data-<slug>.json` and sitemap.json only lists them:
+
+    sitemap.json = {"parts": ["sitemap-data-….json", …]}
+"""
+
+import json
+from pathlib import Path
+from agents.common.site_manifest import slugify
+
+try:                                   # optional, much faster encoder
+    import orjson
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+FEED = "sitemap.json"
+
+# hierarchy level (base_config.yaml) → sitemap record field
+LEVEL_FIELDS = {
+    "date":          "issued",
+    "oj_collection": "collection",
+    "resource_type": "docType",
+}
+
+
+def group_records(records, hierarchy) -> list:
+    """[{<page level fields>, "items": {<section>: [records]}}, …] in sitemap order."""
+    levels = [LEVEL_FIELDS[level] for level in hierarchy if level in LEVEL_FIELDS]
+    if len(levels) < 3:
+        raise ValueError(f"hierarchy {hierarchy} needs 3 levels out of {list(LEVEL_FIELDS)}")
+    page_fields, section = levels[:2], levels[2]
+    pages = {}
+    for rec in records:
+        key  = tuple(rec[f] for f in page_fields)
+        page = pages.get(key)
+        if page is None:
+            page = pages[key] = {**dict(zip(page_fields, key)), "items": {}}
+        page["items"].setdefault(rec[section], []).append(
+            {"loc": rec["loc"], "num": rec["num"], "title": rec["title"]})
+    return list(pages.values())
+
+
+def write_feed(site_dir: Path, maps: list, split: bool = False) -> list:
+    """Write sitemap.json (+ one part per collection if *split*), return the file names."""
+    if not split:
+        (site_dir / FEED).write_bytes(_dumps({"maps": maps}))
+        return [FEED]
+
+    parts = {}
+    for m in maps:
+        parts.setdefault(f"sitemap-data-{slugify(m['collection'])}.json", []).append(m)
+    for name, part in parts.items():
+        (site_dir / name).write_bytes(_dumps({"maps": part}))
+    (site_dir / FEED).write_bytes(_dumps({"parts": list(parts)}))
+    return [FEED, *parts]
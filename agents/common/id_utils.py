@@ -3,3 +3,7 @@ from ulid import ULID
 def new_run_id(date_str: str) -> str:
     """Return sortable id: <YYYY-MM-DD>_<ULID>"""
     return f"{date_str}_{ULID()}"
+
+def new_backfill_id(start: str, end: str) -> str:
+    """Return sortable id: <start>_<end>_<ULID>"""
+    return f"{start}_{end}_{ULID()}"
@@ -1,18 +1,45 @@
-import os, json, time, uuid, logging, sys
+import os, json, time, uuid, logging, sys, queue, random, socket, threading
+from collections import OrderedDict
 from confluent_kafka import Producer, SerializingProducer, DeserializingConsumer
-from confluent_kafka.schema_registry import SchemaRegistryClient
-from confluent_kafka.schema_registry.avro import AvroSerializer, AvroDeserializer
+# confluent_kafka.schema_registry (~0.2 s to import) is only loaded when a
+# serializer or deserializer is first needed, see _registry()
 
 BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP", "kafka:9092")
 SCHEMA_REGISTRY   = os.getenv("SCHEMA_REGISTRY", "http://schema-registry:8081")
+SCHEMA_CACHE      = os.getenv("SCHEMA_CACHE", "/runs/_cache/schemas.json")
+# KAFKA_BOOTSTRAP="" → no broker (agents.direct): producers drop what they are
+# given, logs stay on the console, consumers cannot be created
+OFFLINE           = not BOOTSTRAP_SERVERS
 
-def _logger(name: str, log_topic: str | None = None) -> logging.Logger:
-    """Returns a logger; if *log_topic* is set, adds a Kafka handler."""
+# neither the console format nor the log topic use caller, thread or process
+# info: skip collecting it per record ("Optimization" in the logging HOWTO)
+logging._srcfile          = None
+logging.logThreads        = False
+logging.logProcesses      = False
+logging.logMultiprocessing = False
+
+# base_config.yaml `logging`: `default`, overlaid by the component's entry
+_LOG_DEFAULTS = {
+    "level":       "INFO",      # logger level; records below are never formatted
+    "kafka_level": "INFO",      # forwarded to the log topic from this level up
+    "sample":      {},          # level → fraction of records forwarded
+    "queue_size":  10000,
+    "batch_size":  500,
+}
+
+def _logger(name: str, log_topic: str | None = None,
+            settings: dict | None = None) -> logging.Logger:
+    """
+    Returns a logger; if *log_topic* is set, adds a Kafka handler.
+    *settings* is the `logging` config section.
+    """
     logger = logging.getLogger(name)
     if logger.handlers:               # already initialised → return as is
         return logger
 
-    logger.setLevel(logging.DEBUG)
+    settings = settings or {}
+    cfg = {**_LOG_DEFAULTS, **settings.get("default", {}), **settings.get(name, {})}
+    logger.setLevel(cfg["level"])
 
     # Console/stdout
     stream = logging.StreamHandler()
@@ -22,81 +49,335 @@ def _logger(name: str, log_topic: str | None = None) -> logging.Logger:
     logger.addHandler(stream)
 
     # Kafka
-    if log_topic:
-        logger.addHandler(_KafkaLogHandler(log_topic, component=name))
+    if log_topic and not OFFLINE:
+        logger.addHandler(_KafkaLogHandler(log_topic, component=name, settings=cfg))
 
     return logger
 
-_sr_client = SchemaRegistryClient({"url": SCHEMA_REGISTRY})
-_plain_producer = Producer({"bootstrap.servers": BOOTSTRAP_SERVERS})
+class _OfflineProducer:
+    """Producer stand-in when OFFLINE: nothing is sent, nothing is pending."""
+    def produce(self, *args, **kwargs):
+        pass
+
+    def poll(self, timeout=None) -> int:
+        return 0
+
+    def flush(self, timeout=None) -> int:
+        return 0
+
+    def produce_serialized(self, *args, **kwargs):
+        pass
+
+def _once(factory):
+    """Zero-argument function: factory() on the first call, its result afterwards."""
+    lock, box = threading.Lock(), []
+    def get():
+        if not box:
+            with lock:
+                if not box:
+                    box.append(factory())
+        return box[0]
+    return get
+
+def _schema_registry_client():
+    from agents.common.schema_cache import CachedSchemaRegistryClient
+    return CachedSchemaRegistryClient({"url": SCHEMA_REGISTRY}, SCHEMA_CACHE)
+
+_registry = _once(_schema_registry_client)
+
+def _serde_conf() -> dict:
+    # subjects are <topic>-value, spelled out: newer clients otherwise ask the
+    # registry for the topic's associated subject first
+    from confluent_kafka.schema_registry import topic_subject_name_strategy
+    return {"subject.name.strategy": topic_subject_name_strategy}
+_plain_producer = _OfflineProducer() if OFFLINE else Producer({"bootstrap.servers": BOOTSTRAP_SERVERS})
 
 def _dict_to_bytes(obj, ctx):
     # Serializer helper—not used, value schema only
     return obj
 
-def create_avro_producer(value_schema_str: str):
+# base_config.yaml `producers` keys → librdkafka properties
+_PRODUCER_KEYS = {
+    "compression":       "compression.type",
+    "linger_ms":         "linger.ms",
+    "batch_size":        "batch.size",
+    "max_message_bytes": "message.max.bytes",
+}
+
+def producer_settings(cfg: dict | None, topic_key: str | None = None) -> dict:
+    """
+    librdkafka settings for the topic *topic_key* (a key of `topics`), from
+    the `producers` config section: `default`, overlaid by the topic's entry.
+    """
+    cfg = cfg or {}
+    merged = {**cfg.get("default", {}), **cfg.get(topic_key, {})}
+    return {_PRODUCER_KEYS.get(k, k): v for k, v in merged.items()}
+
+# base_config.yaml `consumers` keys → librdkafka properties
+_CONSUMER_KEYS = {
+    "session_timeout_ms": "session.timeout.ms",
+    "fetch_wait_max_ms":  "fetch.wait.max.ms",
+}
+
+def consumer_settings(cfg: dict | None, name: str, group: str) -> dict:
+    """
+    librdkafka settings for the consumer of agent *name* in *group*, from
+    the `consumers` config section: `default`, overlaid by the agent's entry.
+    `static_membership` gives the consumer a group.instance.id stable across
+    restarts of its container (<group>-<hostname>): restarted within the
+    session timeout, it gets its partitions back without a rebalance.
+    """
+    cfg = cfg or {}
+    merged = {**cfg.get("default", {}), **cfg.get(name, {})}
+    static = merged.pop("static_membership", False)
+    settings = {_CONSUMER_KEYS.get(k, k): v for k, v in merged.items()}
+    if static:
+        settings["group.instance.id"] = f"{group}-{socket.gethostname()}"
+    return settings
+
+class _LazyProducer:
+    """
+    SerializingProducer created on the first produce(): an agent that has
+    nothing to send yet does not wait for (or connect to) the broker. Until
+    then poll() and flush() have nothing to serve.
+    """
+    def __init__(self, config: dict):
+        self._producer = None
+        self._create   = _once(lambda: SerializingProducer(config))
+
+    def produce(self, *args, **kwargs):
+        self._producer = self._create()
+        self._producer.produce(*args, **kwargs)
+
+    def produce_serialized(self, topic, value, **kwargs):
+        """produce() of a value serialized already (a re-send): the serializer is skipped."""
+        self._producer = self._create()
+        Producer.produce(self._producer, topic, value=value, **kwargs)
+
+    def poll(self, *args) -> int:
+        return self._producer.poll(*args) if self._producer is not None else 0
+
+    def flush(self, *args) -> int:
+        return self._producer.flush(*args) if self._producer is not None else 0
+
+    def __len__(self) -> int:
+        return len(self._producer) if self._producer is not None else 0
+
+def create_avro_producer(value_schema_str: str,
+                         payload_store=None, payload_fields=(),
+                         settings: dict | None = None):
     """
     Returns (producer, value_serializer) so callers can:
         producer.produce(topic, key=None,
                          value=value_serializer(payload, ctx))
+
+    If *payload_store* is given, string values of *payload_fields* above the
+    store's inline threshold are offloaded and replaced by a PayloadRef.
+    *settings* (see producer_settings()) override the batching defaults.
+    The producer and its Avro serializer are only created on first use.
     """
-    value_serializer = AvroSerializer(
-        _sr_client,
-        value_schema_str,
-        _dict_to_bytes
-    )
+    to_dict = _dict_to_bytes
+    if payload_store is not None and payload_fields:
+        to_dict = lambda obj, ctx: payload_store.offload(obj, payload_fields)
+
+    def serializer():
+        from confluent_kafka.schema_registry.avro import AvroSerializer
+        return AvroSerializer(_registry(), value_schema_str, to_dict, conf=_serde_conf())
+    serializer = _once(serializer)
+    value_serializer = lambda obj, ctx: serializer()(obj, ctx)
+    if OFFLINE:
+        return _OfflineProducer(), value_serializer
 
-    producer = SerializingProducer({
+    producer = _LazyProducer({
         "bootstrap.servers": BOOTSTRAP_SERVERS,
         "enable.idempotence": True,
         "linger.ms": 0,
         "batch.size": 16384,
         "delivery.timeout.ms": 30000,
+        **(settings or {}),
         "value.serializer": value_serializer,
     })
     return producer, value_serializer
 
-def create_avro_consumer(group, topics, value_schema_str: str):
-    value_deserializer = AvroDeserializer(_sr_client, value_schema_str)
+class DeliveryTracker:
+    """
+    Delivery outcomes of asynchronous produce() calls, counted per run_id.
+    Callbacks fire from producer.poll()/flush(); agents poll after producing
+    and only flush at checkpoints (offset commits, shutdown).
+
+    A message whose delivery failed is kept (serialized) until a checkpoint
+    re-sends it; until it is delivered, checkpoints count it as undelivered,
+    so the input offsets behind it are not committed.
+    """
+    def __init__(self, logger: logging.Logger, keep: int = 256):
+        self.log    = logger
+        self.keep   = keep
+        self.runs   = OrderedDict()         # run_id → {"delivered": n, "failed": n}
+        self.failed = []                    # (run_id, topic, key, value, headers) to re-send
+
+    def callback(self, run_id: str):
+        def on_delivery(err, msg):
+            stats = self.runs.setdefault(run_id, {"delivered": 0, "failed": 0})
+            self.runs.move_to_end(run_id)
+            if err is not None:
+                stats["failed"] += 1
+                self.failed.append((run_id, msg.topic(), msg.key(), msg.value(), msg.headers()))
+                self.log.error("Delivery failed for run %s on %s: %s", run_id, msg.topic(), err)
+            else:
+                stats["delivered"] += 1
+                self.log.debug("Delivered run %s to %s [%s] @%s",
+                               run_id, msg.topic(), msg.partition(), msg.offset())
+            while len(self.runs) > self.keep:
+                self.runs.popitem(last=False)
+        return on_delivery
+
+    def checkpoint(self, producer, timeout: float = 30.0) -> int:
+        """
+        Re-send the failed messages through *producer*, then flush it; returns
+        (and warns about) the messages still queued or failed again.
+        """
+        failed, self.failed = self.failed, []
+        for run_id, topic, key, value, headers in failed:
+            producer.produce_serialized(topic, value, key=key, headers=headers,
+                                        on_delivery=self.callback(run_id))
+        if failed:
+            self.log.warning("Re-sending %s message(s) whose delivery failed", len(failed))
+        remaining = producer.flush(timeout)
+        if remaining:
+            self.log.warning("%s message(s) still undelivered after %ss", remaining, timeout)
+        if self.failed:
+            self.log.error("%s message(s) failed delivery again, offsets held back", len(self.failed))
+        return remaining + len(self.failed)
+
+def create_avro_consumer(group, topics, value_schema_str: str,
+                         payload_store=None, payload_fields=(), auto_commit: bool = True,
+                         settings: dict | None = None):
+    """
+    Returns a subscribed consumer. PayloadRefs found in *payload_fields* are
+    resolved through *payload_store*, so msg.value() always holds the content.
+    Without *auto_commit*, offsets are left to the caller (see AgentRunner).
+    *settings* are extra librdkafka properties (e.g. Metrics.client_settings()).
+    """
+    if OFFLINE:
+        raise RuntimeError("no Kafka consumer without a broker (KAFKA_BOOTSTRAP is empty)")
+    from_dict = None
+    if payload_store is not None and payload_fields:
+        from_dict = lambda obj, ctx: payload_store.resolve(obj, payload_fields)
+
+    def deserializer():
+        from confluent_kafka.schema_registry.avro import AvroDeserializer
+        return AvroDeserializer(_registry(), value_schema_str, from_dict, conf=_serde_conf())
+    deserializer = _once(deserializer)
 
     consumer = DeserializingConsumer({
         "bootstrap.servers": BOOTSTRAP_SERVERS,
         "group.id": group,
         "auto.offset.reset": "earliest",
-        "value.deserializer": value_deserializer,
+        "enable.auto.commit": auto_commit,
+        **(settings or {}),
+        "value.deserializer": lambda data, ctx: deserializer()(data, ctx),
     })
     consumer.subscribe(topics)
+    # build the deserializer (imports, cached schemas) while the group is joined
+    threading.Thread(target=deserializer, name="avro-deserializer", daemon=True).start()
     return consumer
 
-def heartbeat(producer, topic, component):
+def publish_json(topic, obj, key: str | None = None):
+    """Fire-and-forget JSON record on *topic* (metrics and other side channels)."""
+    _plain_producer.produce(topic, json.dumps(obj).encode(), key=key)
+    _plain_producer.poll(0)
+
+def heartbeat(producer, topic, component, stats: dict | None = None):
+    """Liveness record on *topic*; *stats* (see Metrics.snapshot()) ride along."""
     _plain_producer.produce(
         topic,
-        json.dumps({"ts": time.time(), "component": component}).encode()
+        json.dumps({"ts": time.time(), "component": component, **(stats or {})}).encode()
     )
     _plain_producer.poll(0)
 
 # kafka-backed log handler
 class _KafkaLogHandler(logging.Handler):
-    def __init__(self, topic: str, component: str):
-        super().__init__(level=logging.INFO)     # forward INFO and up
+    """
+    emit() only samples and enqueues the record; formatting, JSON encoding
+    and produce() happen on a background thread, one Kafka message (a JSON
+    array of log entries) per batch. When the bounded queue is full, records
+    are dropped and counted instead of blocking the caller; the count is
+    shipped with the next batch.
+    """
+    def __init__(self, topic: str, component: str, settings: dict | None = None):
+        cfg = {**_LOG_DEFAULTS, **(settings or {})}
+        super().__init__(level=cfg["kafka_level"])
         self.topic      = topic
         self.component  = component
+        self.sample     = {logging.getLevelName(k): float(v) for k, v in cfg["sample"].items()}
+        self.batch_size = int(cfg["batch_size"])
+        self.dropped    = 0
+        self._drops     = threading.Lock()   # not self.lock: shutdown() holds it around close()
+        self.queue      = queue.Queue(maxsize=int(cfg["queue_size"]))
+        self._shipper   = threading.Thread(target=self._ship, name=f"log-{component}", daemon=True)
+        self._shipper.start()
 
     def emit(self, record):
-        if record.levelno < logging.INFO:
+        rate = self.sample.get(record.levelno)
+        if rate is not None and random.random() >= rate:
             return
-        payload = {
-            "ts":       record.created,
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._drops:
+                self.dropped += 1
+
+    def _entry(self, ts, level, msg) -> dict:
+        return {
+            "ts":       ts,
             "component": self.component,
-            "level":    record.levelname,
-            "msg":      record.getMessage()
+            "level":    level,
+            "msg":      msg
         }
-        try:
-            _plain_producer.produce(
-                self.topic,
-                json.dumps(payload).encode()
-            )
+
+    def _ship(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                stop = True
+
+            entries = []
+            for record in batch:
+                try:
+                    msg = record.getMessage()
+                except Exception:
+                    msg = str(record.msg)
+                entries.append(self._entry(record.created, record.levelname, msg))
+            with self._drops:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                entries.append(self._entry(time.time(), "WARNING",
+                                           f"{dropped} log record(s) dropped under backpressure"))
+            if not entries:
+                continue
+            try:
+                _plain_producer.produce(self.topic, json.dumps(entries).encode())
+            except BufferError:
+                with self._drops:
+                    self.dropped += len(batch)
+            except Exception as exc:
+                print("KafkaLogHandler error:", exc, file=sys.stderr)
             _plain_producer.poll(0)
-        except Exception as exc:
-            print("KafkaLogHandler error:", exc, file=sys.stderr)
 
+    def close(self):
+        """Ship what is queued (called by logging.shutdown() at exit)."""
+        if self._shipper.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+            except queue.Full:
+                pass
+            self._shipper.join(timeout=5)
+            _plain_producer.flush(5)
+        super().close()
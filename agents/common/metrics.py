@@ -0,0 +1,234 @@
+"""
+Runtime metrics and heartbeats
+──────────────────────────────
+`Metrics` collects an agent's counters, gauges and latency histograms and
+reports them from a background thread, independent of the main loop:
+
+  * every `interval` seconds a heartbeat on the agent's `hb_*` topic
+    (JSON: ts, component, uptime, messages, errors, in_flight, msg_per_s,
+    bytes_in, bytes_out, consumer_lag, rss_bytes, latency percentiles);
+  * with a `port`, the same figures as Prometheus text on
+    http://<host>:<port>/metrics.
+
+Bytes in/out and consumer lag come from librdkafka statistics: pass
+client_settings() to the consumer and producers whose traffic counts.
+The AgentRunner feeds messages, errors, in-flight work and handling times.
+
+Settings come from the `metrics` config section: `default`, overlaid by the
+agent's entry (interval, port, window).
+"""
+
+import http.server, json, os, sys, threading, time
+from collections import deque
+from agents.common.kafka_utils import heartbeat
+
+_DEFAULTS = {
+    "interval": 5.0,                # heartbeat / statistics period, seconds
+    "port":     None,               # Prometheus endpoint (None: off)
+    "window":   1024,               # recent observations kept for percentiles
+}
+
+# handling times range from milliseconds (queries hitting the cache) to
+# minutes (full Eleventy builds)
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, float("inf"))
+PREFIX  = "c2x2w_"
+
+try:
+    _PAGE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE = 4096
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process (peak RSS where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * _PAGE
+    except (OSError, IndexError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _Histogram:
+    def __init__(self, window: int):
+        self.counts = [0] * len(BUCKETS)
+        self.sum    = 0.0
+        self.count  = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum   += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentiles(self, qs=(50, 90, 99)) -> dict:
+        values = sorted(self.recent)
+        if not values:
+            return {}
+        return {f"p{q}": values[min(len(values) - 1, len(values) * q // 100)] for q in qs}
+
+
+class Metrics:
+    def __init__(self, component: str, topic: str | None = None, *,
+                 interval: float = 5.0, port: int | None = None, window: int = 1024):
+        self.component = component
+        self.topic     = topic
+        self.interval  = float(interval)
+        self.port      = int(port) if port else None
+        self.window    = int(window)
+        self.started   = time.time()
+
+        self._counters   = {}               # name → value
+        self._gauges     = {}               # name → value
+        self._histograms = {}               # name → _Histogram
+        self._clients    = {}               # librdkafka client name → {bytes_in, bytes_out, lag}
+        self._lock       = threading.Lock()
+        self._stop       = threading.Event()
+        self._last       = (time.monotonic(), 0)   # for msg_per_s
+
+    @classmethod
+    def from_config(cls, cfg: dict | None, name: str, topic: str | None = None) -> "Metrics":
+        cfg = cfg or {}
+        settings = {**_DEFAULTS, **cfg.get("default", {}), **cfg.get(name, {})}
+        return cls(name, topic, **settings)
+
+    # ─── Recording ────────────────────────────────────────────────────────────
+    def inc(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def set(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = _Histogram(self.window)
+            hist.observe(seconds)
+
+    def client_settings(self) -> dict:
+        """librdkafka settings reporting a client's traffic (and lag) here."""
+        return {"statistics.interval.ms": int(self.interval * 1000),
+                "stats_cb": self.kafka_stats}
+
+    def kafka_stats(self, stats_json: str):
+        """librdkafka `stats_cb`: cumulative bytes per client, lag of consumers."""
+        stats = json.loads(stats_json)
+        client = {"bytes_in": stats.get("rxmsg_bytes", 0) if stats.get("type") == "consumer" else 0,
+                  "bytes_out": stats.get("txmsg_bytes", 0) if stats.get("type") == "producer" else 0,
+                  "lag": 0}
+        for topic in stats.get("topics", {}).values():
+            for partition, p in topic.get("partitions", {}).items():
+                # behind the committed offset, or the stored one before a first commit
+                lag = max(p.get("consumer_lag", -1), p.get("consumer_lag_stored", -1))
+                if partition != "-1" and lag > 0:
+                    client["lag"] += lag
+        with self._lock:
+            self._clients[stats.get("name", "")] = client
+
+    # ─── Reporting ────────────────────────────────────────────────────────────
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges   = dict(self._gauges)
+            latency  = {name: {"count": h.count,
+                               **{p: round(v * 1000, 1) for p, v in h.percentiles().items()}}
+                        for name, h in self._histograms.items()}
+            clients  = list(self._clients.values())
+
+        now, messages = time.monotonic(), counters.get("messages", 0)
+        last_t, last_n = self._last
+        self._last = (now, messages)
+        return {
+            "ts":           time.time(),
+            "component":    self.component,
+            "uptime_s":     round(time.time() - self.started, 1),
+            **counters,
+            **gauges,
+            "msg_per_s":    round((messages - last_n) / max(now - last_t, 1e-6), 3),
+            "bytes_in":     sum(c["bytes_in"] for c in clients),
+            "bytes_out":    sum(c["bytes_out"] for c in clients),
+            "consumer_lag": sum(c["lag"] for c in clients),
+            "rss_bytes":    rss_bytes(),
+            "latency_ms":   latency,
+        }
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition (format 0.0.4)."""
+        label = f'component="{self.component}"'
+        with self._lock:
+            counters = dict(self._counters)
+            gauges   = dict(self._gauges)
+            hists    = {n: (list(h.counts), h.sum, h.count) for n, h in self._histograms.items()}
+            clients  = list(self._clients.values())
+        counters["bytes_in"]  = sum(c["bytes_in"] for c in clients)
+        counters["bytes_out"] = sum(c["bytes_out"] for c in clients)
+        gauges["consumer_lag"]   = sum(c["lag"] for c in clients)
+        gauges["rss_bytes"]      = rss_bytes()
+        gauges["uptime_seconds"] = round(time.time() - self.started, 1)
+
+        lines = []
+        for name, value in sorted(counters.items()):
+            lines += [f"# TYPE {PREFIX}{name}_total counter",
+                      f"{PREFIX}{name}_total{{{label}}} {value}"]
+        for name, value in sorted(gauges.items()):
+            lines += [f"# TYPE {PREFIX}{name} gauge",
+                      f"{PREFIX}{name}{{{label}}} {value}"]
+        for name, (counts, total, count) in sorted(hists.items()):
+            lines.append(f"# TYPE {PREFIX}{name}_seconds histogram")
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{PREFIX}{name}_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+            lines += [f"{PREFIX}{name}_seconds_sum{{{label}}} {total}",
+                      f"{PREFIX}{name}_seconds_count{{{label}}} {count}"]
+        return "\n".join(lines) + "\n"
+
+    # ─── Background reporting ─────────────────────────────────────────────────
+    def start(self) -> "Metrics":
+        threading.Thread(target=self._beat, name=f"metrics-{self.component}", daemon=True).start()
+        if self.port:
+            server = http.server.ThreadingHTTPServer(("", self.port), self._handler())
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _beat(self):
+        while True:
+            if self.topic:
+                try:
+                    heartbeat(None, self.topic, self.component, self.snapshot())
+                except Exception as exc:        # never let reporting kill the thread
+                    print("Metrics heartbeat error:", exc, file=sys.stderr)
+            if self._stop.wait(self.interval):
+                return
+
+    def _handler(self):
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):   # scrapes are not worth a log line
+                pass
+
+        return Handler
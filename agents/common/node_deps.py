@@ -0,0 +1,59 @@
+"""
+Node dependencies of the templates
+──────────────────────────────────
+Resolved at image build: `npm ci` of templates/package-lock.json into
+/opt/node_modules (NODE_PATH), stamped with the lockfile's sha256:
+
+    /opt/node_modules/.lock-sha256
+
+At start the web builder only compares that stamp with the lockfile of the
+(bind-mounted) templates. When they differ, `npm ci` runs once into
+
+    <node_cache>/<sha256>/node_modules
+
+which every later start with the same lockfile reuses.
+"""
+
+import hashlib, os, shutil, subprocess
+from pathlib import Path
+
+STAMP = ".lock-sha256"
+LOCK  = "package-lock.json"
+
+
+def lock_hash(templates: str | Path) -> str:
+    return hashlib.sha256((Path(templates) / LOCK).read_bytes()).hexdigest()
+
+
+def _stamped(node_modules: Path, digest: str) -> bool:
+    try:
+        return (node_modules / STAMP).read_text().strip() == digest
+    except OSError:
+        return False
+
+
+def resolve(templates: str | Path, cache: str | Path, log) -> Path:
+    """node_modules matching the lockfile of *templates* (for NODE_PATH)."""
+    digest = lock_hash(templates)
+    built  = [Path(p) for p in os.environ.get("NODE_PATH", "").split(os.pathsep) if p]
+    cached = Path(cache) / digest / "node_modules"
+    for node_modules in (*built, cached):
+        if _stamped(node_modules, digest):
+            return node_modules
+
+    log.warning("No node_modules for %s %s, installing into %s", LOCK, digest[:12], cached.parent)
+    tmp = Path(cache) / f".tmp-{digest}-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    try:
+        for name in ("package.json", LOCK):
+            shutil.copy(Path(templates) / name, tmp / name)
+        subprocess.check_call(["npm", "ci", "--omit=dev", "--no-audit", "--no-fund"], cwd=tmp)
+        (tmp / "node_modules" / STAMP).write_text(digest)
+        os.replace(tmp, cached.parent)
+    except OSError:
+        if not _stamped(cached, digest):    # not a concurrent install of the same lockfile
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return cached
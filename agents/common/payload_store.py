@@ -0,0 +1,210 @@
+"""
+Claim-check payload store
+─────────────────────────
+Large payloads (SPARQL results, sitemaps) are written once into a
+content-addressed, compressed store and Kafka records only carry a
+reference: `{digest, size, codec}`. Payloads smaller than
+`inline_threshold` bytes keep travelling inline as plain strings.
+
+Layout of the filesystem backend (defined in base_config.yaml):
+    /runs/_payloads/<digest[:2]>/<digest>.<codec>
+"""
+
+import gzip, hashlib, os, tempfile, zlib
+from pathlib import Path
+
+CHUNK_SIZE = 1 << 20
+
+# Avro definition of a reference, used as second branch of a
+# ["string", PayloadRef] union in the record schemas.
+PAYLOAD_REF_SCHEMA = '''
+{
+  "type":"record",
+  "name":"PayloadRef",
+  "fields":[
+    {"name":"digest","type":"string"},
+    {"name":"size",  "type":"long"},
+    {"name":"codec", "type":"string"}
+  ]
+}
+'''
+
+CODECS = {
+    "gzip": (lambda b: gzip.compress(b, mtime=0), gzip.decompress),
+    "none": (lambda b: b, lambda b: b),
+}
+
+# Incremental compressors, for payloads that should never be held in memory
+STREAM_CODECS = {
+    "gzip": lambda: zlib.compressobj(6, zlib.DEFLATED, 31),   # wbits 31 → gzip framing
+    "none": None,
+}
+
+
+def _iter_file(path: Path, chunk_size: int = CHUNK_SIZE):
+    with open(path, "rb") as fh:
+        while chunk := fh.read(chunk_size):
+            yield chunk
+
+
+def is_ref(value) -> bool:
+    return isinstance(value, dict) and {"digest", "size", "codec"} <= value.keys()
+
+
+class FilesystemBackend:
+    """Stores blobs as files below *root*, fanned out on the first 2 chars."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def touch(self, key: str):
+        """Mark a blob as used now (see RunStore.collect_blobs)."""
+        os.utime(self._path(key))
+
+    def size(self, key: str) -> int:
+        return self._path(key).stat().st_size
+
+    def scan(self):
+        """(key, mtime) of every blob."""
+        for path in self.root.glob("??/*"):
+            if not path.name.startswith("."):
+                yield path.name, path.stat().st_mtime
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def put(self, key: str, data: bytes):
+        self.put_stream(key, [data])
+
+    def put_stream(self, key: str, chunks):
+        path = self._path(key)
+        if path.exists():                 # content-addressed → already there
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write + rename so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in chunks:
+                    fh.write(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def get(self, key: str) -> bytes:
+        return self._path(key).read_bytes()
+
+    def open(self, key: str):
+        return open(self._path(key), "rb")
+
+
+BACKENDS = {"filesystem": FilesystemBackend}
+
+
+class PayloadStore:
+    def __init__(self, backend, codec: str = "gzip", inline_threshold: int = 64 * 1024):
+        if codec not in CODECS:
+            raise ValueError(f"unknown payload codec {codec!r}")
+        self.backend          = backend
+        self.codec            = codec
+        self.inline_threshold = inline_threshold
+
+    @classmethod
+    def from_config(cls, cfg: dict | None) -> "PayloadStore":
+        cfg = cfg or {}
+        backend_cls = BACKENDS[cfg.get("backend", "filesystem")]
+        return cls(
+            backend_cls(cfg.get("root", "/runs/_payloads")),
+            codec=cfg.get("codec", "gzip"),
+            inline_threshold=int(cfg.get("inline_threshold", 64 * 1024)),
+        )
+
+    # ─── Single payloads ──────────────────────────────────────────────────────
+    def put(self, text: str) -> dict:
+        """Store *text*, return its reference."""
+        data   = text.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        key    = f"{digest}.{self.codec}"
+        if self.backend.exists(key):
+            self.backend.touch(key)
+        else:
+            compress, _ = CODECS[self.codec]
+            self.backend.put(key, compress(data))
+        return {"digest": digest, "size": len(data), "codec": self.codec}
+
+    def ref_for_file(self, path: str | Path) -> dict:
+        """The reference of the file at *path*, without storing it."""
+        sha  = hashlib.sha256()
+        size = 0
+        for chunk in _iter_file(Path(path)):
+            sha.update(chunk)
+            size += len(chunk)
+        return {"digest": sha.hexdigest(), "size": size, "codec": self.codec}
+
+    def put_file(self, path: str | Path) -> dict:
+        """Store the file at *path* chunk by chunk, return its reference."""
+        ref = self.ref_for_file(path)
+        key = f"{ref['digest']}.{self.codec}"
+        if self.backend.exists(key):
+            self.backend.touch(key)
+        else:
+            self.backend.put_stream(key, self._compress_stream(_iter_file(Path(path))))
+        return ref
+
+    def value_for_file(self, path: str | Path):
+        """Record value for a file: its text below the inline threshold, else a reference."""
+        path = Path(path)
+        if path.stat().st_size < self.inline_threshold:
+            return path.read_text()
+        return self.put_file(path)
+
+    def _compress_stream(self, chunks):
+        factory = STREAM_CODECS[self.codec]
+        if factory is None:
+            yield from chunks
+            return
+        comp = factory()
+        for chunk in chunks:
+            yield comp.compress(chunk)
+        yield comp.flush()
+
+    def get(self, ref: dict) -> str:
+        """Fetch and decompress the payload behind *ref*."""
+        _, decompress = CODECS[ref["codec"]]
+        data = decompress(self.backend.get(f"{ref['digest']}.{ref['codec']}"))
+        if len(data) != ref["size"]:
+            raise ValueError(f"payload {ref['digest']} is {len(data)} bytes, expected {ref['size']}")
+        return data.decode()
+
+    def open(self, ref: dict):
+        """Binary file object streaming the decompressed payload behind *ref*."""
+        raw = self.backend.open(f"{ref['digest']}.{ref['codec']}")
+        return gzip.GzipFile(fileobj=raw) if ref["codec"] == "gzip" else raw
+
+    # ─── Whole records (used as Avro to_dict / from_dict hooks) ──────────────
+    def offload(self, record: dict, fields) -> dict:
+        """Replace large *fields* of *record* by references."""
+        out = dict(record)
+        for f in fields:
+            value = out.get(f)
+            # the threshold is in bytes: a str of fewer characters can still reach it encoded
+            if isinstance(value, str) and (len(value) >= self.inline_threshold
+                                           or len(value.encode()) >= self.inline_threshold):
+                out[f] = self.put(value)
+        return out
+
+    def resolve(self, record: dict, fields) -> dict:
+        """Replace references in *fields* of *record* by their content."""
+        if record is None:
+            return record
+        for f in fields:
+            if is_ref(record.get(f)):
+                record[f] = self.get(record[f])
+        return record
@@ -0,0 +1,123 @@
+"""
+Persistent SPARQL result cache
+──────────────────────────────
+Results are cached on disk, keyed by a hash of the expanded query text, the
+endpoint and the query parameters. Each entry is two files:
+
+    <root>/<key>.xml    ← raw SPARQL results (hardlinked to/from run dirs)
+    <root>/<key>.json   ← {created, expires, count, size}, mtime = last use
+
+Expiry follows per-query rules from base_config.yaml (`sparql_queries.*.cache`):
+results for dates older than `immutable_after_days` never expire, more
+recent ones live for `ttl` seconds (0 → not cached). The whole store is kept
+under `max_bytes` by evicting the least recently used entries.
+"""
+
+import hashlib, json, os, shutil, threading, time
+from datetime import date, timedelta
+from pathlib import Path
+
+
+def _link_or_copy(src: Path, dst: Path):
+    # via a private name + rename: concurrent runs may store the same key
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError:                        # other filesystem → plain copy
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class QueryCache:
+    def __init__(self, root: str | Path, max_bytes: int = 2 << 30):
+        self.root      = Path(root)
+        self.max_bytes = max_bytes
+        self.hits      = 0
+        self.misses    = 0
+        self._lock     = threading.Lock()   # counted from the runner's worker threads
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, cfg: dict | None) -> "QueryCache":
+        cfg = cfg or {}
+        return cls(cfg.get("root", "/runs/_cache/sparql"),
+                   max_bytes=int(cfg.get("max_bytes", 2 << 30)))
+
+    @staticmethod
+    def key(query: str, endpoint: str, params: dict) -> str:
+        blob = json.dumps({"query": query, "endpoint": endpoint, "params": params},
+                          sort_keys=True)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    @staticmethod
+    def expiry(rules: dict | None, date_param: str | None) -> float | None:
+        """
+        Return the expiry timestamp of a fresh entry, None if it never
+        expires, or 0 if it should not be cached at all.
+        """
+        rules = rules or {}
+        immutable_after = rules.get("immutable_after_days")
+        if immutable_after is not None and date_param:
+            if date.fromisoformat(date_param) < date.today() - timedelta(days=int(immutable_after)):
+                return None
+        ttl = int(rules.get("ttl", 0))
+        return time.time() + ttl if ttl > 0 else 0
+
+    # ─── Lookup / store ───────────────────────────────────────────────────────
+    def get(self, key: str, dest: Path) -> dict | None:
+        """On a hit, link the cached results to *dest* and return the entry."""
+        meta_path = self.root / f"{key}.json"
+        data_path = self.root / f"{key}.xml"
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (FileNotFoundError, ValueError):
+            self._count(hit=False)
+            return None
+        if (meta["expires"] is not None and meta["expires"] < time.time()) \
+                or not data_path.exists():
+            self._drop(key)
+            self._count(hit=False)
+            return None
+
+        _link_or_copy(data_path, dest)
+        os.utime(meta_path)                # LRU bookkeeping
+        self._count(hit=True)
+        return meta
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key: str, results: Path, count: int, expires: float | None):
+        if expires == 0:
+            return
+        _link_or_copy(results, self.root / f"{key}.xml")
+        meta = {"created": time.time(), "expires": expires,
+                "count": count, "size": results.stat().st_size}
+        tmp  = self.root / f".{key}.json.{os.getpid()}.{threading.get_ident()}"
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.root / f"{key}.json")
+        self._evict()
+
+    def _drop(self, key: str):
+        for suffix in (".json", ".xml"):
+            (self.root / f"{key}{suffix}").unlink(missing_ok=True)
+
+    def _evict(self):
+        entries = []
+        for meta_path in self.root.glob("*.json"):
+            data_path = meta_path.with_suffix(".xml")
+            try:
+                entries.append((meta_path.stat().st_mtime, data_path.stat().st_size, meta_path.stem))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._drop(key)
+            total -= size
@@ -0,0 +1,138 @@
+"""
+Cross-run result deltas
+───────────────────────
+The query agent fingerprints each run's SPARQL results and compares them with
+the previous run of the same date and collection (the one SeenDates points
+to):
+
+    /runs/<run_id>/fingerprints.json  ← {"document": sha256, "elis": {<eli>: sha256}}
+    /runs/<run_id>/delta.json         ← {"previous_run_id", "added": [eli…],
+                                         "changed": […], "removed": […], "unchanged": n,
+                                         "same_document": bool}
+
+An ELI's hash covers the bindings of its results in document order (values,
+kinds, languages and datatypes; binding order does not matter). The document hash
+covers every result in order, those without an ELI too: the sitemap is a
+function of that sequence (see the creator quirk in sitemap_stream), so only
+an identical document lets the later stages reuse the previous run's output.
+
+Downstream records carry the counts (`delta`); the lists stay in delta.json.
+"""
+
+import hashlib, json
+import lxml.etree as ET
+from pathlib import Path
+from agents.common import result_rows
+
+FINGERPRINTS = "fingerprints.json"
+DELTA        = "delta.json"
+
+SPARQL_NS = "http://www.w3.org/2005/sparql-results#"
+_RESULT   = f"{{{SPARQL_NS}}}result"
+_LITERAL  = f"{{{SPARQL_NS}}}literal"
+_XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+# Avro type of the `delta` field (a ["null", Delta] union, default null)
+DELTA_SCHEMA = '''
+{
+  "type":"record",
+  "name":"Delta",
+  "fields":[
+    {"name":"previous_run_id","type":"string"},
+    {"name":"added",          "type":"long"},
+    {"name":"changed",        "type":"long"},
+    {"name":"removed",        "type":"long"},
+    {"name":"unchanged",      "type":"long"},
+    {"name":"same_document",  "type":"boolean"}
+  ]
+}
+'''
+
+
+def _result_key(result) -> tuple[str | None, bytes]:
+    """(eli, canonical bytes) of one <result>."""
+    eli, values = None, []
+    for binding in result:
+        name = binding.get("name")
+        for value in binding:
+            tag = ET.QName(value).localname
+            values.append((name, tag, value.get(_XML_LANG) or "", value.get("datatype") or "",
+                           value.text or ""))
+            if name == "eli" and value.tag == _LITERAL and eli is None:
+                eli = value.text or ""
+    return eli, json.dumps(sorted(values), ensure_ascii=False).encode()
+
+
+def _xml_keys(source):
+    for _, result in ET.iterparse(source, events=("end",), tag=_RESULT):
+        yield _result_key(result)
+        result.clear()
+        while result.getprevious() is not None:
+            del result.getparent()[0]
+
+
+def _row_keys(source):
+    # same keys as _result_key(): the fingerprints do not depend on the format
+    for row in result_rows.rows(source):
+        values = [(name, result_rows.KINDS[kind], lang, datatype, value or "")
+                  for name, (kind, value, lang, datatype) in row.items()]
+        eli    = row.get("eli")
+        yield (eli[1] or "" if eli and eli[0] == "l" else None,
+               json.dumps(sorted(values), ensure_ascii=False).encode())
+
+
+def fingerprint(source) -> dict:
+    """
+    {"document": sha256, "elis": {eli: sha256}} of *source*, SPARQL XML or
+    a row batch file (result_rows, by its suffix).
+    """
+    document, elis = hashlib.sha256(), {}
+    keys = _row_keys if str(source).endswith(result_rows.SUFFIX) else _xml_keys
+    for eli, key in keys(source):
+        digest   = hashlib.sha256(key).digest()
+        document.update(digest)
+        if eli is not None:
+            elis.setdefault(eli, hashlib.sha256()).update(digest)
+    return {"document": document.hexdigest(),
+            "elis": {eli: h.hexdigest() for eli, h in elis.items()}}
+
+
+def compare(old: dict, new: dict) -> dict:
+    """Added, changed and removed ELIs of *new* against *old*, and the unchanged count."""
+    old_elis, new_elis = old["elis"], new["elis"]
+    return {
+        "added":         sorted(e for e in new_elis if e not in old_elis),
+        "changed":       sorted(e for e, h in new_elis.items() if e in old_elis and old_elis[e] != h),
+        "removed":       sorted(e for e in old_elis if e not in new_elis),
+        "unchanged":     sum(1 for e, h in new_elis.items() if old_elis.get(e) == h),
+        "same_document": old["document"] == new["document"],
+    }
+
+
+def record(run_dir: Path, results: Path, previous_dir: Path | None) -> dict | None:
+    """
+    Fingerprint run_dir's *results* and, when *previous_dir* has fingerprints,
+    write delta.json; returns the `delta` record field (None: nothing to compare).
+    """
+    prints = fingerprint(str(results))
+    (run_dir / FINGERPRINTS).write_text(json.dumps(prints))
+    if previous_dir is None:
+        return None
+    try:
+        old = json.loads((previous_dir / FINGERPRINTS).read_text())
+    except (OSError, ValueError):
+        return None
+    delta = {"previous_run_id": previous_dir.name, **compare(old, prints)}
+    (run_dir / DELTA).write_text(json.dumps(delta, indent=1))
+    return summary(delta)
+
+
+def summary(delta: dict) -> dict:
+    return {"previous_run_id": delta["previous_run_id"],
+            **{k: len(delta[k]) for k in ("added", "changed", "removed")},
+            "unchanged": delta["unchanged"], "same_document": delta["same_document"]}
+
+
+def unchanged(delta: dict | None) -> bool:
+    """The results are those of the previous run, to the byte that matters."""
+    return bool(delta and delta["same_document"])
@@ -0,0 +1,338 @@
+"""
+Compact intermediate results
+────────────────────────────
+SPARQL results fetched as JSON (application/sparql-results+json) or TSV
+(text/tab-separated-values) are streamed into a row batch file instead of
+being kept as SPARQL XML:
+
+    /runs/<run_id>/sparql_results.rows
+
+One JSON document per line: a header, then batches of up to `batch_size`
+results stored by column:
+
+    {"format": "c2x-rows", "version": 1, "vars": ["act", "eli", …], "interned": ["oj_collection", …]}
+    {"n": 4096, "strings": [new interned strings], "columns": {"eli": {"kind": "llll…", "value": […]}, …}}
+
+  * kind: one letter per row, u(ri), l(iteral), b(node) or - (unbound);
+  * lang, datatype: per-row lists, present only when a row of the batch has one;
+  * interned columns (INTERNED: the few URIs repeated on every row) hold
+    indexes into the file's string table, which each batch extends with the
+    strings it introduces.
+
+Reading a batch is one json.loads, with no tree to build: `read()` yields
+batches (interned values resolved), `rows()` one result at a time. `write_xml()`
+turns a row file back into SPARQL XML, for the XSLT engine.
+"""
+
+import codecs, json, re
+import lxml.etree as ET
+
+FORMAT     = "c2x-rows"
+VERSION    = 1
+SUFFIX     = ".rows"
+BATCH_SIZE = 4096
+INTERNED   = ("oj_collection", "resource_type", "creating_agents")
+
+SPARQL_NS  = "http://www.w3.org/2005/sparql-results#"
+KINDS      = {"u": "uri", "l": "literal", "b": "bnode"}
+XSD        = "http://www.w3.org/2001/XMLSchema#"
+
+# a term: (kind letter, value, lang, datatype), "" for no lang / datatype
+
+
+class RowWriter:
+    """Rows ({var: term}) → row batch file, on the binary file *out*."""
+
+    def __init__(self, out, variables, interned=INTERNED, batch_size: int = BATCH_SIZE):
+        self.out        = out
+        self.vars       = list(variables)
+        self.interned   = [v for v in self.vars if v in interned]
+        self.batch_size = int(batch_size)
+        self.strings    = {}                # interned string → index
+        self.pending    = []
+        self.count      = 0
+        self._line({"format": FORMAT, "version": VERSION,
+                    "vars": self.vars, "interned": self.interned})
+
+    def _line(self, doc: dict):
+        self.out.write(json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode())
+        self.out.write(b"\n")
+
+    def add(self, row: dict):
+        self.pending.append(row)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        rows = self.pending
+        if not rows:
+            return
+        new, columns = [], {}
+        for var in self.vars:
+            terms = [row.get(var) for row in rows]
+            if all(t is None for t in terms):
+                continue
+            values = [t and t[1] for t in terms]
+            if var in self.interned:
+                for i, value in enumerate(values):
+                    if value is not None:
+                        index = self.strings.get(value)
+                        if index is None:
+                            index = self.strings[value] = len(self.strings)
+                            new.append(value)
+                        values[i] = index
+            column = {"kind": "".join(t[0] if t else "-" for t in terms), "value": values}
+            langs  = [t[2] if t else "" for t in terms]
+            types  = [t[3] if t else "" for t in terms]
+            if any(langs):
+                column["lang"] = langs
+            if any(types):
+                column["datatype"] = types
+            columns[var] = column
+        self._line({"n": len(rows), "strings": new, "columns": columns})
+        self.count  += len(rows)
+        self.pending = []
+
+    def close(self) -> int:
+        """Write the last batch; returns the row count."""
+        self.flush()
+        return self.count
+
+
+# ─── Parsing responses ────────────────────────────────────────────────────────
+_JSON_KINDS = {"uri": "u", "literal": "l", "typed-literal": "l", "bnode": "b"}
+_BINDINGS   = re.compile(r'"bindings"\s*:\s*\[')
+_VARS       = re.compile(r'"vars"\s*:\s*')
+_SEPARATOR  = re.compile(r"[\s,]*")
+
+
+class JsonParser:
+    """
+    Incremental reader of application/sparql-results+json: feed() response
+    chunks, each complete binding object goes to a RowWriter on *out*.
+    The head (`vars`) must come before the bindings, as endpoints send it.
+    """
+
+    def __init__(self, out, **writer_args):
+        self.out, self.writer_args = out, writer_args
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json    = json.JSONDecoder()
+        self.buf     = ""
+        self.writer  = None
+        self.done    = False
+
+    def feed(self, chunk: bytes):
+        self.buf += self.decoder.decode(chunk)
+        self._parse()
+
+    def _parse(self):
+        buf, pos = self.buf, 0
+        if self.writer is None:
+            start = _BINDINGS.search(buf)
+            if start is None:
+                return
+            head = _VARS.search(buf, 0, start.start())
+            if head is None:
+                raise ValueError("SPARQL JSON results without head.vars before the bindings")
+            names, _ = self.json.raw_decode(buf, head.end())
+            self.writer = RowWriter(self.out, names, **self.writer_args)
+            pos = start.end()
+        while not self.done:
+            pos = _SEPARATOR.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            if buf[pos] == "]":
+                self.done = True
+                break
+            try:
+                binding, pos = self.json.raw_decode(buf, pos)
+            except ValueError:
+                break                       # cut by the chunk: wait for more
+            self.writer.add({var: (_JSON_KINDS[v["type"]], v["value"],
+                                   v.get("xml:lang", ""), v.get("datatype", ""))
+                             for var, v in binding.items()})
+        self.buf = buf[pos:]
+
+    def close(self) -> int:
+        """Finish the file; returns the row count."""
+        self.buf += self.decoder.decode(b"", final=True)
+        self._parse()
+        if not self.done:
+            raise ValueError("Truncated or invalid SPARQL JSON results")
+        return self.writer.close()
+
+
+_TSV_ESCAPE = re.compile(r"\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)")
+_TSV_CHARS  = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f"}
+_TSV_NUMBER = [(re.compile(r"[+-]?\d+"), XSD + "integer"),
+               (re.compile(r"[+-]?\d*\.\d+"), XSD + "decimal"),
+               (re.compile(r"[+-]?(\d+\.?\d*|\.\d+)[eE][+-]?\d+"), XSD + "double")]
+
+
+def _unescape(text: str) -> str:
+    if "\\" not in text:
+        return text
+    return _TSV_ESCAPE.sub(lambda m: chr(int(m.group(1)[1:], 16)) if len(m.group(1)) > 1
+                           else _TSV_CHARS.get(m.group(1), m.group(1)), text)
+
+
+def tsv_term(cell: str):
+    """A text/tab-separated-values cell (Turtle syntax) → term, None when unbound."""
+    if not cell:
+        return None
+    if cell[0] == "<":
+        return ("u", _unescape(cell[1:-1]), "", "")
+    if cell.startswith("_:"):
+        return ("b", cell[2:], "", "")
+    if cell[0] == '"':
+        end  = cell.rindex('"')
+        rest = cell[end + 1:]
+        return ("l", _unescape(cell[1:end]), rest[1:] if rest.startswith("@") else "",
+                rest[3:-1] if rest.startswith("^^<") else "")
+    if cell in ("true", "false"):
+        return ("l", cell, "", XSD + "boolean")
+    for pattern, datatype in _TSV_NUMBER:
+        if pattern.fullmatch(cell):
+            return ("l", cell, "", datatype)
+    raise ValueError(f"Unreadable TSV term {cell[:80]!r}")
+
+
+class TsvParser:
+    """Incremental reader of text/tab-separated-values results, like JsonParser."""
+
+    def __init__(self, out, **writer_args):
+        self.out, self.writer_args = out, writer_args
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf     = ""
+        self.writer  = None
+
+    def feed(self, chunk: bytes):
+        lines    = (self.buf + self.decoder.decode(chunk)).split("\n")
+        self.buf = lines.pop()
+        self._lines(lines)
+
+    def _lines(self, lines):
+        for line in lines:
+            line = line.rstrip("\r")
+            if self.writer is None:
+                self.names  = [v.lstrip("?$") for v in line.split("\t")]
+                self.writer = RowWriter(self.out, self.names, **self.writer_args)
+            elif line:
+                row = {}
+                for var, cell in zip(self.names, line.split("\t")):
+                    term = tsv_term(cell)
+                    if term is not None:
+                        row[var] = term
+                self.writer.add(row)
+
+    def close(self) -> int:
+        tail = self.buf + self.decoder.decode(b"", final=True)
+        self._lines([tail] if tail else [])
+        if self.writer is None:
+            raise ValueError("Empty TSV results: no header line")
+        return self.writer.close()
+
+
+PARSERS = {"json": JsonParser, "tsv": TsvParser}
+
+
+# ─── Reading ──────────────────────────────────────────────────────────────────
+def _lines(source):
+    """Lines of *source*: a path or a binary file (left open)."""
+    if hasattr(source, "read"):
+        yield from source
+    else:
+        with open(source, "rb") as fh:
+            yield from fh
+
+
+def _batches(lines, interned):
+    table = []
+    for line in lines:
+        batch = json.loads(line)
+        table.extend(batch["strings"])
+        columns = batch["columns"]
+        for var in interned:
+            column = columns.get(var)
+            if column is not None:
+                column["value"] = [None if i is None else table[i] for i in column["value"]]
+        yield batch["n"], columns
+
+
+def read(source):
+    """(vars, batches) of *source*; a batch is (n, columns), interned values as strings."""
+    lines  = _lines(source)
+    header = json.loads(next(lines, b"{}"))
+    if header.get("format") != FORMAT or header.get("version") != VERSION:
+        raise ValueError(f"Not a {FORMAT} v{VERSION} row file")
+    return header["vars"], _batches(lines, header["interned"])
+
+
+def rows(source):
+    """{var: term} per result of *source*, unbound variables left out."""
+    _, data = read(source)
+    for n, columns in data:
+        cols = [(var, c["kind"], c["value"], c.get("lang"), c.get("datatype"))
+                for var, c in columns.items()]
+        for i in range(n):
+            yield {var: (kind[i], value[i], lang[i] if lang else "", types[i] if types else "")
+                   for var, kind, value, lang, types in cols if kind[i] != "-"}
+
+
+def merge(pages, dest) -> int:
+    """Concatenate the row files *pages* (in order) into *dest*; returns the row count."""
+    with open(dest, "wb") as out:
+        writer = RowWriter(out, read(pages[0])[0] if pages else [])
+        for page in pages:
+            for row in rows(page):
+                writer.add(row)
+        return writer.close()
+
+
+# ─── SPARQL XML ───────────────────────────────────────────────────────────────
+def _attr(text: str) -> str:
+    # libxml2's attribute serializer
+    return (text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+                .replace('"', "&quot;").replace("\n", "&#10;").replace("\r", "&#13;")
+                .replace("\t", "&#9;"))
+
+
+def literal_xml(text: str, lang: str = "", datatype: str = "") -> str:
+    """The <literal> as lxml serializes one taken from a SPARQL XML document."""
+    attrs = f' xml:lang="{_attr(lang)}"' if lang else ""
+    if datatype:
+        attrs += f' datatype="{_attr(datatype)}"'
+    head  = f'<literal xmlns="{SPARQL_NS}"{attrs}'
+    if not text:
+        return head + "/>"
+    return head + ">" + (text.replace("&", "&amp;").replace("<", "&lt;")
+                         .replace(">", "&gt;").replace("\r", "&#13;")) + "</literal>"
+
+
+def write_xml(source, dest):
+    """*source* (a row file) as a SPARQL XML results document at *dest* (path or binary file)."""
+    ns, lang    = f"{{{SPARQL_NS}}}", "{http://www.w3.org/XML/1998/namespace}lang"
+    names, data = read(source)
+    with ET.xmlfile(dest, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element(ns + "sparql", nsmap={None: SPARQL_NS}):
+            head = ET.Element(ns + "head", nsmap={None: SPARQL_NS})
+            for var in names:
+                ET.SubElement(head, ns + "variable", name=var)
+            xf.write(head)
+            with xf.element(ns + "results"):
+                for n, columns in data:
+                    for i in range(n):
+                        result = ET.Element(ns + "result", nsmap={None: SPARQL_NS})
+                        for var, c in columns.items():
+                            kind = c["kind"][i]
+                            if kind == "-":
+                                continue
+                            value = ET.SubElement(ET.SubElement(result, ns + "binding", name=var),
+                                                  ns + KINDS[kind])
+                            value.text = c["value"][i]
+                            if c.get("lang") and c["lang"][i]:
+                                value.set(lang, c["lang"][i])
+                            if c.get("datatype") and c["datatype"][i]:
+                                value.set("datatype", c["datatype"][i])
+                        xf.write(result)
@@ -0,0 +1,425 @@
+"""
+Run store
+─────────
+Index and retention of what runs leave behind:
+
+    /runs/<run_id>/            sparql_query.rdf, sparql_results.xml (pages/),
+                               sitemap*.xml, site.tar.gz, build/, timings.json
+    <web.output_dir>/<run_id>/ the site, staged for promotion
+
+  * Index: /runs/_index.sqlite holds one row per run (date, collection,
+    status, storage, sizes, total time) with its stages (status, handle
+    time, error) and artifacts. The query agent opens a run, the
+    AgentRunner records each stage, the web builder seals the run and the
+    web agent marks promotions. Runs are listed and looked up there, not by
+    scanning directories (`runs()`, `get()`, the web agent's /_runs).
+  * Artifacts: sealing a run records its files (digest, size); packing it
+    puts them into the content-addressed payload store (/runs/_payloads,
+    gzip at rest, archives as they are), so runs that produced the same
+    bytes share one blob and an expanded run is never stored twice.
+  * Retention (`retain()`, opt-in: from the web builder every `interval`
+    seconds with `enabled: true`, or by hand with the CLI below): per date, the `expanded` newest complete runs keep their files; older
+    ones are packed, keeping only timings.json and artifacts.json (their
+    build/ and site dir go too; `restore()` brings them back). Runs beyond
+    `keep_per_date` (failed ones first) are deleted, except promoted ones. Runs younger than
+    `min_age` and runs a backfill still reads are left alone. Blobs no run
+    refers to are deleted once unused for `blob_grace` seconds, as Kafka
+    records may still point at them.
+
+An index that cannot be written is logged and never fails a message.
+
+    python -m agents.common.run_store list [--date 2025-06-20]
+    python -m agents.common.run_store show|restore <run_id>
+    python -m agents.common.run_store retain [--dry-run] | reindex
+"""
+
+import argparse, json, logging, os, shutil, sqlite3, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+from agents.common import site_archive
+from agents.common.backfill import referenced_runs
+from agents.common.payload_store import PayloadStore
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id       TEXT PRIMARY KEY,
+    date         TEXT,
+    end_date     TEXT NOT NULL DEFAULT '',   -- backfill sites: the last date
+    collection   TEXT,
+    backfill_id  TEXT NOT NULL DEFAULT '',
+    created      REAL,
+    updated      REAL,
+    status       TEXT,                       -- running | failed | done
+    storage      TEXT,                       -- files | packed | pruned
+    promoted     REAL,
+    bytes        INTEGER,                    -- artifacts, as written
+    stored_bytes INTEGER,                    -- their blobs
+    total_ms     REAL
+);
+CREATE INDEX IF NOT EXISTS runs_by_date ON runs (date, end_date, created);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id    TEXT,
+    component TEXT,
+    status    TEXT,
+    finished  REAL,
+    ms        REAL,
+    error     TEXT,
+    PRIMARY KEY (run_id, component)
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    run_id TEXT,
+    name   TEXT,                             -- path in the run dir
+    digest TEXT,
+    size   INTEGER,
+    codec  TEXT,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS artifacts_by_blob ON artifacts (digest, codec);
+"""
+
+MANIFEST   = "artifacts.json"
+KEPT       = ("timings.json", MANIFEST)    # stay in a packed run dir
+SKIPPED    = ("build",)                    # the site again: site.tar.gz has it
+COMPRESSED = (".gz", ".zst", ".tgz")       # stored as they are
+
+
+class RunStore:
+    def __init__(self, runs_dir: str | Path, payloads: PayloadStore, *,
+                 index: str | Path | None = None, sites: str | Path | None = None,
+                 keep_per_date: int = 5, expanded: int = 1, min_age: float = 86400,
+                 blob_grace: float = 7 * 86400, interval: float = 3600, enabled: bool = False):
+        self.runs_dir      = Path(runs_dir)
+        self.index         = Path(index) if index else self.runs_dir / "_index.sqlite"
+        self.sites         = Path(sites) if sites else None
+        self.backend       = payloads.backend
+        self.blobs         = {codec: PayloadStore(self.backend, codec) for codec in ("gzip", "none")}
+        self.keep_per_date = int(keep_per_date)
+        self.expanded      = int(expanded)
+        self.min_age       = float(min_age)
+        self.blob_grace    = float(blob_grace)
+        self.interval      = float(interval)
+        self.enabled       = bool(enabled)      # periodic retention; retain() works either way
+        self._local        = threading.local()  # one connection per thread
+        self._retaining    = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg: dict | None, runs_dir, payloads: PayloadStore, sites=None) -> "RunStore":
+        cfg = dict(cfg or {})
+        return cls(runs_dir, payloads, sites=sites, **cfg)
+
+    # ─── Index ────────────────────────────────────────────────────────────────
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            self.index.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.index, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")       # agents write from several containers
+            db.executescript(SCHEMA)
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _tx(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _quietly(self, fn, *args, **kwargs):
+        try:
+            with self._tx() as db:
+                fn(db, *args, **kwargs)
+        except (sqlite3.Error, OSError) as exc:
+            log.warning("Run index %s not updated: %s", self.index, exc)
+
+    # ─── What the stages report ───────────────────────────────────────────────
+    def start(self, run_id: str, date: str, collection: str, backfill_id: str = "", end_date: str = ""):
+        """A new run (or a backfill site) exists."""
+        self._quietly(_insert, run_id, date=date, collection=collection,
+                      backfill_id=backfill_id, end_date=end_date)
+
+    def stage(self, run_id: str, component: str, status: str, ms: float | None = None,
+              error: str | None = None, total_ms: float | None = None):
+        """*component* is done with *run_id* (status done | failed)."""
+        self._quietly(_stage, run_id, component, status, ms, error, total_ms)
+
+    def promoted(self, run_id: str):
+        self._quietly(lambda db: db.execute("UPDATE runs SET promoted = ? WHERE run_id = ?",
+                                            (time.time(), run_id)))
+
+    # ─── Lookups ──────────────────────────────────────────────────────────────
+    def runs(self, date: str | None = None, limit: int = 50) -> list[dict]:
+        """Newest runs first, of *date* only when given."""
+        sql, args = "SELECT * FROM runs", []
+        if date:
+            sql, args = sql + " WHERE date = ?", [date]
+        rows = self._db().execute(sql + " ORDER BY created DESC LIMIT ?", [*args, int(limit)])
+        return [dict(r) for r in rows]
+
+    def get(self, run_id: str) -> dict | None:
+        """The run's row with its `stages` and `artifacts`."""
+        db  = self._db()
+        row = db.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        run = dict(row)
+        run["stages"]    = [dict(r) for r in db.execute(
+            "SELECT component, status, finished, ms, error FROM stages WHERE run_id = ? "
+            "ORDER BY finished", (run_id,))]
+        run["artifacts"] = self._artifacts(run_id)
+        return run
+
+    def _artifacts(self, run_id: str) -> dict:
+        rows = self._db().execute("SELECT name, digest, size, codec FROM artifacts WHERE run_id = ?",
+                                  (run_id,))
+        return {r["name"]: {"digest": r["digest"], "size": r["size"], "codec": r["codec"]} for r in rows}
+
+    # ─── Artifacts ────────────────────────────────────────────────────────────
+    def _files(self, run_dir: Path) -> list[str]:
+        """Artifacts of a run dir, relative: everything but KEPT, SKIPPED and dot files."""
+        out = []
+        for root, dirs, files in os.walk(run_dir):
+            rel = Path(root).relative_to(run_dir)
+            dirs[:] = [d for d in dirs if not d.startswith(".") and (rel.parts or d not in SKIPPED)]
+            out += [str(rel / f) for f in files
+                    if not f.startswith(".") and (rel.parts or f not in KEPT)]
+        return sorted(out)
+
+    def seal(self, run_id: str, store: bool = False):
+        """Record the run's files (with *store*: as blobs too); the run is done."""
+        run_dir = self.runs_dir / run_id
+        refs    = {}
+        for name in self._files(run_dir):
+            codec      = "none" if name.endswith(COMPRESSED) else "gzip"
+            blobs      = self.blobs[codec]
+            refs[name] = {**(blobs.put_file if store else blobs.ref_for_file)(run_dir / name),
+                          "codec": codec}
+        # blobs already there (e.g. results stored as Kafka payloads) count before packing
+        stored = sum(self.backend.size(key) for key in
+                     {f"{ref['digest']}.{ref['codec']}" for ref in refs.values()}
+                     if self.backend.exists(key))
+        self._quietly(_seal, run_id, refs, stored)
+        return refs
+
+    def pack(self, run_id: str):
+        """Keep the run in the blob store only: its files, build/ and site dir go."""
+        run_dir = self.runs_dir / run_id
+        # blobs are written now, the files being about to go
+        refs    = self.seal(run_id, store=True) if self._files(run_dir) else self._artifacts(run_id)
+        tmp = run_dir / f".{MANIFEST}.tmp"
+        tmp.write_text(json.dumps(refs, indent=1))
+        os.replace(tmp, run_dir / MANIFEST)
+        for name in refs:
+            (run_dir / name).unlink(missing_ok=True)
+        for root, dirs, _ in os.walk(run_dir, topdown=False):
+            for d in dirs:
+                _rmdir_if_empty(Path(root) / d)     # e.g. pages/
+        for tree in (run_dir / "build", self.sites / run_id if self.sites else None):
+            if tree is not None:
+                shutil.rmtree(tree, ignore_errors=True)
+        self._quietly(_storage, run_id, "packed")
+
+    def restore(self, run_id: str, site_dir: str | Path | None = None) -> bool:
+        """Files of a packed run back in place (and its site at *site_dir*); False if unknown."""
+        run_dir = self.runs_dir / run_id
+        refs    = self._artifacts(run_id)
+        if not refs and (run_dir / MANIFEST).exists():
+            refs = json.loads((run_dir / MANIFEST).read_text())
+        if not refs:
+            return False
+        for name, ref in refs.items():
+            dest = run_dir / name
+            if dest.exists():
+                continue
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dest.with_name(f".{dest.name}.{os.getpid()}")
+            with self.blobs[ref["codec"]].open(ref) as src, open(tmp, "wb") as out:
+                shutil.copyfileobj(src, out)
+            os.replace(tmp, dest)
+        (run_dir / MANIFEST).unlink(missing_ok=True)
+        if site_dir is not None and not Path(site_dir).exists():
+            archive = next((n for n in refs if n.startswith("site.tar")), None)
+            if archive is None:
+                raise FileNotFoundError(f"run {run_id} has no site archive")
+            site_archive.extract_archive(run_dir / archive, Path(site_dir))
+        self._quietly(_storage, run_id, "files")
+        log.info("Run %s restored from %s blob(s)", run_id, len(refs))
+        return True
+
+    def prune(self, run_id: str):
+        """Delete the run's files and site; its index row stays, as pruned."""
+        shutil.rmtree(self.runs_dir / run_id, ignore_errors=True)
+        if self.sites is not None:
+            shutil.rmtree(self.sites / run_id, ignore_errors=True)
+        self._quietly(_storage, run_id, "pruned")
+
+    # ─── Retention ────────────────────────────────────────────────────────────
+    def plan(self, now: float | None = None) -> dict:
+        """{"pack": [run_id…], "prune": [run_id…]} by the retention rules."""
+        now       = time.time() if now is None else now
+        protected = referenced_runs(self.runs_dir / "_backfill")
+        plan      = {"pack": [], "prune": []}
+        rank      = {}
+        rows = self._db().execute("SELECT run_id, date, end_date, created, storage, promoted "
+                                  "FROM runs WHERE storage != 'pruned' "
+                                  "ORDER BY date, end_date, status = 'done' DESC, created DESC")
+        for row in rows:
+            key = (row["date"], row["end_date"])
+            n   = rank[key] = rank.get(key, -1) + 1
+            if now - (row["created"] or now) < self.min_age or row["run_id"] in protected:
+                continue
+            if n >= self.keep_per_date and not row["promoted"]:
+                plan["prune"].append(row["run_id"])
+            elif n >= self.expanded and row["storage"] == "files":
+                plan["pack"].append(row["run_id"])
+        return plan
+
+    def retain(self, dry_run: bool = False) -> dict:
+        """Apply the retention rules, then delete unused blobs; returns what was done."""
+        if not self._retaining.acquire(blocking=False):
+            return {}
+        try:
+            now  = time.time()
+            plan = self.plan(now)
+            if not dry_run:
+                for run_id in plan["pack"]:
+                    self.pack(run_id)
+                for run_id in plan["prune"]:
+                    self.prune(run_id)
+            plan["blobs"] = self.collect_blobs(now, dry_run)
+            log.info("Run retention%s: %s packed, %s pruned, %s unused blob(s) deleted",
+                     " (dry run)" if dry_run else "",
+                     len(plan["pack"]), len(plan["prune"]), len(plan["blobs"]))
+            return plan
+        finally:
+            self._retaining.release()
+
+    def collect_blobs(self, now: float, dry_run: bool = False) -> list[str]:
+        """Blobs no run refers to and unused for `blob_grace` seconds, deleted."""
+        used = {f"{r['digest']}.{r['codec']}" for r in
+                self._db().execute("SELECT DISTINCT digest, codec FROM artifacts")}
+        out  = [key for key, mtime in self.backend.scan()
+                if key not in used and now - mtime > self.blob_grace]
+        if not dry_run:
+            for key in out:
+                self.backend.delete(key)
+        return out
+
+    def reindex(self) -> int:
+        """Add the run dirs the index does not know (written before it existed)."""
+        known = {r["run_id"] for r in self._db().execute("SELECT run_id FROM runs")}
+        added = 0
+        for run_dir in sorted(self.runs_dir.iterdir()):
+            if run_dir.name in known or run_dir.name[:1] in "._" or not run_dir.is_dir():
+                continue
+            date, _, rest = run_dir.name.partition("_")
+            end_date = rest.partition("_")[0] if rest.count("_") else ""
+            meta = {}
+            if self.sites is not None:
+                try:
+                    meta = json.loads((self.sites / run_dir.name / "metadata.json").read_text())
+                except (OSError, ValueError):
+                    pass
+            try:
+                total_ms = json.loads((run_dir / "timings.json").read_text()).get("total_ms")
+            except (OSError, ValueError):
+                total_ms = None
+            done = any(run_dir.glob("site.tar*")) or (run_dir / MANIFEST).exists()
+            self._quietly(_insert, run_dir.name, date=date, end_date=end_date,
+                          collection=meta.get("action"), created=run_dir.stat().st_mtime,
+                          status="done" if done else "running", total_ms=total_ms,
+                          storage="packed" if (run_dir / MANIFEST).exists() else "files")
+            added += 1
+        return added
+
+
+# ─── Index updates (one transaction each) ─────────────────────────────────────
+def _insert(db, run_id, **fields):
+    fields = {"created": time.time(), "status": "running", "storage": "files", **fields}
+    fields["updated"] = fields["created"]
+    db.execute(f"INSERT OR IGNORE INTO runs (run_id, {', '.join(fields)}) "
+               f"VALUES (?{', ?' * len(fields)})", (run_id, *fields.values()))
+
+
+def _stage(db, run_id, component, status, ms, error, total_ms):
+    now = time.time()
+    _insert(db, run_id)                 # e.g. a backfill site: no query of its own
+    db.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?)",
+               (run_id, component, status, now, ms, error))
+    db.execute("UPDATE runs SET updated = ?, total_ms = COALESCE(?, total_ms), "
+               "status = CASE WHEN ? = 'failed' THEN 'failed' ELSE status END WHERE run_id = ?",
+               (now, total_ms, status, run_id))
+
+
+def _seal(db, run_id, refs: dict, stored: int):
+    _insert(db, run_id)
+    db.execute("DELETE FROM artifacts WHERE run_id = ?", (run_id,))
+    db.executemany("INSERT INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                   [(run_id, name, r["digest"], r["size"], r["codec"]) for name, r in refs.items()])
+    db.execute("UPDATE runs SET status = CASE WHEN status = 'failed' THEN status ELSE 'done' END, "
+               "bytes = ?, stored_bytes = ?, updated = ? WHERE run_id = ?",
+               (sum(r["size"] for r in refs.values()), stored, time.time(), run_id))
+
+
+def _storage(db, run_id, storage: str):
+    if storage == "pruned":
+        db.execute("DELETE FROM artifacts WHERE run_id = ?", (run_id,))
+    db.execute("UPDATE runs SET storage = ?, updated = ? WHERE run_id = ?",
+               (storage, time.time(), run_id))
+
+
+def _rmdir_if_empty(path: Path):
+    try:
+        path.rmdir()
+    except OSError:
+        pass
+
+
+# ─── CLI ──────────────────────────────────────────────────────────────────────
+def main() -> int:
+    import yaml
+    ap = argparse.ArgumentParser(prog="python -m agents.common.run_store", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("command", choices=("list", "show", "restore", "retain", "reindex"))
+    ap.add_argument("run_id", nargs="?")
+    ap.add_argument("--date", help="list: runs of this date only")
+    ap.add_argument("--limit", type=int, default=50)
+    ap.add_argument("--dry-run", action="store_true", help="retain: only say what would go")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    config = yaml.safe_load(Path(os.getenv("CONFIG_FILE", "/app/config/base_config.yaml")).read_text())
+    store  = RunStore.from_config(config.get("run_store"), config.get("runs_dir", "/runs"),
+                                  PayloadStore.from_config(config.get("payload_store")),
+                                  sites=config["web"]["output_dir"])
+    if args.command in ("show", "restore") and not args.run_id:
+        ap.error(f"{args.command} needs a run_id")
+    if args.command == "list":
+        for run in store.runs(args.date, args.limit):
+            print(f"{run['run_id']:40} {run['collection'] or '':4} {run['status']:8} "
+                  f"{run['storage']:7} {run['bytes'] or 0:>12} B {run['total_ms'] or 0:>10.0f} ms"
+                  f"{'  promoted' if run['promoted'] else ''}")
+    elif args.command == "show":
+        run = store.get(args.run_id)
+        if run is None:
+            print(f"Unknown run {args.run_id}")
+            return 1
+        print(json.dumps(run, indent=1))
+    elif args.command == "restore":
+        return 0 if store.restore(args.run_id, store.sites / args.run_id) else 1
+    elif args.command == "retain":
+        print(json.dumps(store.retain(args.dry_run), indent=1))
+    else:
+        print(f"{store.reindex()} run(s) added to {store.index}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,123 @@
+"""
+Schema Registry client with a disk cache
+────────────────────────────────────────
+Schema ids (per subject and schema) and schemas (per id) are kept in one
+JSON file shared by the agents through /runs:
+
+    /runs/_cache/schemas.json  ← {<registry url>: {"ids": {…}, "schemas": {…}}}
+
+so a restarted agent serializes and reads its first messages without a
+registry round-trip, even while the registry itself is still starting.
+
+Answers served from the file are checked against the registry once per
+process, on a background thread: an id that changed (the registry was
+reset) is replaced, a schema id the registry no longer knows is dropped.
+Without a writable cache file the client behaves like the plain one.
+"""
+
+import fcntl, hashlib, json, logging, os, threading
+from pathlib import Path
+from confluent_kafka.schema_registry import SchemaRegistryClient, Schema, RegisteredSchema
+from confluent_kafka.schema_registry.error import SchemaRegistryError
+
+log = logging.getLogger(__name__)
+
+
+class CachedSchemaRegistryClient(SchemaRegistryClient):
+    def __init__(self, conf: dict, path: str | Path | None):
+        super().__init__(conf)
+        self.url     = conf["url"]
+        self.path    = Path(path) if path else None
+        self.ids     = {}                   # "<subject> <sha256>" → {"id", "guid"}
+        self.schemas = {}                   # str(id) → Schema.to_dict()
+        self._lock   = threading.Lock()
+        self._checks = set()                # cached answers already queued for a check
+        entry = self._read().get(self.url, {})
+        self.ids.update(entry.get("ids", {}))
+        self.schemas.update(entry.get("schemas", {}))
+
+    # ─── SchemaRegistryClient (the calls the Avro serdes make) ───────────────
+    def register_schema_full_response(self, subject_name, schema, normalize_schemas=False):
+        key = f"{subject_name} {hashlib.sha256(schema.schema_str.encode()).hexdigest()}"
+        hit = self.ids.get(key)
+        if hit is None:
+            return self._register(key, subject_name, schema, normalize_schemas)
+        self._check(key, self._register, key, subject_name, schema, normalize_schemas)
+        return RegisteredSchema(schema_id=hit["id"], guid=hit["guid"], subject=subject_name,
+                                version=None, schema=schema)
+
+    def get_schema(self, schema_id, subject_name=None, fmt=None, reference_format=None):
+        hit = self.schemas.get(str(schema_id))
+        if hit is None:
+            return self._fetch(schema_id, subject_name, fmt, reference_format)
+        self._check(str(schema_id), self._fetch, schema_id, subject_name, fmt, reference_format)
+        return Schema.from_dict(hit)
+
+    # ─── Registry round-trips ─────────────────────────────────────────────────
+    def _register(self, key, subject_name, schema, normalize_schemas):
+        registered = super().register_schema_full_response(subject_name, schema, normalize_schemas)
+        value = {"id": registered.schema_id, "guid": registered.guid}
+        if self.ids.get(key, value) != value:
+            log.warning("Schema id of %s changed from %s to %s (registry reset?)",
+                        subject_name, self.ids[key]["id"], registered.schema_id)
+        self._store("ids", key, value)
+        return registered
+
+    def _fetch(self, schema_id, subject_name, fmt, reference_format):
+        try:
+            schema = super().get_schema(schema_id, subject_name, fmt, reference_format)
+        except SchemaRegistryError as exc:
+            if exc.http_status_code == 404 and str(schema_id) in self.schemas:
+                log.warning("Schema id %s unknown to the registry, dropped from the cache", schema_id)
+                self._store("schemas", str(schema_id), None)
+            raise
+        self._store("schemas", str(schema_id), schema.to_dict())
+        return schema
+
+    def _check(self, key, fn, *args):
+        with self._lock:
+            if key in self._checks:
+                return
+            self._checks.add(key)
+        threading.Thread(target=self._quietly, args=(fn, *args), daemon=True,
+                         name="schema-check").start()
+
+    @staticmethod
+    def _quietly(fn, *args):
+        try:
+            fn(*args)
+        except Exception as exc:            # registry down: keep serving the cache
+            log.debug("Schema check failed: %s", exc)
+
+    # ─── Cache file ───────────────────────────────────────────────────────────
+    def _read(self) -> dict:
+        try:
+            return json.loads(self.path.read_text()) if self.path else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _store(self, table: str, key: str, value):
+        with self._lock:
+            entries = getattr(self, table)
+            if value is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = value
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path.with_name(f".{self.path.name}.lock"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)    # agents share the file
+                content = self._read()
+                entry   = content.setdefault(self.url, {})
+                entry.setdefault(table, {})
+                if value is None:
+                    entry[table].pop(key, None)
+                else:
+                    entry[table][key] = value
+                tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+                tmp.write_text(json.dumps(content, indent=1))
+                os.replace(tmp, self.path)
+        except OSError as exc:
+            log.debug("Schema cache %s not written: %s", self.path, exc)
@@ -0,0 +1,205 @@
+"""
+Static search index
+───────────────────
+An inverted index over the titles, CELEX numbers and OJ numbers of every
+date built so far, kept by the web builder in `web.search.root`
+(<output_dir>/_search) and linked into each site as search/, a relative
+symlink (so the root stays inside output_dir):
+
+    search/meta.json             {"version", "prefix", "fields", "dates": {date: {"docs", "digest"}},
+                                  "shards": {key: tokens}}
+    search/docs/<date>.json      [[loc, celex, num, title, collection, docType], …]
+    search/shards/<key>.json     {token: {date: [doc index, …]}}
+
+Shards hold the tokens sharing their first `prefix` characters (other than
+a-z0-9: "_" + the UTF-8 hex of the prefix), so assets/search.js only fetches
+the shards of the words typed. Files of 1 KiB or more get a precompressed
+`.gz` variant (static_server.precompress), served by the web agent.
+
+Updates are per date: a run replaces the documents of its date(s) and
+rewrites only the shards of the tokens whose postings changed; a date whose
+documents did not change (same digest) costs nothing. Files are replaced
+by rename, never rewritten in place: the staged sites all show the current
+index, and a release takes its own copy (web_agent). The sizes reported are
+running totals kept in .sizes.json, updated from the files written.
+"""
+
+import fcntl, hashlib, json, os, re, shutil, time, unicodedata
+from pathlib import Path
+from agents.common.static_server import precompress
+
+VERSION  = 1
+SITE_DIR = "search"
+META     = "meta.json"
+SIZES    = ".sizes.json"
+PREFIX   = 2
+FIELDS   = ("loc", "celex", "num", "title", "collection", "docType")
+INDEXED  = ("celex", "num", "title")
+# same list in templates/assets/search.js
+STOPWORDS = frozenset("a an and are as at be by for from in into is it its of on or "
+                      "that the their this to which with".split())
+
+_WORD  = re.compile(r"[^\W_]+")
+_PLAIN = re.compile(r"[a-z0-9]+")
+
+
+def tokens(text: str) -> list[str]:
+    """Lowercased words without accents or stopwords; one-letter words only as digits."""
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return [t for t in _WORD.findall(text.lower())
+            if (len(t) > 1 or t.isdigit()) and t not in STOPWORDS]
+
+
+def shard_key(token: str, prefix: int = PREFIX) -> str:
+    key = token[:prefix]
+    return key if _PLAIN.fullmatch(key) else "_" + key.encode().hex()
+
+
+def documents(records) -> dict:
+    """{date: [[field, …] per FIELDS]} of sitemap records, in sitemap order."""
+    docs = {}
+    for rec in records:
+        docs.setdefault(rec["issued"], []).append([rec.get(f, "") for f in FIELDS])
+    return docs
+
+
+def _postings(docs: list) -> dict:
+    """{token: [doc index, …]} of one date's documents."""
+    out = {}
+    for i, doc in enumerate(docs):
+        for token in dict.fromkeys(t for f in INDEXED for t in tokens(doc[FIELDS.index(f)])):
+            out.setdefault(token, []).append(i)
+    return out
+
+
+def _dumps(obj) -> bytes:
+    # sorted and compact: the same content gives the same bytes, which later
+    # sites and releases then share as links
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _replace(path: Path, data: bytes | None) -> list[int]:
+    """Write (None: delete) *path* and its .gz variant, by rename; returns their sizes."""
+    gz = path.with_name(path.name + ".gz")
+    gz.unlink(missing_ok=True)
+    if data is None:
+        path.unlink(missing_ok=True)
+        return [0, 0]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return [len(data), gz.stat().st_size if precompress(path) else 0]
+
+
+def _load(path: Path, default):
+    try:
+        return json.loads(path.read_bytes())
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def update(root: Path, records, prefix: int = PREFIX) -> dict:
+    """
+    Bring the index at *root* up to date with the dates of *records*; returns
+    stats (dates changed, shards written, sizes, ms).
+    """
+    t0   = time.time()
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    new_docs = documents(records)
+    with open(root / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)        # builders of several processes
+
+        meta  = _load(root / META, {})
+        sizes = _load(root / SIZES, None)
+        if meta.get("version") != VERSION or meta.get("prefix") != prefix:
+            meta  = {"version": VERSION, "prefix": prefix, "fields": list(FIELDS),
+                     "dates": {}, "shards": {}}
+            sizes = None
+        scanned = sizes is None
+        if scanned:
+            sizes = _scan(root)                 # once, for an index without totals yet
+
+        changed, shards = [], {}                # shard key → {token: {date: postings | None}}
+        for day, docs in sorted(new_docs.items()):
+            digest = hashlib.sha256(_dumps(docs)).hexdigest()
+            if meta["dates"].get(day, {}).get("digest") == digest:
+                continue
+            changed.append(day)
+            old = _load(root / "docs" / f"{day}.json", []) if day in meta["dates"] else []
+            old, new = _postings(old), _postings(docs)
+            for token in old.keys() | new.keys():
+                if old.get(token) != new.get(token):    # only the tokens whose postings moved
+                    shards.setdefault(shard_key(token, prefix), {}).setdefault(token, {})[day] = new.get(token)
+            meta["dates"][day] = {"docs": len(docs), "digest": digest}
+
+        for key, edits in shards.items():
+            path  = root / "shards" / f"{key}.json"
+            shard = _load(path, {}) if key in meta["shards"] else {}
+            for token, days in edits.items():
+                postings = shard.setdefault(token, {})
+                for day, ids in days.items():
+                    if ids is None:
+                        postings.pop(day, None)
+                    else:
+                        postings[day] = ids
+                if not postings:
+                    del shard[token]
+            _count(sizes, f"shards/{key}.json", _replace(path, _dumps(shard) if shard else None))
+            if shard:
+                meta["shards"][key] = len(shard)
+            else:
+                meta["shards"].pop(key, None)
+
+        for day in changed:
+            _count(sizes, f"docs/{day}.json", _replace(root / "docs" / f"{day}.json", _dumps(new_docs[day])))
+        if changed:
+            _count(sizes, META, _replace(root / META, _dumps(meta)))
+        if changed or scanned:
+            tmp = root / f"{SIZES}.{os.getpid()}"
+            tmp.write_bytes(_dumps(sizes))      # not served: no .gz variant
+            os.replace(tmp, root / SIZES)
+        stats = _stats(meta, sizes, changed, len(new_docs) - len(changed), len(shards))
+    stats["ms"] = round((time.time() - t0) * 1000, 1)
+    return stats
+
+
+def _scan(root: Path) -> dict:
+    """Size totals of the files of the index at *root*: {"bytes", "gz_bytes", "files": {name: [bytes, gz]}}."""
+    sizes = {"bytes": 0, "gz_bytes": 0, "files": {}}
+    for p in [root / META, *root.glob("docs/*.json"), *root.glob("shards/*.json")]:
+        if p.is_file():
+            gz = p.with_name(p.name + ".gz")
+            _count(sizes, p.relative_to(root).as_posix(),
+                   [p.stat().st_size, gz.stat().st_size if gz.is_file() else 0])
+    return sizes
+
+
+def _count(sizes: dict, name: str, new: list[int]):
+    """Swap the sizes of file *name* in the running totals."""
+    old = sizes["files"].pop(name, [0, 0])
+    sizes["bytes"]    += new[0] - old[0]
+    sizes["gz_bytes"] += new[1] - old[1]
+    if new[0]:
+        sizes["files"][name] = new
+
+
+def _stats(meta: dict, sizes: dict, changed, unchanged: int, written: int) -> dict:
+    shards  = {name[7:-5]: size[0] for name, size in sizes["files"].items() if name.startswith("shards/")}
+    largest = max(shards, key=shards.get, default=None)
+    return {"changed": changed, "unchanged": unchanged, "dates": len(meta["dates"]),
+            "shards_written": written, "shards": len(shards), "bytes": sizes["bytes"],
+            "gz_bytes": sizes["gz_bytes"], "largest_shard": largest,
+            "largest_bytes": shards.get(largest, 0)}
+
+
+def link_into(root: Path, site_dir: Path):
+    """site_dir/search: one relative symlink to the index at *root*, whatever its size."""
+    link = site_dir / SITE_DIR
+    if link.is_dir() and not link.is_symlink():
+        shutil.rmtree(link)
+    tmp = link.with_name(f".{SITE_DIR}.{os.getpid()}")
+    tmp.unlink(missing_ok=True)
+    tmp.symlink_to(os.path.relpath(Path(root).resolve(), site_dir.resolve()), target_is_directory=True)
+    os.replace(tmp, link)
@@ -0,0 +1,172 @@
+"""
+Site archives and snapshots
+───────────────────────────
+The rendered site is archived for inspection as /runs/<run_id>/site.tar.gz
+(.tar.zst, .tar), compressed on several threads:
+
+  * gzip: the tar stream is cut into `block_size` blocks, each compressed
+    on its own as one gzip member (zlib releases the GIL). Concatenated
+    members are one valid gzip file: tar -xzf, gunzip and gzip.GzipFile
+    read it whole (tarfile's own "r|gz" stops after the first member).
+  * zstd: the `zstandard` package (optional) with its own worker threads.
+  * none: a plain tar.
+
+Archives are written to a temporary name and renamed, so a reader never
+sees half of one; `extract_archive()` reads any of them back.
+
+`snapshot()` makes the uncompressed debug copy (/runs/<run_id>/build) from
+hardlinks, reflinks across filesystems, and copies only where neither
+works: the files of a rendered site are never rewritten in place (builds
+already link unchanged pages between them).
+"""
+
+import fcntl, gzip, os, shutil, tarfile, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+try:                                   # optional, for codec: zstd
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUFFIXES   = {"gzip": ".tar.gz", "zstd": ".tar.zst", "none": ".tar"}
+FICLONE    = getattr(fcntl, "FICLONE", 0x40049409)     # Linux ioctl, not in fcntl before 3.12
+BLOCK_SIZE = 1 << 20
+
+
+def archive_name(codec: str = "gzip") -> str:
+    if codec not in SUFFIXES:
+        raise ValueError(f"Unknown archive codec {codec!r} (gzip | zstd | none)")
+    return "site" + SUFFIXES[codec]
+
+
+def _gzip_member(block: bytes, level: int) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush()
+
+
+class _BlockWriter:
+    """Write-only file for tarfile: full blocks compressed on a pool, written in order."""
+
+    def __init__(self, out, compress, threads: int, block_size: int):
+        self.out        = out
+        self.compress   = compress
+        self.block_size = block_size
+        self.pool       = ThreadPoolExecutor(threads, thread_name_prefix="archive")
+        self.window     = 2 * threads     # compressed blocks waiting to be written
+        self.pending    = deque()
+        self.buf        = bytearray()
+
+    def write(self, data) -> int:
+        self.buf += data
+        while len(self.buf) >= self.block_size:
+            self._submit(bytes(self.buf[:self.block_size]))
+            del self.buf[:self.block_size]
+        return len(data)
+
+    def _submit(self, block: bytes):
+        self.pending.append(self.pool.submit(self.compress, block))
+        while len(self.pending) > self.window:
+            self.out.write(self.pending.popleft().result())
+
+    def close(self):
+        try:
+            if self.buf:
+                self._submit(bytes(self.buf))
+                self.buf.clear()
+            while self.pending:
+                self.out.write(self.pending.popleft().result())
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+
+def write_archive(site_dir: Path, dest: Path, codec: str = "gzip", level: int | None = None,
+                  threads: int | None = None, block_size: int = BLOCK_SIZE, arcname: str = "site"):
+    """*site_dir* as a tar under *arcname*, compressed with *codec*, at *dest*."""
+    threads = int(threads or os.cpu_count() or 1)
+    tmp     = dest.with_name(f".{dest.name}.{os.getpid()}")
+    try:
+        with open(tmp, "wb") as out:
+            if codec == "gzip":
+                sink = _BlockWriter(out, partial(_gzip_member, level=6 if level is None else level),
+                                    threads, int(block_size))
+            elif codec == "zstd":
+                if zstandard is None:
+                    raise RuntimeError("Archive codec zstd needs the zstandard package")
+                sink = zstandard.ZstdCompressor(level=3 if level is None else level,
+                                                threads=threads).stream_writer(out, closefd=False)
+            elif codec == "none":
+                sink = None
+            else:
+                raise ValueError(f"Unknown archive codec {codec!r} (gzip | zstd | none)")
+            try:
+                with tarfile.open(fileobj=sink or out, mode="w|") as tar:
+                    tar.add(site_dir, arcname=arcname)
+            finally:
+                if sink is not None:
+                    sink.close()
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def extract_archive(archive: Path, dest: Path, arcname: str = "site"):
+    """The tree stored under *arcname* in *archive* (any codec above) at *dest*."""
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    try:
+        with open(archive, "rb") as raw:
+            if archive.name.endswith(".zst"):
+                if zstandard is None:
+                    raise RuntimeError("Archive codec zstd needs the zstandard package")
+                source = zstandard.ZstdDecompressor().stream_reader(raw)
+            elif archive.name.endswith(".gz"):
+                # GzipFile reads every member (tarfile's "r|gz" stops after the first block)
+                source = gzip.GzipFile(fileobj=raw)
+            else:
+                source = raw
+            with tarfile.open(fileobj=source, mode="r|") as tar:
+                for member in tar:
+                    parts = Path(member.name).parts
+                    if len(parts) < 2 or parts[0] != arcname:
+                        continue
+                    member.name = os.path.join(*parts[1:])
+                    if member.islnk():              # a file seen twice: linked to the first
+                        member.linkname = os.path.join(*Path(member.linkname).parts[1:])
+                    tar.extract(member, tmp, filter="data")     # nothing outside *dest*
+        shutil.rmtree(dest, ignore_errors=True)
+        os.replace(tmp, dest)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# ─── Debug snapshots ──────────────────────────────────────────────────────────
+def _reflink(src, dst):
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+    shutil.copystat(src, dst)
+
+
+def link_or_copy(src, dst):
+    """Hardlink, else reflink (copy-on-write), else copy *src* to *dst*."""
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def snapshot(src: Path, dst: Path):
+    """Replace *dst* with a tree of links to the files of *src*."""
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    shutil.copytree(src, tmp, symlinks=True, copy_function=link_or_copy)
+    shutil.rmtree(dst, ignore_errors=True)
+    os.replace(tmp, dst)
@@ -0,0 +1,166 @@
+"""
+Page manifest for incremental site builds
+─────────────────────────────────────────
+A site is one index page plus one page per `date/oj_collection`, holding a
+section per `resource_type` (see templates/maps.njk). The manifest records a
+content hash for every page, computed from the sitemap records it renders:
+
+    {"templates": "…", "pages": {"2025-06-20/http-…-oj-c": {"hash": "…", "resource_types": {…}}}}
+
+Comparing it with the manifest of the previous build of the same date tells
+which pages need rendering; all other files are hardlinked from that build.
+`templates` hashes the template dir (layouts, _data, .eleventy.js, assets):
+when it changed, every page is rendered again.
+"""
+
+import fnmatch, gzip, hashlib, json, os, re, shutil
+import lxml.etree as ET
+from pathlib import Path
+
+MANIFEST = ".manifest.json"
+
+SM_NS  = "http://www.sitemaps.org/schemas/sitemap/0.9"
+AKN_NS = "http://imfc.europa.eu/akn4eu"
+DC_NS  = "http://purl.org/dc/terms/"
+_FIELDS = {
+    f"{{{SM_NS}}}loc":          "loc",
+    f"{{{AKN_NS}}}num":         "num",
+    f"{{{DC_NS}}}issued":       "issued",
+    f"{{{DC_NS}}}identifier":   "celex",
+    f"{{{DC_NS}}}isPartOf":     "collection",
+    f"{{{AKN_NS}}}docType":     "docType",
+}
+# fields a page renders: the manifest hashes these (celex only feeds the search index)
+PAGE_FIELDS = ("loc", "num", "issued", "collection", "docType", "title")
+# not part of the templates hash: installed packages and Eleventy's default output
+TEMPLATE_SKIP = ("node_modules", "_site")
+
+
+def slugify(s: str) -> str:
+    """Same as the `slug` filter in templates/.eleventy.js"""
+    return re.sub(r"(^-|-$)", "", re.sub(r"\W+", "-", s.lower(), flags=re.ASCII))
+
+
+def page_key(issued: str, collection: str) -> str:
+    """Directory of a page below the site root (permalink of maps.njk)."""
+    return f"{issued}/{slugify(collection)}"
+
+
+def _url_records(source):
+    for _, url in ET.iterparse(source, tag=f"{{{SM_NS}}}url"):
+        rec = {"loc": "", "num": "", "issued": "", "collection": "", "docType": "", "title": "",
+               "celex": ""}
+        for child in url:
+            if child.tag in _FIELDS:
+                rec[_FIELDS[child.tag]] = child.text or ""
+            elif child.tag == f"{{{AKN_NS}}}docTitle" and len(child):
+                rec["title"] = child[0].text or ""          # first <literal>
+        url.clear()
+        while url.getprevious() is not None:
+            del url.getparent()[0]
+        yield rec
+
+
+def sitemap_files(site_dir: Path) -> list[str]:
+    """Names of the urlset files of site_dir: the shards of its index, or sitemap.xml."""
+    index = site_dir / "sitemap_index.xml"
+    if not index.exists():
+        return ["sitemap.xml"]
+    return [loc.text for _, loc in ET.iterparse(str(index), tag=f"{{{SM_NS}}}loc")]
+
+
+def sitemap_records(site_dir: Path):
+    """Yield the records of site_dir/sitemap.xml, or of its sitemap shards."""
+    for name in sitemap_files(site_dir):
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(site_dir / name, "rb") as urlset:
+            yield from _url_records(urlset)
+
+
+def templates_hash(template_dir) -> str:
+    """Hash of the files of *template_dir* a render depends on, dotfiles (.eleventy.js) included."""
+    root, sha = Path(template_dir), hashlib.sha256()
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d not in TEMPLATE_SKIP and not d.startswith("."))
+        for f in sorted(files):
+            path = Path(dirpath) / f
+            sha.update(path.relative_to(root).as_posix().encode() + b"\0")
+            sha.update(hashlib.sha256(path.read_bytes()).digest())
+    return sha.hexdigest()
+
+
+def build_manifest(records, templates: str = "") -> dict:
+    """Hash the records page by page, in rendering order; *templates*: templates_hash()."""
+    pages = {}
+    for rec in records:
+        page = pages.setdefault(page_key(rec["issued"], rec["collection"]), {})
+        page.setdefault(rec["docType"], hashlib.sha256())
+        page[rec["docType"]].update(json.dumps({f: rec[f] for f in PAGE_FIELDS}, sort_keys=True).encode())
+
+    manifest = {}
+    for key, types in pages.items():
+        types = {t: h.hexdigest() for t, h in types.items()}
+        manifest[key] = {
+            "hash": hashlib.sha256(json.dumps(list(types.items())).encode()).hexdigest(),
+            "resource_types": types,
+        }
+    return {"templates": templates, "pages": manifest}
+
+
+def load_manifest(site_dir: Path) -> dict | None:
+    try:
+        return json.loads((site_dir / MANIFEST).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_manifest(site_dir: Path, manifest: dict):
+    (site_dir / MANIFEST).write_text(json.dumps(manifest, indent=1))
+
+
+def previous_site(output_dir: Path, date: str, run_id: str) -> Path | None:
+    """Most recent earlier build of *date* that has a manifest (run ids sort by ULID)."""
+    for candidate in sorted(output_dir.glob(f"{date}_*"), reverse=True):
+        if candidate.name < run_id and (candidate / MANIFEST).exists():
+            return candidate
+    return None
+
+
+def diff_pages(old: dict | None, new: dict):
+    """Return (pages to render, pages to drop); all pages when the templates changed."""
+    old_pages = (old or {}).get("pages", {})
+    new_pages = new["pages"]
+    if (old or {}).get("templates") != new.get("templates"):
+        return set(new_pages), set(old_pages) - set(new_pages)
+    render = {k for k, v in new_pages.items() if old_pages.get(k, {}).get("hash") != v["hash"]}
+    drop   = set(old_pages) - set(new_pages)
+    return render, drop
+
+
+def link_unchanged(prev: Path, site_dir: Path, skip_pages, skip_top=()) -> int:
+    """
+    Hardlink every file of *prev* into *site_dir*, except the pages in
+    *skip_pages*, top-level names matching a pattern of *skip_top* and files
+    already present. Returns the number of linked files.
+    """
+    skip_dirs = {prev / k for k in skip_pages}
+    top_skip  = lambda name: name == MANIFEST or any(fnmatch.fnmatch(name, p) for p in skip_top)
+    linked = 0
+    for root, dirs, files in os.walk(prev):
+        root = Path(root)
+        dirs[:] = [d for d in dirs
+                   if root / d not in skip_dirs and not (root == prev and top_skip(d))]
+        rel = root.relative_to(prev)
+        for f in files:
+            if root == prev and top_skip(f):
+                continue
+            dst = site_dir / rel / f
+            if dst.exists():
+                continue
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(root / f, dst)
+            except OSError:
+                shutil.copy2(root / f, dst)
+            linked += 1
+    return linked
@@ -0,0 +1,252 @@
+"""
+Streaming sitemap engine
+────────────────────────
+Single-pass alternative to xslt/raw_to_sitemap.xslt. SPARQL <result>s are
+read with iterparse and folded into one small record per ELI (hash-based
+grouping and creator dedup), then written out with an incremental writer.
+Memory grows with the number of distinct ELIs, not with the document.
+The same records can also be written as gzipped `sitemap-N.xml.gz` shards
+plus a `sitemapindex`, in parallel across a process pool. `group_rows()`
+builds them from a row batch file (result_rows) instead of SPARQL XML.
+
+The output is byte-identical to `str(XSLT(...))`, including the stylesheet's
+quirks:
+  * results without an `eli` literal are dropped;
+  * a creator is only emitted for the act where it first occurs in the whole
+    document (`not(preceding::…/s:uri = $uri)`), not once per act;
+  * without an English title, the first literal of *every* title binding of
+    the group is copied.
+"""
+
+import gzip
+import lxml.etree as ET
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from agents.common import result_rows
+
+SPARQL_NS = "http://www.w3.org/2005/sparql-results#"
+_RESULT   = f"{{{SPARQL_NS}}}result"
+_URI      = f"{{{SPARQL_NS}}}uri"
+_LITERAL  = f"{{{SPARQL_NS}}}literal"
+_XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+ANY_URI = 'rdf:datatype="http://www.w3.org/2001/XMLSchema#anyURI"'
+URLSET  = ('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+           ' xmlns:dcterms="http://purl.org/dc/terms/"'
+           ' xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"'
+           ' xmlns:akn4eu="http://imfc.europa.eu/akn4eu"')
+
+
+def _escape(text: str) -> str:
+    # same rules as libxml2's text serializer
+    return (text.replace("&", "&amp;").replace("<", "&lt;")
+                .replace(">", "&gt;").replace("\r", "&#13;"))
+
+
+def _elem(tag: str, text: str, attrs: str = "") -> str:
+    attrs = f" {attrs}" if attrs else ""
+    if text == "":
+        return f"    <{tag}{attrs}/>\n"
+    return f"    <{tag}{attrs}>{_escape(text)}</{tag}>\n"
+
+
+class _Group:
+    __slots__ = ("eli", "collection", "celex", "num", "doc_type",
+                 "creators", "title_en", "titles")
+
+    def __init__(self, eli, first: dict):
+        self.eli        = eli
+        self.collection = first.get(("oj_collection", _URI))
+        self.celex      = first.get(("celex", _LITERAL))
+        self.num        = first.get(("oj_number", _LITERAL))
+        self.doc_type   = first.get(("resource_type", _URI))
+        self.creators   = []
+        self.title_en   = None
+        self.titles     = []
+
+
+def _values(result):
+    """
+    Return ({(binding, kind): first value}, creator uris, title literals)
+    for one <result> element.
+    """
+    first, creators, titles = {}, [], []
+    for binding in result:
+        name, n_literals = binding.get("name"), 0
+        for value in binding:
+            first.setdefault((name, value.tag), value.text or "")
+            if name == "creating_agents" and value.tag == _URI:
+                creators.append(value.text or "")
+            elif name == "title" and value.tag == _LITERAL:
+                titles.append((n_literals, value))
+            if value.tag == _LITERAL:
+                n_literals += 1
+    return first, creators, titles
+
+
+def group_results(source) -> dict:
+    """Read SPARQL XML from *source* (path or binary file) → {eli: _Group}."""
+    groups, seen_creators = {}, set()
+
+    for _, result in ET.iterparse(source, tag=_RESULT):
+        first, creators, titles = _values(result)
+        eli = first.get(("eli", _LITERAL))
+
+        group = None
+        if eli is not None:
+            group = groups.get(eli)
+            if group is None:
+                group = groups[eli] = _Group(eli, first)
+
+        for uri in creators:
+            if uri not in seen_creators:
+                seen_creators.add(uri)
+                if group is not None:
+                    group.creators.append(uri)
+
+        if group is not None and group.title_en is None:
+            for i, lit in titles:
+                if lit.get(_XML_LANG) == "en":
+                    group.title_en = ET.tostring(lit, encoding="unicode", with_tail=False)
+                    group.titles   = []
+                    break
+                if i == 0:
+                    group.titles.append(ET.tostring(lit, encoding="unicode", with_tail=False))
+
+        # the result is fully consumed: free it and its predecessors
+        result.clear()
+        while result.getprevious() is not None:
+            del result.getparent()[0]
+
+    return groups
+
+
+def _column(columns, name, kind, n):
+    """Values of the *name* column that are of *kind* (u, l), None elsewhere."""
+    column = columns.get(name)
+    if column is None:
+        return [None] * n
+    return [v if k == kind else None for k, v in zip(column["kind"], column["value"])]
+
+
+def group_rows(source) -> dict:
+    """group_results() for a row batch file *source* (path or binary file)."""
+    groups, seen_creators = {}, set()
+
+    _, batches = result_rows.read(source)
+    for n, columns in batches:
+        elis     = _column(columns, "eli", "l", n)
+        firsts   = [(key, _column(columns, key[0], kind, n)) for key, kind in
+                    ((("oj_collection", _URI), "u"), (("celex", _LITERAL), "l"),
+                     (("oj_number", _LITERAL), "l"), (("resource_type", _URI), "u"))]
+        creators = _column(columns, "creating_agents", "u", n)
+        title    = columns.get("title") or {"kind": "-" * n, "value": [None] * n}
+        langs    = title.get("lang") or [""] * n
+        types    = title.get("datatype") or [""] * n
+
+        for i in range(n):
+            eli, group = elis[i], None
+            if eli is not None:
+                group = groups.get(eli)
+                if group is None:
+                    group = groups[eli] = _Group(eli, {key: values[i] for key, values in firsts
+                                                       if values[i] is not None})
+
+            uri = creators[i]
+            if uri is not None and uri not in seen_creators:
+                seen_creators.add(uri)
+                if group is not None:
+                    group.creators.append(uri)
+
+            if group is not None and group.title_en is None and title["kind"][i] == "l":
+                literal = result_rows.literal_xml(title["value"][i], langs[i], types[i])
+                if langs[i] == "en":
+                    group.title_en = literal
+                    group.titles   = []
+                else:
+                    group.titles.append(literal)
+
+    return groups
+
+
+def write_sitemap(groups, out, issued_date: str, lastmod_date: str) -> int:
+    """Write the urlset for the _Groups *groups* to the binary file *out*, return URL count."""
+    out.write(b'<?xml version="1.0"?>\n')
+    if not groups:
+        out.write(f"{URLSET}/>\n".encode())
+        return 0
+
+    out.write(f"{URLSET}>\n".encode())
+    for g in groups:
+        parts = ["  <url>\n",
+                 _elem("loc", g.eli),
+                 _elem("lastmod", lastmod_date),
+                 "    <changefreq>monthly</changefreq>\n",
+                 "    <priority>1</priority>\n"]
+        if g.collection is not None:
+            parts.append(_elem("dcterms:isPartOf", g.collection, ANY_URI))
+        if g.celex is not None:
+            parts.append(_elem("dcterms:identifier", g.celex))
+        for uri in g.creators:
+            parts.append(_elem("dcterms:creator", uri, ANY_URI))
+        if issued_date:
+            parts.append(_elem("dcterms:issued", issued_date))
+        if g.num is not None:
+            parts.append(_elem("akn4eu:num", g.num))
+        if g.doc_type is not None:
+            parts.append(_elem("akn4eu:docType", g.doc_type, ANY_URI))
+        titles = [g.title_en] if g.title_en is not None else g.titles
+        if titles:
+            parts.append("    <akn4eu:docTitle>\n")
+            parts.extend(f"      {t}\n" for t in titles)
+            parts.append("    </akn4eu:docTitle>\n")
+        parts.append("  </url>\n")
+        out.write("".join(parts).encode())
+    out.write(b"</urlset>\n")
+    return len(groups)
+
+
+def build_sitemap(source, out, issued_date: str, lastmod_date: str) -> int:
+    """SPARQL XML *source* → sitemap XML on *out*. Returns the URL count."""
+    return write_sitemap(list(group_results(source).values()), out, issued_date, lastmod_date)
+
+
+# ─── Sharded output ───────────────────────────────────────────────────────────
+def _write_shard(path, groups, issued_date, lastmod_date) -> int:
+    with gzip.GzipFile(path, "wb", mtime=0) as out:
+        return write_sitemap(groups, out, issued_date, lastmod_date)
+
+
+def write_sitemap_index(names, out, lastmod_date: str):
+    out.write(b'<?xml version="1.0"?>\n')
+    out.write(b'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+    for name in names:
+        out.write(f"  <sitemap>\n    <loc>{_escape(name)}</loc>\n"
+                  f"    <lastmod>{_escape(lastmod_date)}</lastmod>\n  </sitemap>\n".encode())
+    out.write(b"</sitemapindex>\n")
+
+
+def build_sitemap_shards(source, dest_dir: Path, issued_date: str, lastmod_date: str,
+                         shard_size: int = 50000, workers: int = 4, group=group_results):
+    """
+    SPARQL XML *source* (row file: group=group_rows) → dest_dir/sitemap-N.xml.gz
+    (at most *shard_size* URLs each, written by *workers* processes) +
+    dest_dir/sitemap_index.xml. Returns (index path, shard file names, URL count).
+    """
+    groups = list(group(source).values())
+    chunks = [groups[i:i + shard_size] for i in range(0, len(groups), shard_size)] or [[]]
+    names  = [f"sitemap-{n}.xml.gz" for n in range(1, len(chunks) + 1)]
+
+    if len(chunks) == 1 or workers <= 1:
+        counts = [_write_shard(dest_dir / names[i], c, issued_date, lastmod_date)
+                  for i, c in enumerate(chunks)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            counts = list(pool.map(_write_shard,
+                                   [dest_dir / n for n in names], chunks,
+                                   [issued_date] * len(chunks), [lastmod_date] * len(chunks)))
+
+    index = dest_dir / "sitemap_index.xml"
+    with open(index, "wb") as out:
+        write_sitemap_index(names, out, lastmod_date)
+    return index, names, sum(counts)
@@ -0,0 +1,72 @@
+"""
+Helpers for paginated SPARQL execution: rewrite an ordered query into
+LIMIT/OFFSET pages, and merge the page result files back into a single
+SPARQL results document, in page order.
+"""
+
+import re
+import lxml.etree as ET
+from pathlib import Path
+
+SPARQL_NS = "http://www.w3.org/2005/sparql-results#"
+
+_SELECT_RE   = re.compile(r"\bselect\b(.*?)\bwhere\b", re.IGNORECASE | re.DOTALL)
+_ORDER_BY_RE = re.compile(r"\border\s+by\b(?P<keys>.*?)\s*$", re.IGNORECASE | re.DOTALL)
+_LIMIT_RE    = re.compile(r"\b(limit|offset)\s+\d+\s*$", re.IGNORECASE)
+
+
+def paginate(query: str):
+    """
+    Return a function page(limit, offset) → query text.
+
+    The query must end with an ORDER BY clause, otherwise pages would not be
+    stable between requests. Projected variables are appended as tie-breakers,
+    so rows sharing the same sort key (e.g. one row per creating agent) keep a
+    deterministic position; the original order is unchanged.
+    """
+    query = query.rstrip()
+    if _LIMIT_RE.search(query):
+        raise ValueError("query already has LIMIT/OFFSET, cannot paginate it")
+    order = _ORDER_BY_RE.search(query)
+    if not order:
+        raise ValueError("paginated queries need a trailing ORDER BY clause")
+    select = _SELECT_RE.search(query)
+    keys   = order.group("keys").strip()
+    extra  = [v for v in dict.fromkeys(re.findall(r"\?\w+", select.group(1) if select else ""))
+              if v not in re.findall(r"\?\w+", keys)]
+    base   = query[:order.start()] + "order by " + " ".join([keys, *extra])
+
+    def page(limit: int, offset: int) -> str:
+        return f"{base}\nLIMIT {limit} OFFSET {offset}"
+    return page
+
+
+def merge_pages(pages, dest: Path) -> int:
+    """
+    Concatenate the <result>s of the SPARQL XML files *pages* (in order) into
+    *dest*, taking the <head> of the first page. Returns the result count.
+    """
+    result_tag = f"{{{SPARQL_NS}}}result"
+    head_tag   = f"{{{SPARQL_NS}}}head"
+    count      = 0
+
+    with ET.xmlfile(str(dest), encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element(f"{{{SPARQL_NS}}}sparql", nsmap={None: SPARQL_NS}):
+            head = None
+            if pages:
+                # the first page's <head> only: iterparse stops reading there
+                with open(pages[0], "rb") as fh:
+                    events = ET.iterparse(fh, tag=head_tag)
+                    head   = next(events, (None, None))[1]
+                    del events
+            xf.write(head if head is not None else ET.Element(head_tag))
+            with xf.element(f"{{{SPARQL_NS}}}results"):
+                for p in pages:
+                    for _, elem in ET.iterparse(str(p), tag=result_tag):
+                        xf.write(elem)
+                        count += 1
+                        elem.clear()
+                        while elem.getprevious() is not None:
+                            del elem.getparent()[0]
+    return count
@@ -0,0 +1,58 @@
+"""
+Startup timings
+───────────────
+Where an agent's start goes, from process start to consuming. Agents mark
+the end of each phase:
+
+    STARTUP = Startup("query_agent")    # after the imports: "imports"
+    …
+    STARTUP.mark("clients")
+
+and the AgentRunner marks "assigned" once the consumer got its partitions,
+then logs one line and sets the `startup_ms` metric:
+
+    Started in 412 ms: imports 268, clients 9, consumer 3, assigned 132
+"""
+
+import os, time
+
+
+def process_start() -> float:
+    """Epoch seconds at which this process started (now, off Linux)."""
+    try:
+        with open("/proc/self/stat") as fh:
+            ticks = int(fh.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as fh:
+            uptime = float(fh.read().split()[0])
+        return time.time() - uptime + ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class Startup:
+    def __init__(self, component: str, first: str = "imports"):
+        self.component = component
+        self.t0        = process_start()
+        self.phases    = {}                 # phase → ms since the previous mark
+        self.reported  = False
+        self._last     = self.t0
+        self.mark(first)
+
+    def mark(self, phase: str):
+        now = time.time()
+        self.phases[phase] = round((now - self._last) * 1000)
+        self._last = now
+
+    @property
+    def total_ms(self) -> int:
+        return round((self._last - self.t0) * 1000)
+
+    def report(self, log, metrics=None):
+        """Log the phases (once) and publish the total as `startup_ms`."""
+        if self.reported:
+            return
+        self.reported = True
+        log.info("Started in %s ms: %s", self.total_ms,
+                 ", ".join(f"{k} {v}" for k, v in self.phases.items()))
+        if metrics is not None:
+            metrics.set("startup_ms", self.total_ms)
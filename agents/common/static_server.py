@@ -0,0 +1,140 @@
+"""
+Concurrent, caching static file serving
+───────────────────────────────────────
+`CachingHandler` is a drop-in SimpleHTTPRequestHandler for
+`http.server.ThreadingHTTPServer` that adds:
+  * HTTP/1.1 keep-alive;
+  * an in-memory LRU cache of small files, bounded in bytes, validated
+    against (inode, size, mtime) on every hit and cleared on demand;
+  * ETag / Last-Modified validators and 304 responses;
+  * precompressed `<file>.gz` variants for clients accepting gzip;
+  * `sendfile` for files too large to cache.
+Subclasses keep overriding translate_path() for routing.
+"""
+
+import email.utils, gzip, http.server, os, shutil, threading
+from collections import OrderedDict
+from pathlib import Path
+
+COMPRESSIBLE = {".html", ".css", ".js", ".json", ".xml", ".txt", ".svg"}
+
+
+def precompress(path: Path, min_size: int = 1024) -> bool:
+    """Write path.gz next to a compressible file, return True if written."""
+    if path.suffix not in COMPRESSIBLE or path.stat().st_size < min_size:
+        return False
+    gz = path.with_name(path.name + ".gz")
+    if gz.exists():
+        return False
+    with open(path, "rb") as src, gzip.GzipFile(gz, "wb", mtime=int(path.stat().st_mtime)) as dst:
+        shutil.copyfileobj(src, dst)
+    return True
+
+
+class FileCache:
+    """Thread-safe LRU of file contents, bounded by *max_bytes*."""
+
+    def __init__(self, max_bytes: int = 64 << 20, max_item: int = 1 << 20):
+        self.max_bytes = max_bytes
+        self.max_item  = max_item
+        self._items    = OrderedDict()       # path → (validator, bytes)
+        self._size     = 0
+        self._lock     = threading.Lock()
+
+    def get(self, path: str, st: os.stat_result) -> bytes:
+        validator = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            hit = self._items.get(path)
+            if hit is not None and hit[0] == validator:
+                self._items.move_to_end(path)
+                return hit[1]
+        with open(path, "rb") as fh:
+            data = fh.read()
+        with self._lock:
+            old = self._items.pop(path, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._items[path] = (validator, data)
+            self._size += len(data)
+            while self._size > self.max_bytes and self._items:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._size -= len(evicted)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+
+class CachingHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True           # headers and body go out as separate writes
+    cache: FileCache = FileCache()
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def _serve(self, body: bool):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            index = os.path.join(path, "index.html")
+            if not self.path.split("?", 1)[0].endswith("/") or not os.path.isfile(index):
+                # redirects and directory listings: stock behaviour
+                return super().do_GET() if body else super().do_HEAD()
+            path = index
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return
+
+        variant  = path + ".gz"
+        has_gz   = os.path.isfile(variant)
+        use_gz   = has_gz and "gzip" in self.headers.get("Accept-Encoding", "")
+        serve    = variant if use_gz else path
+        st       = os.stat(serve)
+        etag     = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+        modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+
+        if self._not_modified(etag, st.st_mtime):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", modified)
+            if has_gz:                      # as on the 200: caches key the variant on it
+                self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(st.st_size))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", modified)
+        if has_gz:
+            self.send_header("Vary", "Accept-Encoding")
+        if use_gz:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        if not body:
+            return
+
+        if st.st_size <= self.cache.max_item:
+            self.wfile.write(self.cache.get(serve, st))
+        else:
+            with open(serve, "rb") as fh:
+                self.wfile.flush()
+                self.connection.sendfile(fh)
+
+    def _not_modified(self, etag: str, mtime: float) -> bool:
+        inm = self.headers.get("If-None-Match")
+        if inm is not None:
+            return etag in [t.strip() for t in inm.split(",")] or inm.strip() == "*"
+        ims = self.headers.get("If-Modified-Since")
+        if ims:
+            try:
+                return int(mtime) <= email.utils.parsedate_to_datetime(ims).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
@@ -0,0 +1,135 @@
+"""
+Per-run stage timings
+─────────────────────
+Every stage records timing spans for the run it works on. The AgentRunner
+creates a `Trace` per message and makes it current on the worker; stage code
+adds spans with
+
+    with tracing.span("sitemap.transform"):
+        ...
+
+(a no-op when no trace is current, e.g. on helper threads). The run id and
+the run's start time travel downstream as Kafka headers (`run_id`,
+`trace_t0`), so spans of all stages land in the same
+
+    /runs/<run_id>/timings.json  ← {run_id, t0, total_ms, spans: [{component, name, start, end, ms}]}
+
+Each stage also gets a `<component>.queue` span: from the moment its input
+was produced until a worker started on it (Kafka + pool wait).
+"""
+
+import fcntl, json, os, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+
+TIMINGS = "timings.json"
+
+_local = threading.local()
+
+
+class Trace:
+    def __init__(self, run_id: str | None, component: str, t0: float | None = None):
+        self.run_id    = run_id
+        self.component = component
+        self.t0        = t0 if t0 is not None else time.time()
+        self.queued_at = self.t0            # when the stage's input was produced
+        self.spans     = []
+
+    @classmethod
+    def from_message(cls, msg, component: str) -> "Trace":
+        """Context from the message headers, else from its value's run_id."""
+        headers = dict(msg.headers() or [])
+        run_id  = headers.get("run_id")
+        t0      = headers.get("trace_t0")
+        if run_id is None and isinstance(msg.value(), dict):
+            run_id = msg.value().get("run_id") or None
+        trace = cls(run_id.decode() if isinstance(run_id, bytes) else run_id, component,
+                    float(t0) if t0 is not None else produced_at(msg))
+        trace.queued_at = produced_at(msg)
+        return trace
+
+    def add(self, name: str, start: float, end: float):
+        self.spans.append({"component": self.component, "name": name,
+                           "start": start, "end": end, "ms": round((end - start) * 1000, 1)})
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time())
+
+    def headers(self) -> list:
+        if not self.run_id:
+            return []
+        return [("run_id", self.run_id.encode()), ("trace_t0", repr(self.t0).encode())]
+
+
+def produced_at(msg) -> float:
+    """Producer timestamp of *msg* (epoch seconds), or now when unavailable."""
+    kind, ms = msg.timestamp()
+    return ms / 1000 if kind and ms > 0 else time.time()
+
+
+# ─── Current trace (per thread) ───────────────────────────────────────────────
+def current() -> Trace | None:
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def activate(trace: Trace | None):
+    previous, _local.trace = current(), trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def span(name: str):
+    trace = current()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def add(name: str, start: float, end: float):
+    trace = current()
+    if trace is not None:
+        trace.add(name, start, end)
+
+
+def set_run_id(run_id: str):
+    """For the stage that creates the run: tag the current trace."""
+    trace = current()
+    if trace is not None:
+        trace.run_id = run_id
+
+
+def headers() -> list:
+    """Kafka headers carrying the current trace downstream."""
+    trace = current()
+    return trace.headers() if trace is not None else []
+
+
+# ─── timings.json ─────────────────────────────────────────────────────────────
+def write_timings(run_dir: Path, trace: Trace) -> dict:
+    """Merge the spans of *trace* into run_dir/timings.json; returns the file content."""
+    run_dir.mkdir(parents=True, exist_ok=True)
+    path = run_dir / TIMINGS
+    with open(run_dir / f".{TIMINGS}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)    # stages write from several processes
+        try:
+            timings = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            timings = {"run_id": trace.run_id, "t0": trace.t0, "spans": []}
+        timings["t0"]     = min(timings["t0"], trace.t0)
+        timings["spans"]  = sorted(timings["spans"] + trace.spans, key=lambda s: s["start"])
+        timings["total_ms"] = round((max(s["end"] for s in timings["spans"]) - timings["t0"]) * 1000, 1)
+        tmp = path.with_name(f".{TIMINGS}.{os.getpid()}")
+        tmp.write_text(json.dumps(timings, indent=1))
+        os.replace(tmp, path)
+    return timings
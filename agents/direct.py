@@ -0,0 +1,101 @@
+"""
+Direct pipeline
+───────────────
+Query agent → sitemap builder → web builder for one date, chained in this
+process: each stage's function is called with the previous one's output
+files (sparql_results.xml, sitemap.xml), with no Kafka hop, Avro encoding or
+payload store in between. Outputs land where the agents put them:
+/runs/<run_id> (results, sitemap, site.tar.gz, timings.json) and
+web.output_dir/<run_id>, ready for a deploy from the control panel.
+
+    python -m agents.direct 2025-06-20 [2025-06-23 …] [--collection OJ] [--bypass-cache]
+    docker compose run --rm web_builder python -m agents.direct 2025-06-20
+
+--no-kafka runs without a broker (logs stay on the console). The spans in
+timings.json have no `.queue` steps: compared with a run through Kafka,
+they give the cost of the hand-offs.
+"""
+
+import argparse, os, sys, time
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(prog="python -m agents.direct", description=__doc__,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("dates", nargs="+", help="publication dates (YYYY-MM-DD), one run each")
+    ap.add_argument("--collection", default="OJ", help="a key of sparql_queries")
+    ap.add_argument("--bypass-cache", action="store_true", help="skip the SPARQL result cache")
+    ap.add_argument("--no-kafka", action="store_true", help="no broker: nothing is produced")
+    args = ap.parse_args()
+    if args.no_kafka:
+        os.environ["KAFKA_BOOTSTRAP"] = ""  # read when kafka_utils is first imported
+
+    failed = 0
+    for day in args.dates:
+        try:
+            out = run(day, args.collection, args.bypass_cache)
+        except Exception as exc:
+            _log().exception(exc)
+            out = None
+        if out is None:
+            failed += 1
+            continue
+        print(f"{day}  {out['run_id']}  {out['seconds']:.2f}s  → {out['site']}")
+        for name, ms in out["spans_ms"].items():
+            print(f"    {name:24} {ms:10.1f} ms")
+    return 1 if failed else 0
+
+
+def _log():
+    from agents.common.kafka_utils import _logger
+    from agents import query_agent
+    return _logger("direct", log_topic=query_agent.TOPICS["logs_app"],
+                   settings=query_agent.CONFIG.get("logging"))
+
+
+def run(day: str, collection: str = "OJ", bypass_cache: bool = False) -> dict | None:
+    """
+    One date through the three stages; returns {run_id, site, seconds,
+    spans_ms} (the handle time of each stage, then its steps), or None for
+    an unknown collection.
+    """
+    from agents.common import tracing
+    from agents import query_agent, sitemap_builder, web_builder
+
+    t0    = time.time()
+    trace = tracing.Trace(None, "query_agent", t0)
+    with tracing.activate(trace), trace.span("query_agent.handle"):
+        raw = query_agent.fetch({"date": day, "collection": collection,
+                                 "bypass_cache": bypass_cache}, store=False)
+    if raw is None:
+        return None
+    traces = [trace]
+
+    # the SitemapRaw record, with the sitemap as a path instead of its text
+    trace = tracing.Trace(raw["run_id"], "sitemap_builder", t0)
+    with tracing.activate(trace), trace.span("sitemap_builder.handle"):
+        sitemap_path, shards = sitemap_builder.build(raw)
+    traces.append(trace)
+    out = {**{k: v for k, v in raw.items() if k != "xml"},
+           "sitemap": sitemap_path, "shards": shards}
+
+    trace = tracing.Trace(raw["run_id"], "web_builder", t0)
+    with tracing.activate(trace), trace.span("web_builder.handle"):
+        site_dir = web_builder.build(out, background=False)
+    traces.append(trace)
+    seconds = time.time() - t0
+
+    run_dir = query_agent.SHARED_DIR / raw["run_id"]
+    for trace in traces:
+        timings = tracing.write_timings(run_dir, trace)
+        handle  = next(s["ms"] for s in trace.spans if s["name"] == f"{trace.component}.handle")
+        query_agent.RUNS.stage(raw["run_id"], trace.component, "done", handle,
+                               total_ms=timings["total_ms"])
+    spans = {}
+    for span in (s for trace in traces for s in trace.spans):
+        spans[span["name"]] = round(spans.get(span["name"], 0) + span["ms"], 1)
+    return {"run_id": raw["run_id"], "site": site_dir, "seconds": seconds, "spans_ms": spans}
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,37 @@
 import json, yaml, time, requests, os
+import lxml.etree as ET
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 from agents.common.kafka_utils import (
     create_avro_producer,
     create_avro_consumer,
-    heartbeat, _logger
+    _logger,
+    producer_settings, consumer_settings, DeliveryTracker
 )
-from agents.common.id_utils import new_run_id
-from pathlib import Path
+from agents.common.agent_runner import AgentRunner
+from agents.common.id_utils import new_run_id, new_backfill_id
+from agents.common.backfill import SeenDates, Progress, date_range, create_stage
+from agents.common.payload_store import PayloadStore
+from agents.common.run_store import RunStore
+from agents.common.sparql_pages import paginate, merge_pages
+from agents.common.query_cache import QueryCache
+from agents.common import result_delta, result_rows
+from agents.common import tracing
+from agents.common.metrics import Metrics
+from agents.common.config_reload import ConfigWatcher
+from agents.common.startup import Startup
+
+STARTUP = Startup("query_agent")
 
-CONFIG = yaml.safe_load(Path("/app/config/base_config.yaml").read_text())
+CONFIG_FILE = Path(os.getenv("CONFIG_FILE", "/app/config/base_config.yaml"))
+CONFIG = yaml.safe_load(CONFIG_FILE.read_text())
 TOPICS = CONFIG["topics"]
-SHARED_DIR = Path("/runs")
+SHARED_DIR = Path(CONFIG.get("runs_dir", "/runs"))
 
-log = _logger("query_agent", log_topic=TOPICS["logs_app"])
+log = _logger("query_agent", log_topic=TOPICS["logs_app"], settings=CONFIG.get("logging"))
 log.info("Starting query agent")
+METRICS = Metrics.from_config(CONFIG.get("metrics"), "query_agent", TOPICS["hb_query_agent"])
 
 
 # --- Avro schema definitions ---
@@ -21,7 +39,13 @@ CMD_SCHEMA = '''
 {
   "type":"record",
   "name":"Cmd",
-  "fields":[{"name":"date","type":"string"},{"name":"collection","type":"string"}]
+  "fields":[
+    {"name":"date","type":"string"},
+    {"name":"collection","type":"string"},
+    {"name":"bypass_cache","type":"boolean","default":false},
+    {"name":"end_date","type":"string","default":""},
+    {"name":"backfill_id","type":"string","default":""}
+  ]
 }
 '''
 
@@ -31,17 +55,52 @@ OUT_SCHEMA = '''
   "name":"SparqlRaw",
   "fields":[
     {"name":"run_id","type":"string"},
-    {"name":"xml",   "type":"string"},
+    {"name":"xml",   "type":["string", {"type":"record","name":"PayloadRef","fields":[
+        {"name":"digest","type":"string"},
+        {"name":"size",  "type":"long"},
+        {"name":"codec", "type":"string"}]}]},
     {"name":"action","type":"string"},
-    {"name":"date",  "type":"string"}
+    {"name":"date",  "type":"string"},
+    {"name":"backfill_id","type":"string","default":""},
+    {"name":"delta","type":["null", %s],"default":null},
+    {"name":"format","type":"string","default":"xml"}
   ]
 }
-'''
+''' % result_delta.DELTA_SCHEMA
+
+PAYLOADS = PayloadStore.from_config(CONFIG.get("payload_store"))
+CACHE    = QueryCache.from_config(CONFIG.get("query_cache"))
+RUNS     = RunStore.from_config(CONFIG.get("run_store"), SHARED_DIR, PAYLOADS)
+PRODUCER, to_avro = create_avro_producer(OUT_SCHEMA,
+                                         payload_store=PAYLOADS,
+                                         payload_fields=("xml",),
+                                         settings={**producer_settings(CONFIG.get("producers"),
+                                                                       "raw_sparql_out"),
+                                                   **METRICS.client_settings()})
+DELIVERIES        = DeliveryTracker(log)
+# backfills fan out into one Cmd per date, on our own command topic
+CMD_PRODUCER, _   = create_avro_producer(CMD_SCHEMA,
+                                         settings={**producer_settings(CONFIG.get("producers"),
+                                                                       "cmd_query_agent"),
+                                                   **METRICS.client_settings()})
+BACKFILL          = CONFIG.get("backfill", {})
+BACKFILL_DIR      = SHARED_DIR / "_backfill"
+SEEN              = SeenDates(BACKFILL_DIR)
+PROGRESS          = Progress()
+STARTUP.mark("clients")
 
-PRODUCER, to_avro = create_avro_producer(OUT_SCHEMA)
-CONSUMER          = create_avro_consumer("query_agent_cmd",
-                                         [TOPICS["cmd_query_agent"]],
-                                         CMD_SCHEMA)
+def configure(cfg: dict):
+    """Swap in a reloaded config (sparql_queries, query_cache, backfill)."""
+    global CONFIG, CACHE, BACKFILL
+    for name, q in cfg["sparql_queries"].items():
+        missing = {"query", "endpoint", "parameter"} - q.keys()
+        if missing:
+            raise ValueError(f"sparql_queries.{name}: no {', '.join(sorted(missing))}")
+        result_format(q)
+    cache = CACHE
+    if cfg.get("query_cache") != CONFIG.get("query_cache"):
+        cache = QueryCache.from_config(cfg.get("query_cache"))
+    CONFIG, CACHE, BACKFILL = cfg, cache, cfg.get("backfill", {})
 
 
 def run_query(sparql, endpoint, date_param):
@@ -50,6 +109,7 @@ def run_query(sparql, endpoint, date_param):
         "Accept": "application/sparql-results+xml, application/xml;q=0.9",
         "Content-Type": "application/x-www-form-urlencoded"
     }
+    sent = time.time()
     r = requests.post(
             endpoint,
             data={"query": sparql.replace("<date>", date_param),
@@ -58,67 +118,364 @@ def run_query(sparql, endpoint, date_param):
                   "timeout":0},
             headers=headers
     )
+    # the body is read by post(): r.elapsed is the time to the response headers
+    first_byte = sent + r.elapsed.total_seconds()
+    tracing.add("query.first_byte", sent, first_byte)
+    tracing.add("query.download", first_byte, time.time())
     r.raise_for_status()
     return r.text
 
-while True:
-    try:
-        msg = CONSUMER.poll(1.0)
-        if msg is None:
-            heartbeat(PRODUCER, TOPICS["hb_query_agent"], "query_agent")
-            continue
-        if msg.error():
-            log.error(msg.error())
-            continue
-
-        log.debug(f"Message received {msg.timestamp()}: {msg.topic()}, Partition: {msg.partition()}, Offset: {msg.offset()}")
-        log.debug("Message contents:", msg.value())
-        payload = msg.value()
-        date_param = payload["date"]
-        collection_param = payload["collection"]
-        action =  collection_param
-        run_id = new_run_id(date_param)
-        run_dir = SHARED_DIR / run_id
-        run_dir.mkdir(parents=True, exist_ok=True)
-
-        log.info("Message received, Run id is %s", run_id)
-
-        if action not in CONFIG["sparql_queries"]:
-            log.warning(f"Could not find {action} in available sparql query definitions")
-            continue
-
-        cfg = CONFIG["sparql_queries"][action]
-        if 'date' in cfg['parameter']:
-            query = cfg["query"].replace('<date>', date_param)
-        else:
-            query = cfg["query"]
+SPARQL_NS    = "http://www.w3.org/2005/sparql-results#"
+STREAM_CHUNK = 64 * 1024
+# `format` of a query → what is requested, and the results file it leaves in the run dir
+MEDIA_TYPES  = {"xml":  "application/sparql-results+xml",
+                "json": "application/sparql-results+json",
+                "tsv":  "text/tab-separated-values"}
+RESULT_FILES = {"xml": "sparql_results.xml",
+                "json": "sparql_results" + result_rows.SUFFIX,
+                "tsv":  "sparql_results" + result_rows.SUFFIX}
 
-        (run_dir / "sparql_query.rdf").write_text(query)
+def result_format(cfg) -> str:
+    fmt = cfg.get("format", "xml")
+    if fmt not in MEDIA_TYPES:
+        raise ValueError(f"Unknown result format {fmt!r} (xml | json | tsv)")
+    return fmt
 
+def run_query_stream(sparql, endpoint, date_param, dest: Path,
+                     session=None, timeout=None, fmt="xml"):
+    """
+    Streaming variant of run_query(): response chunks are written to *dest*
+    as they arrive and fed to an incremental parser counting <result>s.
+    JSON and TSV responses (*fmt*) are streamed into a row batch file
+    (result_rows) instead. Returns (dest, result_count); the body is never
+    held in memory as a whole.
+    """
+    headers = {
+        "Accept": ("application/sparql-results+xml, application/xml;q=0.9"
+                   if fmt == "xml" else MEDIA_TYPES[fmt]),
+        "Content-Type": "application/x-www-form-urlencoded"
+    }
+    parser = ET.XMLPullParser(events=("end",), tag=f"{{{SPARQL_NS}}}result")
+    count  = 0
 
-        log.debug('Raw Sparql query:', query)
-        log.info("Running SPARQL for %s on %s", action, date_param)
+    sent = time.time()
+    with (session or requests).post(
+            endpoint,
+            data={"query": sparql.replace("<date>", date_param),
+                  "default-graph-uri": "",
+                  "format": MEDIA_TYPES[fmt],
+                  "timeout":0},
+            headers=headers,
+            stream=True,
+            timeout=timeout
+    ) as r:
+        first_byte = time.time()
+        tracing.add("query.first_byte", sent, first_byte)
+        r.raise_for_status()
+        with open(dest, "wb") as fh:
+            if fmt != "xml":
+                rows = result_rows.PARSERS[fmt](fh)
+                for chunk in r.iter_content(chunk_size=STREAM_CHUNK):
+                    rows.feed(chunk)
+                count = rows.close()
+            else:
+                for chunk in r.iter_content(chunk_size=STREAM_CHUNK):
+                    fh.write(chunk)
+                    parser.feed(chunk)
+                    for _, elem in parser.read_events():
+                        count += 1
+                        # drop parsed results so the tree stays flat
+                        elem.clear()
+                        while elem.getprevious() is not None:
+                            del elem.getparent()[0]
+                parser.close()
+    tracing.add("query.download", first_byte, time.time())
+    return dest, count
+
+def run_query_paged(sparql, endpoint, date_param, run_dir: Path, pcfg: dict, fmt="xml"):
+    """
+    Paginated variant: the query is rewritten into ordered LIMIT/OFFSET pages
+    fetched concurrently over pooled connections. New pages are scheduled
+    until one comes back short; a failing page (request error, or a body that
+    does not parse) is retried on its own, up to `max_retries` times. Pages
+    are merged into run_dir/sparql_results.xml (.rows for JSON and TSV).
+    """
+    page_size   = int(pcfg.get("page_size", 5000))
+    workers     = int(pcfg.get("workers", 4))
+    max_retries = int(pcfg.get("max_retries", 3))
+    timeout     = pcfg.get("http_timeout", 300)
+    page_query  = paginate(sparql)
+    pages_dir   = run_dir / "pages"
+    dest        = run_dir / RESULT_FILES[fmt]
+    suffix      = dest.suffix
+    pages_dir.mkdir(parents=True, exist_ok=True)
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def fetch(n):
+        for attempt in range(max_retries + 1):
+            try:
+                path, count = run_query_stream(page_query(page_size, n * page_size), endpoint,
+                                               date_param, pages_dir / f"page-{n:05d}{suffix}",
+                                               session=session, timeout=timeout, fmt=fmt)
+                if count > page_size:
+                    raise ValueError(f"{count} results for a page of {page_size}")
+                return path, count
+            # a body cut short parses as invalid XML / JSON: retried like a failed request
+            except (requests.RequestException, ET.ParseError, ValueError) as exc:
+                if attempt == max_retries:
+                    raise
+                log.warning("Page %s failed (%s), retry %s/%s", n, exc, attempt + 1, max_retries)
+                time.sleep(2 ** attempt)
+
+    done, last_page, next_page = {}, None, 0
+    # pages run on helper threads: one span for all of them
+    with tracing.span("query.pages"), session, ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while True:
+            while len(running) < workers and last_page is None:
+                running[pool.submit(fetch, next_page)] = next_page
+                next_page += 1
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                n = running.pop(fut)
+                path, count = fut.result()
+                done[n] = path
+                if count < page_size and (last_page is None or n < last_page):
+                    last_page = n
 
+    pages = [done[n] for n in range(last_page + 1)]
+    log.info("Fetched %s pages of up to %s results", len(pages), page_size)
+    with tracing.span("query.merge"):
+        return dest, (merge_pages if fmt == "xml" else result_rows.merge)(pages, dest)
+
+def fetch_results(cfg, query, date_param, run_dir: Path, bypass_cache=False, store=True):
+    """
+    Run a configured query through the result cache, leaving the results in
+    run_dir/sparql_results.xml (.rows with `format: json | tsv`). Returns the
+    `xml` field of the SparqlRaw record: a PayloadRef in stream/paged mode
+    (always for row files), the result text otherwise.
+    Without *store*, the path of the results file (direct mode).
+    """
+    fmt      = result_format(cfg)
+    results  = run_dir / RESULT_FILES[fmt]
+    streamed = bool(cfg.get("pagination") or cfg.get("stream", False) or fmt != "xml")
+    params   = {"date": date_param} if fmt == "xml" else {"date": date_param, "format": fmt}
+    key      = QueryCache.key(query, cfg["endpoint"], params)
+
+    with tracing.span("query.cache_lookup"):
+        hit = None if bypass_cache else CACHE.get(key, results)
+    if hit:
+        log.info("Query cache hit, %s bytes (hits=%s, misses=%s)",
+                 hit["size"], CACHE.hits, CACHE.misses)
+        if not store:
+            return results
+        return PAYLOADS.put_file(results) if streamed else results.read_text()
+    if bypass_cache:
+        log.info("Query cache bypassed")
+    else:
+        log.info("Query cache miss (hits=%s, misses=%s)", CACHE.hits, CACHE.misses)
+
+    if streamed:
+        if cfg.get("pagination"):
+            results_path, n_results = run_query_paged(
+                cfg["query"], cfg["endpoint"], date_param,
+                run_dir, cfg["pagination"], fmt=fmt
+            )
+        else:
+            results_path, n_results = run_query_stream(
+                cfg["query"], cfg["endpoint"], date_param, results, fmt=fmt
+            )
+        log.info("Results obtained, %s results, %s bytes",
+                 n_results, results_path.stat().st_size)
+        # always goes by reference: the result is never loaded as a str
+        with tracing.span("query.store"):
+            xml = PAYLOADS.put_file(results_path) if store else results_path
+    else:
         xml = run_query(cfg["query"], cfg["endpoint"], date_param)
 
         log.info("Results obtained,  %s characters", len(xml))
 
-        (run_dir / "sparql_results.xml").write_text(xml)
-
-        k_payload={
-            "run_id": run_id,
-            "xml": xml,
-            "action": action,
-            "date": date_param
-        }
-
-        PRODUCER.produce(TOPICS["raw_sparql_out"],
-                         value=k_payload)
-
-        PRODUCER.flush()
-    except KeyboardInterrupt:
-        log.info("Shutting down query agent.")
-        break
-    except Exception as e:
-        print("Catched exception ", e)
-        log.exception(e)
+        results.write_text(xml)
+        n_results = None
+        if not store:
+            xml = results
+
+    CACHE.put(key, results, n_results,
+              QueryCache.expiry(cfg.get("cache"), date_param))
+    return xml
+
+def compare_with_previous(action, date_param, run_dir: Path, fmt="xml") -> dict | None:
+    """
+    Fingerprint run_dir's results against the last run of the same date
+    (result_delta); the `delta` field of the SparqlRaw record.
+    """
+    previous = SEEN.load(action).get(date_param)
+    delta    = result_delta.record(run_dir, run_dir / RESULT_FILES[fmt],
+                                   SHARED_DIR / previous if previous else None)
+    if delta is None:
+        log.info("No previous run of %s to compare results with", date_param)
+    elif result_delta.unchanged(delta):
+        log.info("Results identical to run %s (%s acts)", previous, delta["unchanged"])
+    else:
+        log.info("Results against run %s: %s added, %s changed, %s removed, %s unchanged",
+                 previous, delta["added"], delta["changed"], delta["removed"], delta["unchanged"])
+    return delta
+
+def expand_backfill(payload) -> list[dict]:
+    """Backfill command → one Cmd per date that still has to be fetched."""
+    action = payload["collection"]
+    days   = date_range(payload["date"], payload["end_date"])
+    if not days or len(days) > int(BACKFILL.get("max_days", 366)):
+        raise ValueError(f"Backfill {payload['date']} → {payload['end_date']} refused: "
+                         f"{len(days)} days (backfill.max_days)")
+    if action not in CONFIG["sparql_queries"]:
+        log.warning("Could not find %s in available sparql query definitions", action)
+        return []
+
+    # dates that were fetched and can no longer change reuse their run
+    rules  = CONFIG["sparql_queries"][action].get("cache")
+    seen   = {} if payload.get("bypass_cache") else SEEN.load(action)
+    reused = {d: seen[d] for d in days if d in seen and QueryCache.expiry(rules, d) is None}
+    todo   = [d for d in days if d not in reused]
+
+    backfill_id = new_backfill_id(days[0], days[-1])
+    create_stage(BACKFILL_DIR, backfill_id,
+                 {"start": days[0], "end": days[-1], "collection": action, "total": len(days)},
+                 reused)
+    PROGRESS.start(backfill_id, len(todo))
+    log.info("Backfill %s: %s dates, %s to fetch, %s reused",
+             backfill_id, len(days), len(todo), len(reused))
+    return [{"date": d, "collection": action,
+             "bypass_cache": payload.get("bypass_cache", False),
+             "end_date": "", "backfill_id": backfill_id} for d in todo]
+
+def handle(topic, payload) -> dict | list | None:
+    """
+    Command → raw.sparql.out record (None for an unknown collection), or
+    for a backfill, the list of per-date commands.
+    """
+    log.debug("Message contents: %s", payload)
+    if payload.get("end_date"):
+        return expand_backfill(payload)
+    k_payload = fetch(payload)
+    if k_payload is None:
+        return None
+    # offload on the worker, not in the serializer on the polling thread
+    with tracing.span("query.store"):
+        return PAYLOADS.offload(k_payload, ("xml",))
+
+def fetch(payload, store=True) -> dict | None:
+    """
+    One date's command → SparqlRaw record, None for an unknown collection.
+    Without *store*, `xml` is the path of the results file (direct mode).
+    """
+    date_param = payload["date"]
+    collection_param = payload["collection"]
+    action =  collection_param
+    # checked before the run exists: an unknown collection leaves no run behind
+    if action not in CONFIG["sparql_queries"]:
+        log.warning("Could not find %s in available sparql query definitions", action)
+        return None
+
+    run_id = new_run_id(date_param)
+    tracing.set_run_id(run_id)
+    run_dir = SHARED_DIR / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
+    RUNS.start(run_id, date_param, collection_param, payload.get("backfill_id", ""))
+
+    log.info("Message received, Run id is %s", run_id)
+
+    cfg = CONFIG["sparql_queries"][action]
+    if 'date' in cfg['parameter']:
+        query = cfg["query"].replace('<date>', date_param)
+    else:
+        query = cfg["query"]
+
+    (run_dir / "sparql_query.rdf").write_text(query)
+
+
+    log.debug('Raw Sparql query: %s', query)
+    log.info("Running SPARQL for %s on %s", action, date_param)
+
+    xml = fetch_results(cfg, query, date_param, run_dir,
+                        bypass_cache=payload.get("bypass_cache", False),
+                        store=store)
+
+    delta = None
+    if CONFIG.get("delta", {}).get("enabled", True):
+        with tracing.span("query.delta"):
+            delta = compare_with_previous(action, date_param, run_dir, result_format(cfg))
+
+    SEEN.mark(action, date_param, run_id)
+    backfill_id = payload.get("backfill_id", "")
+    if backfill_id:
+        done, total, rate = PROGRESS.done(backfill_id)
+        log.info("Backfill %s: %s/%s dates fetched (%.1f dates/min)",
+                 backfill_id, done, total or "?", rate)
+
+    return {
+        "run_id": run_id,
+        "xml": xml,
+        "action": action,
+        "date": date_param,
+        "backfill_id": backfill_id,
+        "delta": delta,
+        "format": "xml" if result_format(cfg) == "xml" else "rows"
+    }
+
+def publish(topic, payload, k_payload):
+    if k_payload is None:
+        return
+    if isinstance(k_payload, list):         # backfill → per-date commands
+        for cmd in k_payload:
+            CMD_PRODUCER.produce(TOPICS["cmd_query_agent"], value=cmd,
+                                 on_delivery=DELIVERIES.callback(cmd["backfill_id"]))
+        CMD_PRODUCER.poll(0)
+        return
+    PRODUCER.produce(TOPICS["raw_sparql_out"],
+                     value=k_payload,
+                     headers=tracing.headers(),
+                     on_delivery=DELIVERIES.callback(k_payload["run_id"]))
+    PRODUCER.poll(0)
+
+def tick():
+    PRODUCER.poll(0)                        # serve delivery callbacks
+    CMD_PRODUCER.poll(0)
+
+def checkpoint() -> int:
+    return DELIVERIES.checkpoint(PRODUCER) + DELIVERIES.checkpoint(CMD_PRODUCER)
+
+def runner() -> AgentRunner:
+    consumer = create_avro_consumer("query_agent_cmd",
+                                    [TOPICS["cmd_query_agent"]],
+                                    CMD_SCHEMA,
+                                    auto_commit=False,
+                                    settings={**consumer_settings(CONFIG.get("consumers"),
+                                                                  "query_agent", "query_agent_cmd"),
+                                              **METRICS.client_settings()})
+    STARTUP.mark("consumer")
+    return AgentRunner.from_config(CONFIG.get("runner"), "query_agent",
+                                   consumer, [TOPICS["cmd_query_agent"]], handle, log,
+                                   on_result=publish,
+                                   checkpoint=checkpoint,
+                                   tick=tick,
+                                   runs_dir=SHARED_DIR,
+                                   metrics_topic=TOPICS.get("metrics"),
+                                   metrics=METRICS,
+                                   startup=STARTUP,
+                                   run_store=RUNS,
+                                   reload=ConfigWatcher.from_config(CONFIG_FILE, CONFIG, configure, log))
+
+def main():
+    METRICS.start()
+    runner().run()
+    log.info("Shutting down query agent.")
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,68 @@
-import json, yaml, lxml.etree as ET
+import hashlib, io, json, os, threading, yaml, lxml.etree as ET
 from datetime import date
 from pathlib import Path
 from agents.common.kafka_utils import (
     create_avro_consumer,
     create_avro_producer,
-    heartbeat, _logger
+    _logger,
+    producer_settings, consumer_settings, DeliveryTracker
 )
+from agents.common.agent_runner import AgentRunner
+from agents.common.payload_store import PayloadStore, is_ref
+from agents.common.run_store import RunStore
+from agents.common.sitemap_stream import group_results, group_rows, write_sitemap, build_sitemap_shards
+from agents.common import tracing, result_delta, result_rows, site_archive
+from agents.common.metrics import Metrics
+from agents.common.startup import Startup
+from agents.common.config_reload import ConfigWatcher
 
-CONFIG = yaml.safe_load(Path("/app/config/base_config.yaml").read_text())
+STARTUP = Startup("sitemap_builder")
+
+CONFIG_FILE = Path(os.getenv("CONFIG_FILE", "/app/config/base_config.yaml"))
+CONFIG = yaml.safe_load(CONFIG_FILE.read_text())
 TOPICS = CONFIG["topics"]
-SHARED_DIR = Path("/runs")
+SHARED_DIR = Path(CONFIG.get("runs_dir", "/runs"))
 
-log = _logger("sitemap_builder", log_topic=TOPICS["logs_app"])
+log = _logger("sitemap_builder", log_topic=TOPICS["logs_app"], settings=CONFIG.get("logging"))
 log.info("Starting sitemap builder")
+METRICS = Metrics.from_config(CONFIG.get("metrics"), "sitemap_builder", TOPICS["hb_sitemap_builder"])
+
+_XSLT = threading.local()          # lxml XSLT objects are not shared across workers
+
+def load_xslt(path) -> tuple[str, str, bytes]:
+    """(path, sha256, content) of a stylesheet."""
+    data = Path(path).read_bytes()
+    return str(path), hashlib.sha256(data).hexdigest(), data
+
+def compile_xslt(source) -> ET.XSLT:
+    path, _, data = source
+    return ET.XSLT(ET.fromstring(data, base_url=path))
 
-XSLT = ET.XSLT(ET.parse(CONFIG["xslt"]["raw_to_sitemap"]))
+def xslt():
+    """The current stylesheet, compiled once per worker thread and content hash."""
+    _, digest, _ = XSLT_SOURCE
+    cache = _XSLT.__dict__.setdefault("cache", {})
+    if digest not in cache:
+        if len(cache) >= 4:
+            cache.pop(next(iter(cache)))
+        cache[digest] = compile_xslt(XSLT_SOURCE)
+    return cache[digest]
+
+def configure(cfg: dict):
+    """(Re)load the engine, sharding and stylesheet settings; the XSLT must compile."""
+    global CONFIG, ENGINE, SHARDS, XSLT_SOURCE
+    engine = cfg["xslt"].get("engine", "xslt")      # xslt | stream
+    if engine not in ("xslt", "stream"):
+        raise ValueError(f"xslt.engine: unknown engine {engine!r}")
+    source = load_xslt(cfg["xslt"]["raw_to_sitemap"])
+    if engine == "xslt":
+        compile_xslt(source)                        # raises on a broken stylesheet
+    shards = cfg.get("sitemap", {})
+    if shards.get("sharded") and engine != "stream":
+        log.warning("Sharded sitemaps need xslt.engine=stream, writing a single sitemap")
+    CONFIG, ENGINE, SHARDS, XSLT_SOURCE = cfg, engine, shards, source
+
+configure(CONFIG)
 
 # ---------- Avro schemas ----------
 IN_SCHEMA = '''
@@ -23,12 +71,18 @@ IN_SCHEMA = '''
   "name":"SparqlRaw",
   "fields":[
     {"name":"run_id","type":"string"},
-    {"name":"xml",   "type":"string"},
+    {"name":"xml",   "type":["string", {"type":"record","name":"PayloadRef","fields":[
+        {"name":"digest","type":"string"},
+        {"name":"size",  "type":"long"},
+        {"name":"codec", "type":"string"}]}]},
     {"name":"action","type":"string"},
-    {"name":"date",  "type":"string"}
+    {"name":"date",  "type":"string"},
+    {"name":"backfill_id","type":"string","default":""},
+    {"name":"delta","type":["null", %s],"default":null},
+    {"name":"format","type":"string","default":"xml"}
   ]
 }
-'''
+''' % result_delta.DELTA_SCHEMA
 
 OUT_SCHEMA = '''
 {
@@ -36,58 +90,200 @@ OUT_SCHEMA = '''
   "name":"SitemapRaw",
   "fields":[
     {"name":"run_id","type":"string"},
-    {"name":"sitemap","type":"string"},
+    {"name":"sitemap","type":["string", {"type":"record","name":"PayloadRef","fields":[
+        {"name":"digest","type":"string"},
+        {"name":"size",  "type":"long"},
+        {"name":"codec", "type":"string"}]}]},
     {"name":"action", "type":"string"},
-    {"name":"date",   "type":"string"}
+    {"name":"date",   "type":"string"},
+    {"name":"shards", "type":{"type":"array","items":"string"},"default":[]},
+    {"name":"backfill_id","type":"string","default":""},
+    {"name":"delta","type":["null", %s],"default":null}
   ]
 }
-'''
+''' % result_delta.DELTA_SCHEMA
 
-PRODUCER, _     = create_avro_producer(OUT_SCHEMA)
-CONSUMER        = create_avro_consumer("sitemap_builder",
-                                       [TOPICS["raw_sparql_out"]],
-                                       IN_SCHEMA)
-
-while True:
-    try:
-        msg = CONSUMER.poll(1.0)
-        if msg is None:
-            heartbeat(PRODUCER, TOPICS["hb_sitemap_builder"], "sitemap_builder")
-            continue
-        if msg.error():
-            log.error(msg.error())
-            continue
+PAYLOADS        = PayloadStore.from_config(CONFIG.get("payload_store"))
+PRODUCER, _     = create_avro_producer(OUT_SCHEMA,
+                                       payload_store=PAYLOADS,
+                                       payload_fields=("sitemap",),
+                                       settings={**producer_settings(CONFIG.get("producers"),
+                                                                     "raw_sitemap_out"),
+                                                 **METRICS.client_settings()})
+DELIVERIES      = DeliveryTracker(log)
+RUNS            = RunStore.from_config(CONFIG.get("run_store"), SHARED_DIR, PAYLOADS)
+STARTUP.mark("clients")
 
-        payload = msg.value()
-        log.info("Message received, Run id is %s", payload['run_id'])
+def sitemap_xslt(payload, dest: Path) -> int:
+    with tracing.span("sitemap.parse"), _source(payload) as source:
+        if payload.get("format") == "rows":      # back to SPARQL XML for the stylesheet
+            xml = io.BytesIO()
+            result_rows.write_xml(source, xml)
+            xml.seek(0)
+            source = xml
+        xml_in = ET.parse(source)
 
-        xml_in = ET.fromstring(payload["xml"].encode())
-
-        sitemap_xml = XSLT(
+    with tracing.span("sitemap.transform"):
+        sitemap_xml = xslt()(
                 xml_in,
                 issuedDate=ET.XSLT.strparam(payload['date']),
                 lastmodDate=ET.XSLT.strparam(date.today().isoformat())
                 )
-        sitemap_txt = str(sitemap_xml)
-
-        ns_out = {'sm': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
-        url_count = len(sitemap_xml.xpath('//sm:url', namespaces=ns_out))
-
-        log.info('Sitemap generated, contains %s urls', url_count)
-
-        # dump for debugging
-        run_dir = SHARED_DIR / payload["run_id"]
-        run_dir.mkdir(parents=True, exist_ok=True)
-        (run_dir / "sitemap.xml").write_text(sitemap_txt)
-
-        PRODUCER.produce(
-            TOPICS["raw_sitemap_out"],
-            value={**payload, "sitemap": sitemap_txt}
-        )
-        PRODUCER.flush()
-    except KeyboardInterrupt:
-        log.info("Shutting down sitemap builder.")
-        break
-    except Exception as e:
-        print("Catched exception ", e)
-        log.exception(e)
+    with tracing.span("sitemap.serialize"):
+        dest.write_text(str(sitemap_xml))
+
+    ns_out = {'sm': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
+    return len(sitemap_xml.xpath('//sm:url', namespaces=ns_out))
+
+def _source(payload):
+    """`xml` as a binary file: a PayloadRef, a path (direct mode) or the text itself."""
+    xml = payload["xml"]
+    if is_ref(xml):
+        return PAYLOADS.open(xml)
+    return open(xml, "rb") if isinstance(xml, Path) else io.BytesIO(xml.encode())
+
+def _grouper(payload):
+    """`xml` is SPARQL XML or (format: rows) a row batch file."""
+    return group_rows if payload.get("format") == "rows" else group_results
+
+def sitemap_stream(payload, dest: Path) -> int:
+    with tracing.span("sitemap.transform"), _source(payload) as source:
+        groups = list(_grouper(payload)(source).values())
+    with tracing.span("sitemap.serialize"), open(dest, "wb") as out:
+        return write_sitemap(groups, out,
+                             issued_date=payload['date'],
+                             lastmod_date=date.today().isoformat())
+
+def sitemap_shards(payload, run_dir: Path):
+    """Sharded variant: run_dir/sitemap-N.xml.gz + run_dir/sitemap_index.xml."""
+    with tracing.span("sitemap.shards"), _source(payload) as source:
+        return build_sitemap_shards(source, run_dir,
+                                    issued_date=payload['date'],
+                                    lastmod_date=date.today().isoformat(),
+                                    shard_size=int(SHARDS.get("shard_size", 50000)),
+                                    workers=int(SHARDS.get("workers", 4)),
+                                    group=_grouper(payload))
+
+
+def handle(topic, payload) -> dict:
+    """raw.sparql.out record → raw.sitemap.out record."""
+    sitemap_path, shards = build(payload)
+    # sharded: `sitemap` holds the index, shards stay in the run dir
+    with tracing.span("sitemap.store"):
+        sitemap = PAYLOADS.value_for_file(sitemap_path)
+    return {**payload,
+            "sitemap": sitemap,
+            "shards": shards}
+
+# a dot file: not the data feed's sitemap.json, not matched by sitemap* globs
+SITEMAP_META = ".sitemap_meta.json"
+
+def settings(payload) -> dict:
+    """What the sitemap is a function of, besides the results."""
+    return {"engine":     ENGINE,
+            "xslt":       XSLT_SOURCE[1] if ENGINE == "xslt" else None,
+            "sharded":    bool(ENGINE == "stream" and SHARDS.get("sharded")),
+            "shard_size": int(SHARDS.get("shard_size", 50000)),
+            "issued":     payload["date"],
+            "lastmod":    date.today().isoformat()}
+
+def reuse_previous(payload, run_dir: Path) -> tuple[Path, list[str]] | None:
+    """
+    The previous run's sitemap files linked into run_dir, when its results
+    were the same (result_delta) and so are the settings; None otherwise.
+    """
+    delta = payload.get("delta")
+    if not result_delta.unchanged(delta):
+        return None
+    prev_dir = SHARED_DIR / delta["previous_run_id"]
+    try:
+        meta = json.loads((prev_dir / SITEMAP_META).read_text())
+    except (OSError, ValueError):
+        return None
+    if meta.get("settings") != settings(payload):
+        return None
+    names = [meta["sitemap"], *meta["shards"]]
+    if not all((prev_dir / name).is_file() for name in names):
+        return None
+    with tracing.span("sitemap.link"):
+        for name in names:
+            (run_dir / name).unlink(missing_ok=True)
+            site_archive.link_or_copy(prev_dir / name, run_dir / name)
+        (run_dir / SITEMAP_META).write_text(json.dumps(meta))
+    log.info("Results unchanged since run %s, sitemap reused (%s urls in %s file(s))",
+             prev_dir.name, meta["urls"], len(meta["shards"]) or 1)
+    return run_dir / meta["sitemap"], meta["shards"]
+
+def build(payload) -> tuple[Path, list[str]]:
+    """Sitemap of a SparqlRaw record, in its run dir → (sitemap or index path, shard names)."""
+    log.info("Message received, Run id is %s", payload['run_id'])
+
+    run_dir = SHARED_DIR / payload["run_id"]
+    run_dir.mkdir(parents=True, exist_ok=True)
+    reused = reuse_previous(payload, run_dir)
+    if reused:
+        return reused
+    sitemap_path = run_dir / "sitemap.xml"
+    shards = []
+    meta   = {"settings": settings(payload)}      # before the build: today may end during it
+
+    if ENGINE == "stream" and SHARDS.get("sharded"):
+        sitemap_path, shards, url_count = sitemap_shards(payload, run_dir)
+    elif ENGINE == "stream":
+        url_count = sitemap_stream(payload, sitemap_path)
+    else:
+        url_count = sitemap_xslt(payload, sitemap_path)
+
+    log.info('Sitemap generated, contains %s urls in %s file(s)',
+             url_count, len(shards) or 1)
+    meta.update(sitemap=sitemap_path.name, shards=shards, urls=url_count)
+    (run_dir / SITEMAP_META).write_text(json.dumps(meta))
+    return sitemap_path, shards
+
+def publish(topic, payload, out):
+    PRODUCER.produce(
+        TOPICS["raw_sitemap_out"],
+        value=out,
+        headers=tracing.headers(),
+        on_delivery=DELIVERIES.callback(out["run_id"])
+    )
+    PRODUCER.poll(0)
+
+def tick():
+    PRODUCER.poll(0)                        # serve delivery callbacks
+
+def runner() -> AgentRunner:
+    # referenced payloads stay references: _source() opens them as files for
+    # either engine, so a reload that switches xslt.engine needs no new consumer
+    consumer = create_avro_consumer("sitemap_builder",
+                                    [TOPICS["raw_sparql_out"]],
+                                    IN_SCHEMA,
+                                    payload_store=PAYLOADS,
+                                    payload_fields=(),
+                                    auto_commit=False,
+                                    settings={**consumer_settings(CONFIG.get("consumers"),
+                                                                  "sitemap_builder", "sitemap_builder"),
+                                              **METRICS.client_settings()})
+    STARTUP.mark("consumer")
+    return AgentRunner.from_config(CONFIG.get("runner"), "sitemap_builder",
+                                   consumer, [TOPICS["raw_sparql_out"]], handle, log,
+                                   on_result=publish,
+                                   checkpoint=lambda: DELIVERIES.checkpoint(PRODUCER),
+                                   tick=tick,
+                                   runs_dir=SHARED_DIR,
+                                   metrics_topic=TOPICS.get("metrics"),
+                                   metrics=METRICS,
+                                   startup=STARTUP,
+                                   run_store=RUNS,
+                                   reload=ConfigWatcher.from_config(
+                                       CONFIG_FILE, CONFIG, configure, log,
+                                       files=lambda cfg: [cfg["xslt"]["raw_to_sitemap"]]))
+
+def main():
+    METRICS.start()
+    runner().run()
+    log.info("Shutting down sitemap builder.")
+    DELIVERIES.checkpoint(PRODUCER)
+
+if __name__ == "__main__":
+    main()
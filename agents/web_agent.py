@@ -2,38 +2,79 @@
 Web-Agent
 ─────────
 * Serves both **staging** and **production** HTML trees over HTTP.
-* Listens to two *Avro* command topics:
-    • `cmd.web_agent.deploy`  – promote a run_id from /srv/staging → /srv/prod
-    • `cmd.web_agent.clean`   – delete a run_id from /srv/staging
+* Listens to three *Avro* command topics:
+    • `cmd.web_agent.deploy`   – promote a run_id from /srv/staging → prod
+    • `cmd.web_agent.rollback` – point prod back to an earlier release
+    • `cmd.web_agent.clean`    – delete a run_id from /srv/staging
 * Emits heart-beats (`hb_web_agent`) and structured logs (`logs_app`).
+* Answers run lookups from the run index: `/_runs[?date=…&limit=…]` and
+  `/_runs/<run_id>` (JSON, see agents/common/run_store.py).
 
 Directory layout (defined in base_config.yaml):
-    /srv/staging/<run_id>/_site/…   ← written by Web-Builder
-    /srv/prod/                      ← active public site
+    /srv/staging/<run_id>/…           ← written by Web-Builder
+    /srv/prod/releases/<run_id>/…     ← immutable promoted releases
+    /srv/prod/current → releases/…    ← active public site (symlink)
+    /srv/prod/releases.json           ← promotion history, oldest first
+    /runs/_index.sqlite               ← run index (promotions are recorded there)
+
+A release shares (hardlinks) every file that did not change with the
+previous one, so promotion copies only what changed; going live is a single
+atomic symlink swap, and so is a rollback. A site synced into /srv/prod by
+earlier versions is moved into releases/legacy at startup (and served from
+there until the next promotion, if nothing else is).
 """
 
 import os, json, time, shutil, http.server, socketserver, yaml, signal
-import filecmp
+import sqlite3, urllib.parse
 from pathlib import Path
 from threading import Thread
 from agents.common.kafka_utils import (
     create_avro_consumer,
     create_avro_producer,
-    heartbeat,
+    consumer_settings,
     _logger
 )
+from agents.common.agent_runner import AgentRunner
+from agents.common import site_manifest, tracing
+from agents.common.metrics import Metrics
+from agents.common.startup import Startup
+from agents.common.static_server import CachingHandler, FileCache, precompress
+from agents.common.config_reload import ConfigWatcher
+from agents.common.payload_store import PayloadStore
+from agents.common.run_store import RunStore
+
+STARTUP = Startup("web_agent")
 
 # ─── Configuration ────────────────────────────────────────────────────────────
-CONFIG       = yaml.safe_load(Path("/app/config/base_config.yaml").read_text())
+CONFIG_FILE  = Path(os.getenv("CONFIG_FILE", "/app/config/base_config.yaml"))
+CONFIG       = yaml.safe_load(CONFIG_FILE.read_text())
 TOPICS       = CONFIG["topics"]
 WEB_CFG      = CONFIG.get("web_agent", {})          # optional future fields
 
 STAGING_DIR  = Path("/srv/staging")
 PROD_DIR     = Path("/srv/prod")
+RELEASES_DIR = PROD_DIR / "releases"
+CURRENT      = PROD_DIR / "current"
+HISTORY      = PROD_DIR / "releases.json"
+KEEP         = int(WEB_CFG.get("keep_releases", 5))
+HTTP_CFG     = WEB_CFG.get("http", {})
 PORT         = int(os.getenv("WEB_AGENT_PORT", 8080))
+SHARED_DIR   = Path(CONFIG.get("runs_dir", "/runs"))
 
-log = _logger("web_agent", log_topic=TOPICS["logs_app"])
+log = _logger("web_agent", log_topic=TOPICS["logs_app"], settings=CONFIG.get("logging"))
 log.info("Starting web agent")
+METRICS = Metrics.from_config(CONFIG.get("metrics"), "web_agent", TOPICS["hb_web_agent"])
+
+def configure(cfg: dict):
+    """Reloaded settings: keep_releases. The HTTP server keeps its start settings."""
+    global CONFIG, WEB_CFG, KEEP
+    web_cfg = cfg.get("web_agent", {})
+    keep    = int(web_cfg.get("keep_releases", 5))
+    if keep < 1:
+        raise ValueError("web_agent.keep_releases must be at least 1")
+    if web_cfg.get("http", {}) != HTTP_CFG:
+        log.warning("web_agent.http changed: restart the web agent to apply it")
+    CONFIG, WEB_CFG, KEEP = cfg, web_cfg, keep
 
 # ─── Avro schemas for command topics ──────────────────────────────────────────
 DEPLOY_SCHEMA = """
@@ -63,35 +104,103 @@ OUT_SCHEMA = '''
 
 
 
+COMMAND_TOPICS = [TOPICS["cmd_web_agent_deploy"], TOPICS["cmd_web_agent_clean"],
+                  TOPICS["cmd_web_agent_rollback"]]
 PRODUCER, _  = create_avro_producer(OUT_SCHEMA)
-CONSUMER = create_avro_consumer(
-    group="web_agent_cmds",
-    topics=[TOPICS["cmd_web_agent_deploy"], TOPICS["cmd_web_agent_clean"]],
-    value_schema_str=DEPLOY_SCHEMA  # will also work for CLEAN (extra field ignored)
-)
+RUNS         = RunStore.from_config(CONFIG.get("run_store"), SHARED_DIR,
+                                    PayloadStore.from_config(CONFIG.get("payload_store")),
+                                    sites=STAGING_DIR)
+STARTUP.mark("clients")
 
 # ─── HTTP Server: / → prod , /staging/<run_id>/ → staging ─────────────────────
-class RouterHandler(http.server.SimpleHTTPRequestHandler):
+class RouterHandler(CachingHandler):
+    cache = FileCache(max_bytes=int(HTTP_CFG.get("cache_bytes", 64 << 20)),
+                      max_item=int(HTTP_CFG.get("cache_max_file", 1 << 20)))
+
     def translate_path(self, url: str) -> str:
         if url.startswith("/staging/"):
             return str(Path("/srv") / url.lstrip("/"))
-        return str(PROD_DIR / url.lstrip("/"))
+        return str(CURRENT / url.lstrip("/"))
+
+    def do_GET(self):
+        if self.path.startswith("/_runs"):
+            return self._runs()
+        super().do_GET()
+
+    def _runs(self):
+        """/_runs → newest runs (of ?date=, at most ?limit=); /_runs/<run_id> → one run."""
+        url    = urllib.parse.urlsplit(self.path)
+        query  = urllib.parse.parse_qs(url.query)
+        run_id = url.path[len("/_runs"):].strip("/")
+        try:
+            if run_id:
+                body = RUNS.get(run_id)
+            else:
+                body = RUNS.runs(query.get("date", [None])[0], int(query.get("limit", [50])[0]))
+        except ValueError:
+            return self.send_error(400, "Bad limit")
+        except sqlite3.Error as exc:
+            return self.send_error(503, f"Run index unavailable: {exc}")
+        if body is None:
+            return self.send_error(404, f"Unknown run {run_id}")
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Access-Control-Allow-Origin", "*")    # the control panel
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass                                # one line per request is too chatty
 
 def start_http():
-    with socketserver.TCPServer(("", PORT), RouterHandler) as httpd:
+    if HTTP_CFG.get("concurrent", True):
+        server = http.server.ThreadingHTTPServer(("", PORT), RouterHandler)
+    else:                                   # one request at a time
+        server = socketserver.TCPServer(("", PORT), RouterHandler)
+    with server as httpd:
         log.info("Serving staging=%s and prod=%s on :%s", STAGING_DIR, PROD_DIR, PORT)
         httpd.serve_forever()
 
 # ─── Helper actions ───────────────────────────────────────────────────────────
 def promote(run_id: str):
     src = STAGING_DIR / run_id
-    if not src.exists():
+    if not src.exists() and not RUNS.restore(run_id, src):     # packed by the run store?
         raise FileNotFoundError(f"staging site for run {run_id} not found ({src})")
 
-    PROD_DIR.mkdir(parents=True, exist_ok=True)
-    _sync_dirs(src, PROD_DIR)
+    RELEASES_DIR.mkdir(parents=True, exist_ok=True)
+    release = RELEASES_DIR / run_id
+    if not release.exists():
+        with tracing.span("web_agent.release"):
+            copied, linked = _build_release(src, release, _current_release())
+        log.info("Release %s created: %s files copied, %s linked", run_id, copied, linked)
 
+    with tracing.span("web_agent.switch"):
+        _switch(release)
+        RouterHandler.cache.clear()
+    _record(run_id)
+    RUNS.promoted(run_id)
     log.info("Promoted %s → prod", run_id)
+    _prune()
+
+def rollback(run_id: str = ""):
+    """Point prod to *run_id*, or to the release promoted before the current one."""
+    if not run_id:
+        history = _history()
+        current = _current_release()
+        pos = history.index(current.name) if current and current.name in history else len(history)
+        if pos == 0:
+            raise RuntimeError("no earlier release to roll back to")
+        run_id = history[pos - 1]
+
+    release = RELEASES_DIR / run_id
+    if not release.exists():
+        raise FileNotFoundError(f"release {run_id} not found ({release})")
+    _switch(release)
+    RouterHandler.cache.clear()
+    log.info("Rolled back prod → %s", run_id)
 
 def clean(run_id: str):
     target = STAGING_DIR / run_id
@@ -100,59 +209,154 @@ def clean(run_id: str):
         log.info("Deleted staging run %s", run_id)
 
 
-def _sync_dirs(src: Path, dst: Path):
+def migrate_legacy():
+    """Move a site synced straight into PROD_DIR (before releases) into releases/legacy."""
+    own   = {RELEASES_DIR.name, CURRENT.name, HISTORY.name}
+    names = [p for p in PROD_DIR.glob("*") if p.name not in own] if PROD_DIR.is_dir() else []
+    if not names:
+        return
+    release = RELEASES_DIR / "legacy"
+    if release.exists():
+        release = RELEASES_DIR / f"legacy-{int(time.time())}"
+    tmp = release.with_name(f".tmp-{release.name}")
+    tmp.mkdir(parents=True)
+    for path in names:
+        os.rename(path, tmp / path.name)
+    os.rename(tmp, release)
+    if _current_release() is None:
+        _switch(release)
+        _write_history([release.name] + _history())
+        log.info("Legacy prod site (%s entries) moved to release %s, now current", len(names), release.name)
+    else:
+        # never served next to a current release: pruned with the old releases
+        log.info("Legacy prod files (%s entries) moved to release %s", len(names), release.name)
+
+def _current_release() -> Path | None:
+    if not CURRENT.is_symlink():
+        return None
+    return RELEASES_DIR / Path(os.readlink(CURRENT)).name
+
+def _same_pages(src: Path, prev: Path | None) -> set:
+    """Pages of *src* rendered from the same records and templates as in *prev* (incremental builds)."""
+    new = site_manifest.load_manifest(src)
+    old = site_manifest.load_manifest(prev) if prev else None
+    if not new or not old or new.get("templates") != old.get("templates"):
+        return set()
+    return {k for k, v in new["pages"].items() if old["pages"].get(k, {}).get("hash") == v["hash"]}
+
+def _build_release(src: Path, release: Path, prev: Path | None):
     """
-    Copy newer/changed files from src → dst. Remove files in dst that are
-    no longer present in src. Sub-dirs created as needed.
+    Populate *release* from *src*: files unchanged since *prev* are hardlinked
+    from it (with their .gz variant), the others copied and precompressed.
+    Nothing is read to tell: a file is unchanged when its size matches and
+    so does its mtime (staged builds link unchanged files, copies keep it) or
+    its page hash in the site manifests. Built aside, then renamed in place,
+    so a release directory is always complete.
     """
-    # 1. Copy & overwrite newer files
-    shutil.copytree(src, dst, dirs_exist_ok=True)
+    tmp = release.with_name(f".tmp-{release.name}")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    copied = linked = 0
+    same   = _same_pages(src, prev)
+    # followlinks: the site's search/ is a symlink to the shared index, copied here
+    for root, _, files in os.walk(src, followlinks=True):
+        rel  = Path(root).relative_to(src)
+        page = "/".join(rel.parts[:2])
+        (tmp / rel).mkdir(parents=True, exist_ok=True)
+        names = set(files)
+        for f in files:
+            if f.endswith(".gz") and f[:-3] in names:
+                continue                    # the site's own variant: follows its file below
+            new, old = Path(root) / f, (prev / rel / f) if prev else None
+            if old is not None and old.is_file() and _unchanged(old.stat(), new.stat(), page in same):
+                os.link(old, tmp / rel / f)
+                if old.with_name(f + ".gz").is_file():
+                    os.link(old.with_name(f + ".gz"), tmp / rel / (f + ".gz"))
+                linked += 1
+            else:
+                shutil.copy2(new, tmp / rel / f)
+                precompress(tmp / rel / f)
+                copied += 1
+    os.rename(tmp, release)
+    return copied, linked
 
-    # 2. Remove stale files
-    # Walk dst; if relative path not in src, delete it.
-    for root, dirs, files in os.walk(dst, topdown=False):
-        rel_root = Path(root).relative_to(dst)
-        src_root = src / rel_root
+def _unchanged(old: os.stat_result, new: os.stat_result, same_page: bool) -> bool:
+    return old.st_size == new.st_size and (same_page or old.st_mtime_ns == new.st_mtime_ns)
 
-        # Files
-        for f in files:
-            if not (src_root / f).exists():
-                os.remove(Path(root) / f)
-        # Dirs
-        for d in dirs:
-            dst_dir = Path(root) / d
-            if not (src_root / d).exists():
-                shutil.rmtree(dst_dir)
+def _switch(release: Path):
+    """Atomically re-point the `current` symlink to *release*."""
+    tmp_link = PROD_DIR / ".current.tmp"
+    tmp_link.unlink(missing_ok=True)
+    tmp_link.symlink_to(release.relative_to(PROD_DIR))
+    os.replace(tmp_link, CURRENT)
+
+def _history() -> list:
+    try:
+        return json.loads(HISTORY.read_text())
+    except (FileNotFoundError, ValueError):
+        return []
+
+def _write_history(history: list):
+    tmp = HISTORY.with_suffix(".tmp")
+    tmp.write_text(json.dumps(history, indent=1))
+    os.replace(tmp, HISTORY)
 
-# ─── Start HTTP server in background ─────────────────────────────────────────
-Thread(target=start_http, daemon=True).start()
+def _record(run_id: str):
+    _write_history([r for r in _history() if r != run_id] + [run_id])
+
+def _prune():
+    """Keep the `keep_releases` most recently promoted releases (and current)."""
+    history = _history()
+    keep    = set(history[-KEEP:])
+    current = _current_release()
+    if current is not None:
+        keep.add(current.name)
+    for release in RELEASES_DIR.iterdir():
+        if release.is_dir() and release.name not in keep and not release.name.startswith("."):
+            shutil.rmtree(release)
+            log.info("Pruned release %s", release.name)
+    if any(r not in keep for r in history):
+        _write_history([r for r in history if r in keep])
 
 # ─── Main loop: process Kafka commands ───────────────────────────────────────
-while True:
-    try:
-            msg = CONSUMER.poll(1.0)
-            if msg is None:
-                heartbeat(PRODUCER, TOPICS["hb_web_builder"], "web_builder")
-                continue
-            if msg.error():
-                log.error(msg.error())
-                continue
-
-            topic = msg.topic()
-            cmd   = msg.value()     # Avro → dict
-            try:
-                if topic == TOPICS["cmd_web_agent_deploy"]:
-                    promote(cmd["run_id"])
-                elif topic == TOPICS["cmd_web_agent_clean"]:
-                    clean(cmd["run_id"])
-                else:
-                    log.warning("Unknown command topic %s", topic)
-            except Exception as exc:
-                log.error("Command failed: %s", exc)
-
-    except KeyboardInterrupt:
-        log.info("Shutting down Web-Agent.")
-        break
-    except Exception as e:
-        print("Catched exception ", e)
-        log.exception(e)
+def handle(topic, cmd):
+    """One command; the runner keeps them sequential (runner.web_agent.workers: 1)."""
+    if topic == TOPICS["cmd_web_agent_deploy"]:
+        promote(cmd["run_id"])
+    elif topic == TOPICS["cmd_web_agent_clean"]:
+        clean(cmd["run_id"])
+    elif topic == TOPICS["cmd_web_agent_rollback"]:
+        rollback(cmd["run_id"])
+    else:
+        log.warning("Unknown command topic %s", topic)
+
+def runner() -> AgentRunner:
+    consumer = create_avro_consumer(
+        group="web_agent_cmds",
+        topics=COMMAND_TOPICS,
+        value_schema_str=DEPLOY_SCHEMA,  # will also work for CLEAN/ROLLBACK (extra field ignored)
+        auto_commit=False,
+        settings={**consumer_settings(CONFIG.get("consumers"), "web_agent", "web_agent_cmds"),
+                  **METRICS.client_settings()}
+    )
+    STARTUP.mark("consumer")
+    return AgentRunner.from_config(CONFIG.get("runner"), "web_agent",
+                                   consumer, COMMAND_TOPICS, handle, log,
+                                   runs_dir=SHARED_DIR,
+                                   metrics_topic=TOPICS.get("metrics"),
+                                   metrics=METRICS,
+                                   startup=STARTUP,
+                                   run_store=RUNS,
+                                   reload=ConfigWatcher.from_config(CONFIG_FILE, CONFIG,
+                                                                    configure, log))
+
+def main():
+    METRICS.start()
+    migrate_legacy()
+    # ─── Start HTTP server in background ─────────────────────────────────────
+    Thread(target=start_http, daemon=True).start()
+    runner().run()
+    log.info("Shutting down Web-Agent.")
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,52 @@
-import json, os, yaml, subprocess
+import filecmp, json, os, yaml, subprocess
+from datetime import date
 from pathlib import Path
-import shutil, tarfile
+import shutil, threading, time
+from concurrent.futures import ThreadPoolExecutor
 from agents.common.kafka_utils import (
     create_avro_consumer,
     create_avro_producer,
-    heartbeat, _logger
+    consumer_settings,
+    _logger
 )
+from agents.common.agent_runner import AgentRunner
+from agents.common import tracing
+from agents.common.metrics import Metrics
+from agents.common.startup import Startup
+from agents.common.payload_store import PayloadStore
+from agents.common.run_store import RunStore
+from agents.common import site_manifest, data_feed, backfill
+from agents.common.sitemap_stream import write_sitemap_index
+from agents.common import node_deps, site_archive, result_delta, search_index
+from agents.common.config_reload import ConfigWatcher
 
-CONFIG = yaml.safe_load(Path("/app/config/base_config.yaml").read_text())
+STARTUP = Startup("web_builder")
+
+CONFIG_FILE = Path(os.getenv("CONFIG_FILE", "/app/config/base_config.yaml"))
+CONFIG = yaml.safe_load(CONFIG_FILE.read_text())
 TOPICS = CONFIG["topics"]
 WEBCFG  = CONFIG["web"]
-SHARED_DIR = Path("/runs")
+SHARED_DIR = Path(CONFIG.get("runs_dir", "/runs"))
 TEMPLATES = CONFIG["web"]["eleventy_template_dir"]
 OUTPUT_DIR = Path(CONFIG["web"]["output_dir"])
+BACKFILL     = CONFIG.get("backfill", {})
+BACKFILL_DIR = SHARED_DIR / "_backfill"
 
-log = _logger("web_builder", log_topic=TOPICS["logs_app"])
+log = _logger("web_builder", log_topic=TOPICS["logs_app"], settings=CONFIG.get("logging"))
 log.info("Starting web builder")
+METRICS = Metrics.from_config(CONFIG.get("metrics"), "web_builder", TOPICS["hb_web_builder"])
 
-# ---------- INIT ----------
-log.debug('Trying to ensure fast-xml-parser availability') 
-subprocess.check_call(["npm", "install", "--no-save", "fast-xml-parser@^5"], cwd="/app/templates")
+def configure(cfg: dict):
+    """Reloaded settings: the web section (templates, output dir, feed, …) and backfill."""
+    global CONFIG, WEBCFG, TEMPLATES, OUTPUT_DIR, BACKFILL
+    webcfg = cfg["web"]
+    if not Path(webcfg["eleventy_template_dir"]).is_dir():
+        raise ValueError(f"web.eleventy_template_dir: no directory {webcfg['eleventy_template_dir']}")
+    if (webcfg.get("node_cache"), webcfg["eleventy_template_dir"]) != \
+            (WEBCFG.get("node_cache"), TEMPLATES):
+        log.warning("Templates or node_cache changed: node modules are resolved at start only")
+    CONFIG, WEBCFG, BACKFILL = cfg, webcfg, cfg.get("backfill", {})
+    TEMPLATES, OUTPUT_DIR    = webcfg["eleventy_template_dir"], Path(webcfg["output_dir"])
 
 # ---------- Avro in-schema ----------
 IN_SCHEMA = '''
@@ -28,12 +55,18 @@ IN_SCHEMA = '''
   "name":"SitemapRaw",
   "fields":[
     {"name":"run_id",  "type":"string"},
-    {"name":"sitemap", "type":"string"},
+    {"name":"sitemap", "type":["string", {"type":"record","name":"PayloadRef","fields":[
+        {"name":"digest","type":"string"},
+        {"name":"size",  "type":"long"},
+        {"name":"codec", "type":"string"}]}]},
     {"name":"action",  "type":"string"},
-    {"name":"date",    "type":"string"}
+    {"name":"date",    "type":"string"},
+    {"name":"shards",  "type":{"type":"array","items":"string"},"default":[]},
+    {"name":"backfill_id","type":"string","default":""},
+    {"name":"delta","type":["null", %s],"default":null}
   ]
 }
-'''
+''' % result_delta.DELTA_SCHEMA
 OUT_SCHEMA = '''
 {
     "type":"record",
@@ -44,62 +77,335 @@ OUT_SCHEMA = '''
 
 # We only *consume* Avro records
 PRODUCER, _  = create_avro_producer(OUT_SCHEMA)
-CONSUMER = create_avro_consumer("web_builder",
-                                [TOPICS["raw_sitemap_out"]],
-                                IN_SCHEMA)
+PAYLOADS = PayloadStore.from_config(CONFIG.get("payload_store"))
+RUNS     = RunStore.from_config(CONFIG.get("run_store"), SHARED_DIR, PAYLOADS, sites=OUTPUT_DIR)
+STARTUP.mark("clients")
+
+def link_file(src: Path, dst: Path):
+    """Hardlink *src* to *dst*, copying when both are not on one filesystem."""
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
 def build_site():
     subprocess.check_call(["npx", "@11ty/eleventy", "--input", TEMPLATES, "--output", OUTPUT_DIR])
 
-while True:
+def run_eleventy(site_dir: Path, render_pages=None):
+    """Render into *site_dir*; with *render_pages*, only those maps pages (+ index)."""
+    env = os.environ.copy()
+    env["RUN_DIR"] = str(site_dir)
+    env["SEARCH"]  = "1" if WEBCFG.get("search", {}).get("enabled", False) else "0"
+    if render_pages is not None:
+        pages_file = site_dir / ".render_pages.json"
+        pages_file.write_text(json.dumps(sorted(render_pages)))
+        env["RENDER_PAGES"] = str(pages_file)
+    subprocess.check_call([
+        "eleventy",
+        "--input", TEMPLATES,
+        "--output", str(site_dir)
+    ], cwd=TEMPLATES, env=env)        # Eleventy’s CWD → run-dir (has sitemap.xml)
+    if render_pages is not None:
+        pages_file.unlink(missing_ok=True)
+
+# files written per run, or by every Eleventy call: never linked from a previous build
+FRESH_FILES = ["index.html", "assets", "sitemap*", "metadata.json", ".render_pages.json",   # sitemap* covers the data feed
+               search_index.SITE_DIR]
+
+def write_data_feed(payload, site_dir: Path, records, feed_cfg: dict):
+    """Pre-grouped JSON for sitemap.js, so Eleventy does not parse the XML."""
+    hierarchy = CONFIG["sparql_queries"][payload["action"]]["hierarchy"]
+    maps  = data_feed.group_records(records, hierarchy)
+    files = data_feed.write_feed(site_dir, maps, split=feed_cfg.get("split", False))
+    log.info("Data feed written: %s pages in %s file(s)", len(maps), len(files))
+
+def render_incremental(payload, site_dir: Path, records):
+    """
+    Render only the pages whose records changed since the previous build of
+    the same date; hardlink everything else from that build.
+    """
+    manifest = site_manifest.build_manifest(records, site_manifest.templates_hash(TEMPLATES))
+    prev     = site_manifest.previous_site(OUTPUT_DIR, payload["date"], payload["run_id"])
+    if prev is None:
+        log.info("No previous build for %s, full render", payload["date"])
+        run_eleventy(site_dir)
+    elif (site_manifest.load_manifest(prev) or {}).get("templates") != manifest["templates"]:
+        log.info("Templates changed since %s, full render", prev.name)
+        run_eleventy(site_dir)
+    else:
+        render, drop = site_manifest.diff_pages(site_manifest.load_manifest(prev), manifest)
+        if not render and not drop:
+            # same pages → same index; only the run's own inputs differ
+            site_manifest.link_unchanged(prev, site_dir, (), ["sitemap*", "metadata.json",
+                                                              search_index.SITE_DIR])
+            log.info("No page changed since %s, site linked", prev.name)
+        else:
+            linked = site_manifest.link_unchanged(prev, site_dir, render | drop, FRESH_FILES)
+            log.info("Rendering %s of %s pages (%s dropped), %s files linked from %s",
+                     len(render), len(manifest["pages"]), len(drop), linked, prev.name)
+            run_eleventy(site_dir, render)
+    site_manifest.write_manifest(site_dir, manifest)
+
+def handle(topic, payload):
+    """raw.sitemap.out record → site in OUTPUT_DIR/<run_id> + /runs/<run_id>/site.tar.gz"""
+    log.info("Message received, Run id is %s", payload['run_id'])
+
+    backfill_id = payload.get("backfill_id")
+    if backfill_id and BACKFILL.get("coalesce", True):
+        staged = backfill.stage_date(BACKFILL_DIR, backfill_id, payload["date"], payload["run_id"])
+        if staged is not None:
+            log.info("Backfill %s: %s/%s sitemaps staged", backfill_id, *staged)
+            if staged[0] >= staged[1]:
+                build_backfill(backfill_id)
+            return
+        log.info("Backfill %s already built, building %s on its own", backfill_id, payload["run_id"])
+
+    build(payload)
+
+def build(payload, background: bool | None = None) -> Path:
+    """One run's site: OUTPUT_DIR/<run_id>, archived to /runs/<run_id>/site.tar.gz."""
+    # 1)  write Eleventy input files *inside* the site
+    site_dir = OUTPUT_DIR / payload["run_id"]
+    site_dir.mkdir(parents=True, exist_ok=True)
+    # sharded run: sitemap is the index, shards are linked from /runs
+    sitemap = site_dir / ("sitemap_index.xml" if payload.get("shards") else "sitemap.xml")
+    if isinstance(payload["sitemap"], Path):        # direct mode: the builder's file
+        link_file(payload["sitemap"], sitemap)
+    else:
+        sitemap.write_text(payload["sitemap"])
+    for name in payload.get("shards", []):
+        link_file(SHARED_DIR / payload["run_id"] / name, site_dir / name)
+    (site_dir / "metadata.json").write_text(json.dumps(payload, indent=2, default=str))
+    build_site_dir(payload, site_dir, incremental=WEBCFG.get("incremental", False),
+                   background=background)
+    return site_dir
+
+def unchanged_site(payload, site_dir: Path) -> Path | None:
+    """
+    The previous run's site when that run had the same results (result_delta),
+    wrote the same sitemap files as *site_dir* holds now and was rendered with
+    the same templates; None otherwise.
+    """
+    delta = payload.get("delta")
+    if not result_delta.unchanged(delta):
+        return None
+    prev = OUTPUT_DIR / delta["previous_run_id"]
+    manifest = site_manifest.load_manifest(prev)
+    if manifest is None:
+        return None                     # not built incrementally, packed or pruned
+    if manifest.get("templates") != site_manifest.templates_hash(TEMPLATES):
+        return None                     # same data, other layout: render it
+    names = ["sitemap_index.xml" if payload.get("shards") else "sitemap.xml", *payload.get("shards", [])]
+    if all((prev / n).is_file() and filecmp.cmp(prev / n, site_dir / n, shallow=False) for n in names):
+        return prev
+    return None
+
+def build_site_dir(payload, site_dir: Path, incremental: bool, background: bool | None = None):
+    """Render *site_dir* (inputs already written), then archive it (*background*: aside)."""
+    prev = unchanged_site(payload, site_dir) if incremental else None
+    if prev is not None:
+        # same results, same sitemap → same pages and data feed: nothing to render
+        with tracing.span("web.link"):
+            linked = site_manifest.link_unchanged(prev, site_dir, (),
+                                                  ["metadata.json", search_index.SITE_DIR])
+            link_file(prev / site_manifest.MANIFEST, site_dir / site_manifest.MANIFEST)
+        log.info("Results unchanged since %s, site linked (%s files)", prev.name, linked)
+        records = None
+    else:
+        records = render_site_dir(payload, site_dir, incremental)
+    if WEBCFG.get("search", {}).get("enabled", False):
+        with tracing.span("web.search"):
+            update_search(site_dir, records)
+
+    log.info("Site built and staged → %s", site_dir)
+    # 3)  archive (+ debug snapshot) for inspection, by default while the next message builds
+    if background is None:
+        background = WEBCFG.get("archive", {}).get("background", True)
+    if background:
+        _PACKAGING_SLOTS.acquire()          # packaging fell behind: hold the builds back
+        PACKAGING.submit(_package_aside, payload["run_id"], site_dir, tracing.current())
+    else:
+        package(payload["run_id"], site_dir)
+
+def render_site_dir(payload, site_dir: Path, incremental: bool):
+    """Data feed and Eleventy, all pages or (*incremental*) the changed ones; returns the records read."""
+    feed_cfg    = WEBCFG.get("data_feed", {})
+    records     = None
+    if feed_cfg.get("enabled") or incremental:
+        with tracing.span("web.records"):
+            records = list(site_manifest.sitemap_records(site_dir))
+    if feed_cfg.get("enabled"):
+        with tracing.span("web.data_feed"):
+            write_data_feed(payload, site_dir, records, feed_cfg)
+
+    log.info("Generating static HTML files...")
+    # 2)  call Eleventy, output to OUTPUT_DIR/<run_id>/
+    with tracing.span("web.eleventy"):
+        if incremental:
+            render_incremental(payload, site_dir, records)
+        else:
+            run_eleventy(site_dir)
+    return records
+
+def update_search(site_dir: Path, records=None):
+    """Add the site's dates to the search index (web.search.root), then link it into site_dir/search."""
+    cfg  = WEBCFG.get("search", {})
+    root = Path(cfg.get("root", OUTPUT_DIR / "_search"))
+    if records is None:
+        records = site_manifest.sitemap_records(site_dir)
+    stats = search_index.update(root, records, prefix=int(cfg.get("prefix", search_index.PREFIX)))
+    search_index.link_into(root, site_dir)
+    log.info("Search index: %s date(s) updated, %s unchanged; %s of %s shards written, "
+             "%s bytes (%s gzipped), largest shard %s (%s bytes) in %s ms",
+             len(stats["changed"]), stats["unchanged"], stats["shards_written"], stats["shards"],
+             stats["bytes"], stats["gz_bytes"], stats["largest_shard"], stats["largest_bytes"],
+             stats["ms"])
+
+# ─── Packaging ────────────────────────────────────────────────────────────────
+PACKAGING        = ThreadPoolExecutor(max_workers=1, thread_name_prefix="package")
+_PACKAGING_SLOTS = threading.BoundedSemaphore(int(WEBCFG.get("archive", {}).get("max_pending", 2)))
+
+def package(run_id: str, site_dir: Path):
+    """/runs/<run_id>/site.tar.gz (codec per web.archive) and the optional build/ snapshot."""
+    run_dir = SHARED_DIR / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
+    # 3a)  compressed archive, on several threads
+    tar_path = run_dir / site_archive.archive_name(WEBCFG.get("archive", {}).get("codec", "gzip"))
+    with tracing.span("web.tarball"):
+        archive_site(site_dir, tar_path)
+
+    # 3b)  uncompressed tree for quick inspection (optional): links, not copies
+    if WEBCFG.get("debug_copy_to_runs", False):
+        with tracing.span("web.debug_copy"):
+            site_archive.snapshot(site_dir, run_dir / "build")
+    log.info("Site %s archived at %s", run_id, tar_path)
+
+    # 3c)  the run is complete: its artifacts go to the run store
+    with tracing.span("web.seal"):
+        RUNS.seal(run_id)
+
+def _package_aside(run_id: str, site_dir: Path, parent):
+    """package() on the packaging thread; its spans join the run's timings.json."""
+    trace = tracing.Trace(run_id, "web_builder", parent.t0 if parent else None)
     try:
-        msg = CONSUMER.poll(1.0)
-        if msg is None:
-            heartbeat(PRODUCER, TOPICS["hb_web_builder"], "web_builder")
-            continue
-        if msg.error():
-            log.error(msg.error())
+        with tracing.activate(trace):
+            package(run_id, site_dir)
+        timings = tracing.write_timings(SHARED_DIR / run_id, trace)
+        RUNS.stage(run_id, "web_builder.package", "done",
+                   round(sum(s["ms"] for s in trace.spans), 1), total_ms=timings["total_ms"])
+    except Exception:
+        log.exception("Packaging of %s failed", run_id)
+    finally:
+        _PACKAGING_SLOTS.release()
+
+def archive_site(site_dir: Path, tar_path: Path):
+    cfg = WEBCFG.get("archive", {})
+    site_archive.write_archive(site_dir, tar_path,
+                               codec=cfg.get("codec", "gzip"),
+                               level=cfg.get("level"),
+                               threads=cfg.get("threads"),
+                               block_size=int(cfg.get("block_size", site_archive.BLOCK_SIZE)))
+
+def build_backfill(backfill_id: str):
+    """One site with the sitemaps of every staged date of a backfill."""
+    stage = backfill.claim(BACKFILL_DIR, backfill_id)
+    if stage is None:
+        return                              # built by someone else
+    meta  = json.loads((stage / "backfill.json").read_text())
+    dates = backfill.staged_dates(stage)
+    if len(dates) < meta["total"]:
+        log.warning("Backfill %s: building with %s of %s dates", backfill_id, len(dates), meta["total"])
+
+    # every date's urlset file(s), linked from its run dir and listed in one index
+    site_dir = OUTPUT_DIR / backfill_id
+    site_dir.mkdir(parents=True, exist_ok=True)
+    names = []
+    for day, run_id in sorted(dates.items()):
+        run_dir = SHARED_DIR / run_id
+        try:
+            files = site_manifest.sitemap_files(run_dir)
+        except OSError:
+            files = []
+        if not files or not all((run_dir / f).exists() for f in files):
+            log.warning("Backfill %s: no sitemap for %s (run %s), skipped", backfill_id, day, run_id)
             continue
+        for f in files:
+            link_file(run_dir / f, site_dir / f"{day}-{f}")
+            names.append(f"{day}-{f}")
+    with open(site_dir / "sitemap_index.xml", "wb") as out:
+        write_sitemap_index(names, out, date.today().isoformat())
+
+    payload = {"run_id": backfill_id, "action": meta["collection"],
+               "date": meta["start"], "end_date": meta["end"],
+               "dates": sorted(dates), "shards": names}
+    (site_dir / "metadata.json").write_text(json.dumps(payload, indent=2))
+    RUNS.start(backfill_id, meta["start"], meta["collection"], backfill_id, end_date=meta["end"])
+    log.info("Backfill %s: building one site for %s dates", backfill_id, len(dates))
+    build_site_dir(payload, site_dir, incremental=False)
+    shutil.rmtree(stage)
+
+def build_ready_backfills():
+    """Backfills left complete or stale outside handle(): build them aside."""
+    after = float(BACKFILL.get("build_after", 3600))
+    for backfill_id in backfill.ready(BACKFILL_DIR, after):
+        threading.Thread(target=_build_backfill_logged, args=(backfill_id,),
+                         name=f"backfill-{backfill_id}").start()
+
+def _build_backfill_logged(backfill_id):
+    try:
+        build_backfill(backfill_id)
+    except Exception as exc:
+        log.exception(exc)
+
+_last_scan = _last_retain = 0.0
+
+def tick():
+    global _last_scan, _last_retain
+    if BACKFILL.get("coalesce", True) and time.monotonic() - _last_scan > 60:
+        _last_scan = time.monotonic()
+        build_ready_backfills()
+    if RUNS.enabled and time.monotonic() - _last_retain > RUNS.interval:
+        _last_retain = time.monotonic()
+        threading.Thread(target=_retain_logged, name="run-retention", daemon=True).start()
+
+def _retain_logged():
+    try:
+        RUNS.retain()
+    except Exception:
+        log.exception("Run retention failed")
+
+def runner() -> AgentRunner:
+    consumer = create_avro_consumer("web_builder",
+                                    [TOPICS["raw_sitemap_out"]],
+                                    IN_SCHEMA,
+                                    payload_store=PAYLOADS,
+                                    payload_fields=("sitemap",),
+                                    auto_commit=False,
+                                    settings={**consumer_settings(CONFIG.get("consumers"),
+                                                                  "web_builder", "web_builder"),
+                                              **METRICS.client_settings()})
+    STARTUP.mark("consumer")
+    return AgentRunner.from_config(CONFIG.get("runner"), "web_builder",
+                                   consumer, [TOPICS["raw_sitemap_out"]], handle, log,
+                                   tick=tick,
+                                   runs_dir=SHARED_DIR,
+                                   metrics_topic=TOPICS.get("metrics"),
+                                   metrics=METRICS,
+                                   startup=STARTUP,
+                                   run_store=RUNS,
+                                   reload=ConfigWatcher.from_config(CONFIG_FILE, CONFIG,
+                                                                    configure, log))
+
+def main():
+    # Node modules come from the image (or a cache per lockfile): no npm on a normal start
+    node_modules = node_deps.resolve(TEMPLATES, WEBCFG.get("node_cache", "/runs/_cache/node"), log)
+    os.environ["NODE_PATH"] = str(node_modules)
+    STARTUP.mark("node_modules")
+    METRICS.start()
+    runner().run()
+    PACKAGING.shutdown(wait=True)          # archives of the last builds
+    log.info("Shutting down web builder.")
 
-        payload = msg.value()
-        log.info("Message received, Run id is %s", payload['run_id'])
-
-        # 1)  write Eleventy input files *inside* the site
-        site_dir = OUTPUT_DIR / payload["run_id"]
-        site_dir.mkdir(parents=True, exist_ok=True)
-        (site_dir / "sitemap.xml").write_text(payload["sitemap"])
-        (site_dir / "metadata.json").write_text(json.dumps(payload, indent=2))
-
-        log.info("Generating static HTML files...")
-        # 2)  call Eleventy, output to OUTPUT_DIR/<run_id>/
-        env = os.environ.copy()
-        env["RUN_DIR"] = str(site_dir)
-        subprocess.check_call([
-            "eleventy",
-            "--input", "/app/templates",
-            "--output", str(site_dir)
-        ], cwd="/app/templates", env=env)        # Eleventy’s CWD → run-dir (has sitemap.xml)
-
-        log.info("Static HTML files generated, packaging...")
-        # 3a)  tar-gz the rendered site for inspection
-        run_dir = SHARED_DIR / payload["run_id"]
-        run_dir.mkdir(parents=True, exist_ok=True)
-
-        tar_path = run_dir / "site.tar.gz"
-        with tarfile.open(tar_path, "w:gz") as tar:
-            tar.add(site_dir, arcname="site")
-
-        # 3b)  uncompressed copy for quick inspection  (optional)
-        if WEBCFG.get("debug_copy_to_runs", False):
-            debug_dir = run_dir / "build"
-            if debug_dir.exists():
-                shutil.rmtree(debug_dir)
-            shutil.copytree(site_dir, debug_dir)
-
-        log.info("Site built and staged → %s (and archived at %s)", site_dir, tar_path)
-
-    except KeyboardInterrupt:
-        log.info("Shutting down web builder.")
-        break
-    except Exception as e:
-        print("Catched exception ", e)
-        log.exception(e)
+if __name__ == "__main__":
+    main()
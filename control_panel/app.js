@@ -4,7 +4,9 @@
 const proxy          = 'http://localhost:8082';          // REST-Proxy
 const buildTopic     = 'cmd.query_agent';                // kick off a build
 const deployTopic    = 'cmd.web_agent.deploy';           // promote run to prod
+const rollbackTopic  = 'cmd.web_agent.rollback';         // back to previous release
 const logTopic       = 'logs.app';                       // unified logs
+const metricsTopic   = 'metrics.app';                    // per-run stage timings
 const groupId        = 'cp-panel-' + Math.random().toString(36).slice(2,8);
 const log_pol        = 500
 const web_agent_host = 'http://localhost:8080'
@@ -17,11 +19,13 @@ const latestPanel     = document.getElementById('latestRunPanel');
 const latestRunLinkEl = document.getElementById('latestRunLink');
 const promotedLinkEl  = document.getElementById('promotedLink');
 const deployBtn       = document.getElementById('deploy');
+const waterfallEl     = document.getElementById('waterfall');
 
 /* ============================================================================
    State
 ============================================================================ */
 let latestRunId = null;
+const timings   = {};                    // run_id → {t0, spans: […]}
 
 /* ============================================================================
    Utility: JSON Avro publisher
@@ -44,18 +48,25 @@ async function publishAvro(topic, schemaObj, value) {
 ============================================================================ */
 document.getElementById('run').onclick = async () => {
   const date = document.getElementById('date').value;
+  const end_date = document.getElementById('endDate').value;   // '' → single date
+  const bypass_cache = document.getElementById('bypassCache').checked;
   if (!date) { alert('Pick a date first 🙂'); return; }
+  if (end_date && end_date < date) { alert('"Until" is before the start date'); return; }
 
   await publishAvro(buildTopic,
     { type:'record',
       name:'Cmd',
       fields:[
-        {name:'date',      type:'string'},
-        {name:'collection',type:'string'}
+        {name:'date',        type:'string'},
+        {name:'collection',  type:'string'},
+        {name:'bypass_cache',type:'boolean', default:false},
+        {name:'end_date',    type:'string',  default:''}
       ]},
-    { date, collection:'OJ' }
+    { date, collection:'OJ', bypass_cache, end_date }
   );
-  appendLog(`<span class="log_action">Triggered build for ${date}</span>`);
+  appendLog(end_date
+    ? `<span class="log_action">Triggered backfill ${date} → ${end_date}</span>`
+    : `<span class="log_action">Triggered build for ${date}</span>`);
 };
 
 /* ============================================================================
@@ -76,6 +87,21 @@ deployBtn.onclick = async () => {
   appendLog(`<span class="log_prod">Deploy request sent for ${latestRunId}</span>`);
 };
 
+/* ============================================================================
+   Roll prod back to the previous release
+============================================================================ */
+document.getElementById('rollback').onclick = async () => {
+  if (!confirm('Point production back to the previously promoted release?')) return;
+
+  await publishAvro(rollbackTopic,
+    { type:'record',
+      name:'RollbackCmd',
+      fields:[{name:'run_id', type:'string'}]},
+    { run_id: '' }                           // empty → previous release
+  );
+  appendLog(`<span class="log_prod">Rollback request sent</span>`);
+};
+
 /* ============================================================================
    Log consumer
 ============================================================================ */
@@ -100,7 +126,7 @@ async function initConsumer() {
   await fetch(`${base_uri}/subscription`, {
     method:'POST',
     headers:{ 'Content-Type':'application/vnd.kafka.v2+json' },
-    body: JSON.stringify({ topics:[logTopic] })
+    body: JSON.stringify({ topics:[logTopic, metricsTopic] })
   });
 
   /* 3. auto-delete on tab close */
@@ -132,7 +158,15 @@ async function pollLogs() {
 
 function handleRecord(r) {
   const data = JSON.parse(atob(r.value));      // binary → JSON
+  if (r.topic === metricsTopic) {
+    if (data.type === 'spans') handleSpans(data);
+    return;
+  }
+  // agents ship their logs in batches: one record holds an array of entries
+  [].concat(data).forEach(handleEntry);
+}
 
+function handleEntry(data) {
   appendLog(`<span class='log_${data.level}'>${data.level}</span> ${data.component} | ${data.msg}`);
 
   /* Detect Web-Builder completion line:
@@ -150,6 +184,7 @@ function handleRecord(r) {
 
 function setLatestRun(runId) {
   latestRunId = runId;
+  renderWaterfall(runId);
   latestRunLinkEl.textContent = runId;
   latestRunLinkEl.href        = `${web_agent_host}/staging/${runId}/`;
   latestPanel.hidden          = false;
@@ -166,6 +201,35 @@ function setPromotedRun(runId) {
     }
 }
 
+/* ============================================================================
+   Stage timings waterfall
+============================================================================ */
+function handleSpans(data) {
+  const run = timings[data.run_id] ??= { t0: data.t0, spans: [] };
+  run.t0 = Math.min(run.t0, data.t0);
+  run.spans.push(...data.spans);
+  if (!latestRunId || data.run_id === latestRunId) renderWaterfall(data.run_id);
+}
+
+function renderWaterfall(runId) {
+  const run = timings[runId];
+  if (!run) return;
+  const spans = [...run.spans].sort((a, b) => a.start - b.start);
+  const total = Math.max(...spans.map(s => s.end)) - run.t0 || 1;
+  const pct   = t => (100 * t / total).toFixed(2);
+
+  waterfallEl.innerHTML = `<strong>${runId}</strong> ${(total * 1000).toFixed(0)} ms` +
+    spans.map(s => {
+      const kind = s.name.endsWith('.queue') ? 'wf_queue'
+                 : s.name.endsWith('.handle') ? 'wf_handle' : 'wf_step';
+      return `<div class="wf_row"><span class="wf_name">${s.name}</span>` +
+             `<span class="wf_track"><span class="wf_bar ${kind}" title="${s.ms} ms"` +
+             ` style="left:${pct(s.start - run.t0)}%;width:${pct(s.end - s.start)}%"></span></span>` +
+             `<span class="wf_ms">${s.ms} ms</span></div>`;
+    }).join('');
+  waterfallEl.hidden = false;
+}
+
 /* ============================================================================
    Log display helpers
 ============================================================================ */
@@ -0,0 +1,19 @@
+"""
+End-to-end synthetic benchmarks
+───────────────────────────────
+  synthetic.py   SPARQL results generator (rows, duplicate-ELI ratio, creators per act)
+  stages.py      per-stage timings: XSLT / stream / row-file sitemap, records + data feed,
+                 Eleventy render, tar.gz packaging, release promotion
+  pipeline.py    the three pipeline agents on one in-memory broker (memkafka.py),
+                 and the same run through agents.direct (no Kafka hops)
+  report.py      results JSON and regression checks (thresholds.json)
+
+Run from the repository root, ideally in the agents image (Eleventy and the
+node modules of templates/ are needed for the site.eleventy stage and the
+full pipeline):
+
+    python -m misc.bench --rows 2000 --scale 4 --out bench.json
+    python -m misc.bench --rows 2000 --baseline bench.json
+
+The exit status is 1 when a check fails.
+"""
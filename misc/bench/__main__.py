@@ -0,0 +1,80 @@
+import argparse, json, sys, tempfile
+from pathlib import Path
+
+from . import __doc__ as DOC
+from . import report, stages
+from .env import BenchEnv
+from .synthetic import sparql_rows
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(prog="python -m misc.bench", description=DOC,
+                                 formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=2000, help="result rows of the small run")
+    ap.add_argument("--scale", type=float, default=4, help="large run = rows × scale")
+    ap.add_argument("--dup-ratio", type=float, default=0.1)
+    ap.add_argument("--creators", type=int, default=2)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--only", choices=["stages", "pipeline"])
+    ap.add_argument("--workdir", default=str(Path(tempfile.gettempdir()) / "c2x2w-bench"))
+    ap.add_argument("--out", help="results JSON (default: <workdir>/results.json)")
+    ap.add_argument("--baseline", help="earlier results JSON to compare with")
+    ap.add_argument("--thresholds", default=str(report.THRESHOLDS))
+    args = ap.parse_args()
+
+    sizes = [args.rows, int(args.rows * args.scale)]
+    data  = [sparql_rows(n, args.dup_ratio, args.creators, args.seed) for n in sizes]
+    env   = BenchEnv(Path(args.workdir))
+
+    timings = {}                            # benchmark → [small, large] or skip reason
+    if args.only != "pipeline":
+        for label, rows in zip(("small", "large"), data):
+            for name, value in stages.run(env, rows, label).items():
+                timings.setdefault(name, []).append(value)
+    if args.only != "stages":
+        from .pipeline import Pipeline, direct
+        pipeline = Pipeline(env)
+        try:
+            pipeline.run(data[0])           # warm-up: imports, XSLT compilation, first connections
+            for rows in data:
+                res = pipeline.run(rows)
+                timings.setdefault("pipeline", []).append(res["seconds"])
+                for span, ms in res["spans_ms"].items():
+                    timings.setdefault(f"pipeline:{span}", []).append(ms / 1000)
+        except (RuntimeError, TimeoutError) as exc:
+            timings["pipeline"] = [{"skipped": f"failed: {exc}"}]
+        finally:
+            pipeline.stop()
+        try:
+            for rows in data:
+                timings.setdefault("direct", []).append(direct(env, rows)["seconds"])
+        except Exception as exc:
+            timings["direct"] = [{"skipped": f"failed: {exc}"}]
+
+    results = {}
+    for name, values in timings.items():
+        if name.startswith("_"):
+            results[name] = values
+        elif any(isinstance(v, dict) for v in values):
+            results[name] = next(v for v in values if isinstance(v, dict))
+        elif len(values) == 2:
+            results[name] = report.summarize(*values, args.scale)
+
+    thresholds = json.loads(Path(args.thresholds).read_text())
+    baseline   = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    checked    = {k: v for k, v in results.items() if not k.startswith(("_", "pipeline:"))}
+    failures   = report.check(checked, thresholds, baseline)
+
+    out = Path(args.out or Path(args.workdir) / "results.json")
+    report.write(out, {**vars(args), "sizes": sizes}, results, failures)
+    print(report.table({k: v for k, v in results.items() if not k.startswith("_")}, sizes))
+    if "_formats" in results:
+        print("\n" + report.formats_table(results["_formats"], sizes))
+    print(f"\nresults → {out}")
+    for failure in failures:
+        print("FAIL", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
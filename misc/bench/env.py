@@ -0,0 +1,125 @@
+"""
+The benchmark environment: a scratch directory, a copy of
+config/base_config.yaml pointing into it, the in-memory broker and a local
+SPARQL endpoint serving synthetic rows.
+
+Agent modules read their configuration at import, so there is one
+environment per process: create it before the first `agent()` call.
+"""
+
+import http.server, importlib, os, re, shutil, threading
+from pathlib import Path
+from urllib.parse import parse_qs
+
+import yaml
+
+from .memkafka import MemoryBroker
+from .synthetic import WRITERS
+
+ROOT = Path(__file__).resolve().parents[2]
+
+_PAGE_RE = re.compile(r"LIMIT\s+(\d+)\s+OFFSET\s+(\d+)\s*$", re.IGNORECASE)
+
+
+class SparqlStandIn:
+    """
+    Answers every query with the current rows, honouring LIMIT/OFFSET pages
+    and the requested `format` (SPARQL XML, JSON or TSV).
+    """
+
+    def __init__(self):
+        self.rows     = []
+        self.requests = 0
+        stand_in      = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                form  = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+                page  = _PAGE_RE.search(form.get("query", [""])[0])
+                rows  = stand_in.rows
+                if page:
+                    limit, offset = int(page.group(1)), int(page.group(2))
+                    rows = rows[offset:offset + limit]
+                media = form.get("format", [""])[0]
+                media = media if media in WRITERS else "application/sparql-results+xml"
+                stand_in.requests += 1
+                self.send_response(200)
+                self.send_header("Content-Type", media)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                body = _Chunked(self.wfile)
+                WRITERS[media](rows, body)
+                body.close()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/sparql"
+
+
+class _Chunked:
+    """Buffered chunked transfer encoding over *wfile*."""
+
+    def __init__(self, wfile, size: int = 64 * 1024):
+        self.wfile, self.size, self.buf = wfile, size, []
+        self.pending = 0
+
+    def write(self, data: bytes):
+        self.buf.append(data)
+        self.pending += len(data)
+        if self.pending >= self.size:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.wfile.write(b"%x\r\n%s\r\n" % (self.pending, b"".join(self.buf)))
+        self.buf, self.pending = [], 0
+
+    def close(self):
+        self._flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class BenchEnv:
+    def __init__(self, workdir: Path, log_level: str = "WARNING"):
+        self.workdir = Path(workdir)
+        if self.workdir.exists():
+            shutil.rmtree(self.workdir)
+        self.runs    = self.workdir / "runs"
+        self.output  = self.workdir / "output"
+        self.runs.mkdir(parents=True)
+        self.output.mkdir()
+        self.sparql  = SparqlStandIn()
+        self.broker  = MemoryBroker().install()
+
+        config = yaml.safe_load((ROOT / "config/base_config.yaml").read_text())
+        config["runs_dir"] = str(self.runs)
+        config.setdefault("query_cache", {})["root"]   = str(self.runs / "_cache/sparql")
+        config.setdefault("payload_store", {})["root"] = str(self.runs / "_payloads")
+        config["xslt"]["raw_to_sitemap"]          = str(ROOT / "xslt/raw_to_sitemap.xslt")
+        # the pipeline runs the engine that scales; the XSLT one has its own stage (sitemap.xslt)
+        config["xslt"]["engine"]                  = "stream"
+        config["web"]["eleventy_template_dir"]    = str(ROOT / "templates")
+        config["web"]["output_dir"]               = str(self.output)
+        for query in config["sparql_queries"].values():
+            query["endpoint"] = self.sparql.url
+        for agent in (config.get("metrics") or {}).values():
+            agent.pop("port", None)          # no /metrics listeners
+        config.setdefault("logging", {}).setdefault("default", {})["level"] = log_level
+
+        self.config = config
+        self.config_file = self.workdir / "base_config.yaml"
+        self.config_file.write_text(yaml.safe_dump(config, sort_keys=False))
+        os.environ["CONFIG_FILE"] = str(self.config_file)
+
+    def agent(self, name: str):
+        """The agents.<name> module, running against this environment."""
+        return importlib.import_module(f"agents.{name}")
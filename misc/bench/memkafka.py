@@ -0,0 +1,211 @@
+"""
+In-memory stand-in for Kafka and the Schema Registry.
+
+`MemoryBroker.install()` swaps the client factories of
+agents/common/kafka_utils.py, so agent modules imported afterwards produce
+to and consume from in-process topics (one partition each) instead of a
+cluster. Records are still Avro-encoded with the Confluent wire format
+(magic byte + schema id) and claim-checked through the payload store, so a
+pipeline run pays the same serialisation cost per hop as in production; only
+the network and the brokers are left out.
+"""
+
+import io, json, struct, threading, time
+import fastavro
+from confluent_kafka import TopicPartition
+
+
+class Message:
+    """The parts of confluent_kafka.Message the agents use."""
+
+    def __init__(self, topic, offset, key, value, headers, timestamp):
+        self._topic, self._offset = topic, offset
+        self._key, self._value    = key, value
+        self._headers             = headers
+        self._timestamp           = timestamp
+
+    def topic(self):     return self._topic
+    def partition(self): return 0
+    def offset(self):    return self._offset
+    def key(self):       return self._key
+    def value(self):     return self._value
+    def headers(self):   return self._headers
+    def timestamp(self): return (1, self._timestamp)    # TIMESTAMP_CREATE_TIME, ms
+    def error(self):     return None
+
+    def with_value(self, value) -> "Message":
+        return Message(self._topic, self._offset, self._key, value, self._headers, self._timestamp)
+
+
+class MemoryBroker:
+    def __init__(self):
+        self.topics   = {}                  # topic → [Message] (raw bytes values)
+        self.offsets  = {}                  # (group, topic) → committed offset
+        self._schemas = []                  # schema id - 1 → parsed schema
+        self._ids     = {}                  # schema text → schema id
+        self._cond    = threading.Condition()
+
+    # ─── Schema Registry ──────────────────────────────────────────────────────
+    def register(self, schema_str: str) -> int:
+        with self._cond:
+            if schema_str not in self._ids:
+                self._schemas.append(fastavro.parse_schema(json.loads(schema_str)))
+                self._ids[schema_str] = len(self._schemas)
+            return self._ids[schema_str]
+
+    def serializer(self, schema_str: str, to_dict=None):
+        schema_id = self.register(schema_str)
+        schema    = self._schemas[schema_id - 1]
+
+        def serialize(obj, ctx=None) -> bytes:
+            buf = io.BytesIO()
+            buf.write(struct.pack(">bI", 0, schema_id))
+            fastavro.schemaless_writer(buf, schema, to_dict(obj, ctx) if to_dict else obj)
+            return buf.getvalue()
+        return serialize
+
+    def deserializer(self, schema_str: str, from_dict=None):
+        reader = self._schemas[self.register(schema_str) - 1]
+
+        def deserialize(data: bytes, ctx=None):
+            _, schema_id = struct.unpack(">bI", data[:5])
+            obj = fastavro.schemaless_reader(io.BytesIO(data[5:]), self._schemas[schema_id - 1], reader)
+            return from_dict(obj, ctx) if from_dict else obj
+        return deserialize
+
+    # ─── Topics ───────────────────────────────────────────────────────────────
+    def append(self, topic: str, value: bytes, key=None, headers=None) -> Message:
+        with self._cond:
+            log = self.topics.setdefault(topic, [])
+            msg = Message(topic, len(log), key, value, list(headers or []), int(time.time() * 1000))
+            log.append(msg)
+            self._cond.notify_all()
+            return msg
+
+    def wait_for(self, topic: str, predicate, timeout: float, start: int = 0):
+        """First raw message of *topic* from offset *start* matching *predicate*, or None."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for msg in self.topics.get(topic, [])[start:]:
+                    if predicate(msg):
+                        return msg
+                start = len(self.topics.get(topic, []))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def end(self, topic: str) -> int:
+        with self._cond:
+            return len(self.topics.get(topic, []))
+
+    # ─── Clients (kafka_utils signatures) ─────────────────────────────────────
+    def create_avro_producer(self, value_schema_str: str, payload_store=None, payload_fields=(),
+                             settings: dict | None = None):
+        to_dict = None
+        if payload_store is not None and payload_fields:
+            to_dict = lambda obj, ctx: payload_store.offload(obj, payload_fields)
+        serializer = self.serializer(value_schema_str, to_dict)
+        return MemoryProducer(self, serializer), serializer
+
+    def create_avro_consumer(self, group, topics, value_schema_str: str,
+                             payload_store=None, payload_fields=(), auto_commit: bool = True,
+                             settings: dict | None = None):
+        from_dict = None
+        if payload_store is not None and payload_fields:
+            from_dict = lambda obj, ctx: payload_store.resolve(obj, payload_fields)
+        consumer = MemoryConsumer(self, group, self.deserializer(value_schema_str, from_dict))
+        consumer.subscribe(topics)
+        return consumer
+
+    def install(self):
+        """Route kafka_utils (and agent modules imported from now on) to this broker."""
+        from agents.common import kafka_utils
+        kafka_utils.create_avro_producer = self.create_avro_producer
+        kafka_utils.create_avro_consumer = self.create_avro_consumer
+        kafka_utils._plain_producer      = MemoryProducer(self)   # logs, heartbeats, metrics
+        return self
+
+
+class MemoryProducer:
+    def __init__(self, broker: MemoryBroker, serializer=None):
+        self.broker     = broker
+        self.serializer = serializer
+        self._callbacks = []
+        self._lock      = threading.Lock()
+
+    def produce(self, topic, value=None, key=None, headers=None, on_delivery=None, **_):
+        data = self.serializer(value, None) if self.serializer else value
+        msg  = self.broker.append(topic, data, key, headers)
+        if on_delivery is not None:
+            with self._lock:
+                self._callbacks.append((on_delivery, msg))
+
+    def poll(self, timeout=None) -> int:
+        with self._lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for on_delivery, msg in callbacks:
+            on_delivery(None, msg)
+        return len(callbacks)
+
+    def flush(self, timeout=None) -> int:
+        self.poll(0)
+        return 0
+
+
+class MemoryConsumer:
+    def __init__(self, broker: MemoryBroker, group: str, deserialize):
+        self.broker      = broker
+        self.group       = group
+        self.deserialize = deserialize
+        self.topics      = []
+        self.position    = {}               # topic → next offset
+        self.paused      = False
+        self._next       = 0                # round robin over topics
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        self.topics   = list(topics)
+        self.position = {t: self.broker.offsets.get((self.group, t), 0) for t in self.topics}
+        if on_assign is not None:
+            on_assign(self, self.assignment())
+
+    def assignment(self):
+        return [TopicPartition(t, 0) for t in self.topics]
+
+    def pause(self, partitions):
+        self.paused = True
+
+    def resume(self, partitions):
+        self.paused = False
+
+    def poll(self, timeout: float = 1.0):
+        deadline = time.monotonic() + (timeout or 0)
+        with self.broker._cond:
+            while True:
+                if not self.paused:
+                    for i in range(len(self.topics)):
+                        topic = self.topics[(self._next + i) % len(self.topics)]
+                        log   = self.broker.topics.get(topic, [])
+                        if self.position[topic] < len(log):
+                            msg = log[self.position[topic]]
+                            self.position[topic] += 1
+                            self._next = (self._next + i + 1) % len(self.topics)
+                            break
+                    else:
+                        msg = None
+                    if msg is not None:
+                        break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.broker._cond.wait(remaining)
+        return msg.with_value(self.deserialize(msg.value()))
+
+    def commit(self, offsets=None, asynchronous=True):
+        with self.broker._cond:
+            for tp in offsets or []:
+                self.broker.offsets[(self.group, tp.topic)] = tp.offset
+
+    def close(self):
+        pass
@@ -0,0 +1,76 @@
+"""
+Full-pipeline benchmark: query agent → sitemap builder → web builder, each
+on its own AgentRunner thread, talking through the in-memory broker.
+
+A `Cmd` is produced on cmd.query_agent and the clock stops when the web
+builder publishes its spans for the run on the metrics topic. The stage
+breakdown comes from the run's timings.json (see agents/common/tracing.py).
+
+`direct()` runs the same date through agents.direct (the stage functions
+chained in-process): the difference with `Pipeline.run()` is the cost of the
+Kafka hops.
+"""
+
+import json, threading, time
+
+from .stages import DATE
+
+AGENTS = ("query_agent", "sitemap_builder", "web_builder")
+
+
+def direct(env, rows) -> dict:
+    """One date through agents.direct; returns its wall time and spans per stage."""
+    from agents import direct
+    env.sparql.rows = rows
+    return direct.run(DATE, "OJ", bypass_cache=True)
+
+
+class Pipeline:
+    def __init__(self, env):
+        self.env     = env
+        self.topics  = env.config["topics"]
+        self.modules = [env.agent(name) for name in AGENTS]
+        self.runners = [m.runner() for m in self.modules]
+        self.threads = [threading.Thread(target=r.run, name=f"bench-{name}", daemon=True)
+                        for r, name in zip(self.runners, AGENTS)]
+        for t in self.threads:
+            t.start()
+        self.commands, _ = env.broker.create_avro_producer(self.modules[0].CMD_SCHEMA)
+
+    def run(self, rows, timeout: float = 900) -> dict:
+        """One date through the three stages; returns wall time and spans per stage."""
+        broker  = self.env.broker
+        metrics = self.topics["metrics"]
+        logs    = self.topics["logs_app"]
+        seen, log_start = broker.end(metrics), broker.end(logs)
+        self.env.sparql.rows = rows
+
+        t0 = time.perf_counter()
+        self.commands.produce(self.topics["cmd_query_agent"],
+                              value={"date": DATE, "collection": "OJ", "bypass_cache": True,
+                                     "end_date": "", "backfill_id": ""})
+        deadline = time.monotonic() + timeout
+        done = None
+        while done is None:
+            done = broker.wait_for(metrics, lambda m: json.loads(m.value())["component"] == "web_builder",
+                                   timeout=1.0, start=seen)
+            errors = [e for m in broker.topics.get(logs, [])[log_start:]
+                      for e in json.loads(m.value()) if e["level"] in ("ERROR", "CRITICAL")]
+            if done is None and errors:
+                raise RuntimeError(f"{errors[0]['component']}: {errors[0]['msg']}")
+            if done is None and time.monotonic() > deadline:
+                raise TimeoutError(f"no site built after {timeout}s")
+        wall = time.perf_counter() - t0
+
+        run_id  = json.loads(done.value())["run_id"]
+        timings = json.loads((self.env.runs / run_id / "timings.json").read_text())
+        spans   = {}
+        for span in timings["spans"]:
+            spans[span["name"]] = round(spans.get(span["name"], 0) + span["ms"], 1)
+        return {"seconds": wall, "run_id": run_id, "spans_ms": spans}
+
+    def stop(self):
+        for r in self.runners:
+            r.stop()
+        for t in self.threads:
+            t.join(timeout=30)
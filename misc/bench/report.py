@@ -0,0 +1,83 @@
+"""
+Results and regression checks.
+
+Each benchmark is timed at two sizes, `rows` and `rows × scale`. From those
+two timings:
+
+  exponent   log(t_large / t_small) / log(scale): 1 for a linear stage, 2 for
+             a quadratic one. Checked against `max_exponent` (per benchmark,
+             else `default`) in thresholds.json. The check does not depend on
+             the machine, so it catches an XSLT key/axis blowup anywhere.
+  baseline   with --baseline, the large-size time may not exceed the
+             baseline's by more than `tolerance` (a fraction). Compare runs
+             from the same machine only.
+
+Timings under `min_seconds` are too noisy to judge and are not checked.
+"""
+
+import json, math, platform, time
+from pathlib import Path
+
+THRESHOLDS = Path(__file__).with_name("thresholds.json")
+
+
+def summarize(small: float, large: float, scale: float) -> dict:
+    return {"seconds": [round(small, 4), round(large, 4)],
+            "exponent": round(math.log(max(large, 1e-9) / max(small, 1e-9)) / math.log(scale), 2)}
+
+
+def check(results: dict, thresholds: dict, baseline: dict | None = None) -> list[str]:
+    """Failed checks, as messages."""
+    failures    = []
+    exponents   = thresholds.get("max_exponent", {})
+    tolerance   = float(thresholds.get("tolerance", 0.25))
+    min_seconds = float(thresholds.get("min_seconds", 0.05))
+    previous    = (baseline or {}).get("benchmarks", {})
+
+    for name, res in results.items():
+        if "seconds" not in res:
+            continue
+        small, large = res["seconds"]
+        limit = float(exponents.get(name, exponents.get("default", 1.5)))
+        if large >= min_seconds and res["exponent"] > limit:
+            failures.append(f"{name}: grows as n^{res['exponent']} (max n^{limit}): "
+                            f"{small:.3f}s → {large:.3f}s")
+        before = previous.get(name, {}).get("seconds")
+        if before and large >= min_seconds and large > before[1] * (1 + tolerance):
+            failures.append(f"{name}: {large:.3f}s, baseline {before[1]:.3f}s (+{tolerance:.0%} allowed)")
+    return failures
+
+
+def write(path: Path, params: dict, results: dict, failures: list[str]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({
+        "ts":         time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host":       platform.node(),
+        "python":     platform.python_version(),
+        "params":     params,
+        "benchmarks": results,
+        "failures":   failures,
+    }, indent=1))
+
+
+def table(results: dict, rows: list[int]) -> str:
+    width = max(map(len, results), default=9)
+    lines = [f"{'benchmark':{width}} {rows[0]:>10} {rows[1]:>10}  exponent",
+             f"{'':{width}} {'rows (s)':>10} {'rows (s)':>10}"]
+    for name, res in results.items():
+        if "seconds" in res:
+            small, large = res["seconds"]
+            lines.append(f"{name:{width}} {small:10.3f} {large:10.3f}  {res['exponent']:8.2f}")
+        else:
+            lines.append(f"{name:{width}} skipped: {res.get('skipped', '?')}")
+    return "\n".join(lines)
+
+
+def formats_table(formats: list[dict], rows: list[int]) -> str:
+    """Intermediate results formats (stages.formats()) at both sizes."""
+    lines = [f"{'results file':14} {'rows':>8} {'bytes':>12} {'group (s)':>10} {'peak (MB)':>10}"]
+    for n, fmts in zip(rows, formats):
+        for name, res in fmts.items():
+            lines.append(f"{name:14} {n:8} {res['bytes']:12} "
+                         f"{res.get('group_s', ''):>10} {res.get('peak_mb', ''):>10}")
+    return "\n".join(lines)
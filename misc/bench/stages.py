@@ -0,0 +1,150 @@
+"""
+Per-stage benchmarks, each calling the function its agent runs:
+
+  sitemap.xslt     sitemap_builder.sitemap_xslt()    (XSLT 1.0 engine)
+  sitemap.stream   sitemap_builder.sitemap_stream()  (single-pass engine)
+  sitemap.rows     the same from a row batch file    (result_rows, `format: json`)
+  results.json     JSON response → row batch file    (the query agent's streaming parser)
+  site.records     site_manifest.sitemap_records() + web_builder.write_data_feed()
+  site.eleventy    web_builder.run_eleventy()        (sitemap.js data load + render)
+  site.tarball     web_builder.archive_site()
+  promote.full     web_agent._build_release() without a previous release
+  promote.linked   web_agent._build_release() against an identical previous one
+
+Without `eleventy` on PATH, site.eleventy is skipped and the later stages
+work on a synthetic site of one page per sitemap record.
+
+`formats()` compares the intermediate results files: size on disk, time to
+group them into sitemap records and the peak memory that takes (RSS of a
+fresh interpreter, above its imports).
+"""
+
+import io, json, shutil, subprocess, sys, time
+from pathlib import Path
+
+from .synthetic import results_xml, write_results, write_results_json
+
+ROOT = Path(__file__).resolve().parents[2]
+
+DATE = "2025-06-20"
+
+
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - t0, out
+
+
+def synthetic_site(site_dir: Path, records):
+    """Stand-in for Eleventy's output: a page per record, plus index and assets."""
+    (site_dir / "assets").mkdir(parents=True, exist_ok=True)
+    (site_dir / "assets/site.css").write_text("body { font-family: sans-serif; }\n" * 40)
+    for i, rec in enumerate(records):
+        page = site_dir / rec["collection"].rsplit("/", 1)[-1] / f"{i:06d}.html"
+        page.parent.mkdir(exist_ok=True)
+        page.write_text("<!doctype html><html><body><ul>"
+                        + "".join(f"<li>{k}: {v}</li>" for k, v in rec.items()) * 8
+                        + "</ul></body></html>\n")
+    (site_dir / "index.html").write_text("<!doctype html><html><body>index</body></html>\n")
+
+
+# VmHWM, not ru_maxrss: that one keeps the high-water mark of the forking parent across exec
+_PEAK = """
+import re, sys
+from agents.common import sitemap_stream
+if sys.argv[1] != "-":
+    getattr(sitemap_stream, sys.argv[1])(sys.argv[2])
+print(re.search(r"VmHWM:\\s+(\\d+)", open("/proc/self/status").read()).group(1))
+"""
+
+
+def _peak_kb(group: str, path) -> int:
+    out = subprocess.run([sys.executable, "-c", _PEAK, group, str(path)],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    return int(out.stdout.split()[-1])
+
+
+def formats(work: Path, rows) -> dict:
+    """SPARQL XML against the row batch file of the same *rows*."""
+    from agents.common import result_rows, sitemap_stream
+    xml, json_, rows_file = work / "results.xml", work / "results.json", work / "results.rows"
+    with open(xml, "wb") as out:
+        write_results(rows, out)
+    with open(json_, "wb") as out:
+        write_results_json(rows, out)
+    with open(rows_file, "wb") as out, open(json_, "rb") as src:
+        parser = result_rows.JsonParser(out)
+        for chunk in iter(lambda: src.read(64 * 1024), b""):
+            parser.feed(chunk)
+        parser.close()
+
+    base = _peak_kb("-", "")
+    out  = {}
+    for name, path, group in (("xml", xml, "group_results"), ("rows", rows_file, "group_rows")):
+        seconds, _ = _timed(getattr(sitemap_stream, group), str(path))
+        out[name] = {"bytes": path.stat().st_size, "group_s": round(seconds, 4),
+                     "peak_mb": round(max(_peak_kb(group, path) - base, 0) / 1024, 1)}
+    out["json"] = {"bytes": json_.stat().st_size}
+    return out
+
+
+def run(env, rows, label: str) -> dict:
+    """Every stage once on *rows*; returns {stage: seconds or {"skipped": reason}}."""
+    sitemap_builder = env.agent("sitemap_builder")
+    web_builder     = env.agent("web_builder")
+    web_agent       = env.agent("web_agent")
+    from agents.common import site_manifest
+
+    work = env.workdir / "stages" / label
+    if work.exists():
+        shutil.rmtree(work)
+    work.mkdir(parents=True)
+    out, payload = {}, {"xml": results_xml(rows), "date": DATE}
+
+    out["sitemap.xslt"], urls = _timed(sitemap_builder.sitemap_xslt, payload, work / "sitemap-xslt.xml")
+    out["sitemap.stream"], _  = _timed(sitemap_builder.sitemap_stream, payload, work / "sitemap.xml")
+
+    from agents.common import result_rows
+    body = io.BytesIO()
+    write_results_json(rows, body)
+
+    def json_to_rows():
+        rows_file = io.BytesIO()
+        parser    = result_rows.JsonParser(rows_file)
+        for i in range(0, len(body.getvalue()), 64 * 1024):
+            parser.feed(body.getvalue()[i:i + 64 * 1024])
+        parser.close()
+        return rows_file.getvalue().decode()
+    out["results.json"], rows_text = _timed(json_to_rows)
+    out["sitemap.rows"], _ = _timed(sitemap_builder.sitemap_stream,
+                                    {"xml": rows_text, "date": DATE, "format": "rows"},
+                                    work / "sitemap-rows.xml")
+    out["_formats"] = formats(work, rows)
+
+    site_dir = work / "site"
+    site_dir.mkdir()
+    shutil.copy(work / "sitemap.xml", site_dir / "sitemap.xml")
+    meta = {"run_id": f"bench-{label}", "action": "OJ", "date": DATE}
+    (site_dir / "metadata.json").write_text(json.dumps(meta))
+
+    def records_and_feed():
+        records = list(site_manifest.sitemap_records(site_dir))
+        web_builder.write_data_feed(meta, site_dir, records, web_builder.WEBCFG.get("data_feed", {}))
+        return records
+    out["site.records"], records = _timed(records_and_feed)
+
+    if shutil.which("eleventy"):
+        out["site.eleventy"], _ = _timed(web_builder.run_eleventy, site_dir)
+    else:
+        out["site.eleventy"] = {"skipped": "eleventy not on PATH"}
+        synthetic_site(site_dir, records)
+
+    out["site.tarball"], _ = _timed(web_builder.archive_site, site_dir, work / "site.tar.gz")
+
+    releases = work / "releases"
+    releases.mkdir()
+    out["promote.full"], _   = _timed(web_agent._build_release, site_dir, releases / "r1", None)
+    out["promote.linked"], _ = _timed(web_agent._build_release, site_dir, releases / "r2", releases / "r1")
+
+    out["_urls"] = urls
+    return out
@@ -0,0 +1,114 @@
+"""
+Synthetic SPARQL results, shaped like those of the OJ query
+(`sparql_queries.OJ` in config/base_config.yaml).
+
+Cellar returns one row per combination of multi-valued properties: an act
+with three creating agents comes back as three rows sharing its ELI, and
+an act with two resource types twice that. The generator reproduces that
+shape with three knobs:
+
+  rows        total number of <result> rows
+  dup_ratio   fraction of the acts repeated under the same ELI (another
+              resource type), on top of the per-creator rows
+  creators    creating agents per act (rows per act and resource type)
+"""
+
+import io, json, random
+from xml.sax.saxutils import escape
+
+NS = "http://www.w3.org/2005/sparql-results#"
+
+AUTHORITY      = "http://publications.europa.eu/resource/authority"
+COLLECTIONS    = ["OJ-L", "OJ-C"]
+RESOURCE_TYPES = ["REG", "DEC", "DIR", "REG_IMPL", "DEC_IMPL", "COM", "INFO", "NOTICE"]
+AGENTS         = [f"AG{i:02d}" for i in range(40)]
+VARIABLES      = ["act", "eli", "celex", "resource_type", "title",
+                  "oj_number", "oj_collection", "creating_agents"]
+
+
+def sparql_rows(rows: int, dup_ratio: float = 0.1, creators: int = 2,
+                seed: int = 0, year: int = 2025) -> list[dict]:
+    """*rows* result rows as {variable: value} dicts, in ELI order."""
+    rnd, out, n = random.Random(seed), [], 0
+    while len(out) < rows:
+        n += 1
+        collection = COLLECTIONS[n % 2]
+        act = {
+            "act":           f"http://publications.europa.eu/resource/cellar/{n:08x}-synthetic",
+            "eli":           f"http://data.europa.eu/eli/{collection[-1]}/{year}/{n}/oj",
+            "celex":         f"3{year}{collection[-1]}{n:05d}",
+            "title":         f"Synthetic act {n} on the {rnd.choice(['common', 'internal', 'single'])} "
+                             f"market & <related> matters",
+            "oj_number":     str(n),
+            "oj_collection": f"{AUTHORITY}/document-collection/{collection}",
+        }
+        types = [rnd.choice(RESOURCE_TYPES)]
+        if rnd.random() < dup_ratio:
+            types.append(rnd.choice([t for t in RESOURCE_TYPES if t != types[0]]))
+        agents = rnd.sample(AGENTS, min(creators, len(AGENTS)))
+        for doc_type in types:
+            for agent in agents:
+                out.append({**act,
+                            "resource_type":   f"{AUTHORITY}/resource-type/{doc_type}",
+                            "creating_agents": f"{AUTHORITY}/corporate-body/{agent}"})
+    return out[:rows]
+
+
+def _binding(name: str, value: str) -> str:
+    if value.startswith("http") and name != "eli":
+        return f'<binding name="{name}"><uri>{escape(value)}</uri></binding>'
+    lang = ' xml:lang="en"' if name == "title" else ""
+    return f'<binding name="{name}"><literal{lang}>{escape(value)}</literal></binding>'
+
+
+def write_results(rows, out):
+    """SPARQL XML results document for *rows*, written to the binary file *out*."""
+    out.write(f'<?xml version="1.0"?>\n<sparql xmlns="{NS}">\n <head>\n'.encode())
+    out.write("".join(f'  <variable name="{v}"/>\n' for v in VARIABLES).encode())
+    out.write(b' </head>\n <results distinct="false" ordered="true">\n')
+    for row in rows:
+        out.write(("  <result>"
+                   + "".join(_binding(v, row[v]) for v in VARIABLES)
+                   + "</result>\n").encode())
+    out.write(b" </results>\n</sparql>\n")
+
+
+def _term(name: str, value: str) -> dict:
+    if value.startswith("http") and name != "eli":
+        return {"type": "uri", "value": value}
+    return {"type": "literal", "value": value, **({"xml:lang": "en"} if name == "title" else {})}
+
+
+def write_results_json(rows, out):
+    """The same results as application/sparql-results+json."""
+    out.write(json.dumps({"head": {"link": [], "vars": VARIABLES}}).encode()[:-1])
+    out.write(b',\n "results": {"distinct": false, "ordered": true, "bindings": [')
+    for i, row in enumerate(rows):
+        out.write(((",\n  " if i else "\n  ")
+                   + json.dumps({v: _term(v, row[v]) for v in VARIABLES})).encode())
+    out.write(b" ] } }\n")
+
+
+def _tsv(name: str, value: str) -> str:
+    if value.startswith("http") and name != "eli":
+        return f"<{value}>"
+    text = value.replace("\\", "\\\\").replace('"', '\\"').replace("\t", "\\t").replace("\n", "\\n")
+    return f'"{text}"@en' if name == "title" else f'"{text}"'
+
+
+def write_results_tsv(rows, out):
+    """The same results as text/tab-separated-values."""
+    out.write(("\t".join(f"?{v}" for v in VARIABLES) + "\n").encode())
+    for row in rows:
+        out.write(("\t".join(_tsv(v, row[v]) for v in VARIABLES) + "\n").encode())
+
+
+WRITERS = {"application/sparql-results+xml":   write_results,
+           "application/sparql-results+json":  write_results_json,
+           "text/tab-separated-values":        write_results_tsv}
+
+
+def results_xml(rows) -> str:
+    buf = io.BytesIO()
+    write_results(rows, buf)
+    return buf.getvalue().decode()
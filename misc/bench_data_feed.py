@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Times the Eleventy data-loading phase on a synthetic sitemap, before and
+after the data feed:
+
+  baseline  the loader and grouping as they were before the feed: sitemap.xml
+            parsed with fast-xml-parser by .eleventy.js, by the global data
+            file and by the `maps` collection, grouped with a linear find()
+  xml       templates/_data/sitemap.js on sitemap.xml (fallback, one parse)
+  feed      templates/_data/sitemap.js on the sitemap.json feed
+
+    NODE_PATH=/deps/node_modules python misc/bench_data_feed.py --urls 100000
+
+The XML paths need fast-xml-parser on NODE_PATH (as in the agents image, or
+`npm ci --prefix templates` and NODE_PATH=templates/node_modules); without
+it only the feed path is timed.
+"""
+
+import argparse, json, os, subprocess, sys, tempfile, time
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from agents.common.sitemap_stream import write_sitemap
+from agents.common import site_manifest, data_feed
+
+COLLECTIONS = ["OJ-L", "OJ-C"]
+DOC_TYPES   = ["REG", "DEC", "DIR", "REG_IMPL", "DEC_IMPL", "COM", "INFO", "NOTICE"]
+
+NODE_LOAD = """
+const t0 = process.hrtime.bigint();
+const sitemap = require(process.argv[1]);
+const maps = sitemap.maps();
+const flat = sitemap();
+const ms = Number(process.hrtime.bigint() - t0) / 1e6;
+console.log(JSON.stringify({ms, pages: maps.length, records: flat.length,
+                            rss_mb: process.memoryUsage().rss / 2**20}));
+"""
+
+
+# the pre-feed data loading (baseline .eleventy.js + _data/sitemap.js), verbatim where it ran
+BASELINE_LOAD = """
+const fs = require('fs'), path = require('path');
+const { XMLParser } = require('fast-xml-parser');
+const runDir = process.env.RUN_DIR;
+const sitemap = () => {
+  const xml = fs.readFileSync(path.join(runDir, 'sitemap.xml'), 'utf8');
+  const data = new XMLParser({ ignoreAttributes:false }).parse(xml);
+  return (data.urlset.url || []).map(u => ({
+    loc:        u.loc,
+    title:      u['akn4eu:docTitle']?.literal ?? '',
+    num:        u['akn4eu:num'],
+    issued:     u['dcterms:issued'],
+    collection: u['dcterms:isPartOf']['@_rdf:datatype'] ? u['dcterms:isPartOf']['#text']
+                                                       : u['dcterms:isPartOf'],
+    docType:    u['akn4eu:docType']['#text'] ?? u['akn4eu:docType']
+  }));
+};
+const t0 = process.hrtime.bigint();
+sitemap();                                  // .eleventy.js, at load
+const flat = sitemap();                     // global data (_data/sitemap.js)
+const out = [];                             // the `maps` collection
+for (const r of sitemap()) {
+  let m = out.find(o => o.issued === r.issued && o.collection === r.collection);
+  if (!m) out.push(m = { issued: r.issued, collection: r.collection, items: {} });
+  (m.items[r.docType] ??= []).push(r);
+}
+const ms = Number(process.hrtime.bigint() - t0) / 1e6;
+console.log(JSON.stringify({ms, pages: out.length, records: flat.length,
+                            rss_mb: process.memoryUsage().rss / 2**20}));
+"""
+
+
+def synthetic_groups(n: int):
+    for i in range(n):
+        yield SimpleNamespace(
+            eli=f"http://data.europa.eu/eli/C/2025/{i}/oj",
+            collection=f"http://publications.europa.eu/resource/authority/document-collection/{COLLECTIONS[i % 2]}",
+            celex=f"3{2025}X{i:05d}",
+            num=str(i),
+            doc_type=f"http://publications.europa.eu/resource/authority/resource-type/{DOC_TYPES[i % len(DOC_TYPES)]}",
+            creators=[f"http://publications.europa.eu/resource/authority/corporate-body/AG{i % 40}"],
+            title_en=f'<literal xmlns="http://www.w3.org/2005/sparql-results#" xml:lang="en">Synthetic act {i}</literal>',
+            titles=[],
+        )
+
+
+def node_load(run_dir: Path, script: str = NODE_LOAD) -> dict:
+    env = {**os.environ, "RUN_DIR": str(run_dir)}
+    out = subprocess.check_output(
+        ["node", "-e", script, str(ROOT / "templates/_data/sitemap.js")], env=env)
+    return json.loads(out)
+
+
+def has_xml_parser() -> bool:
+    return subprocess.run(["node", "-e", "require.resolve('fast-xml-parser')"],
+                          capture_output=True).returncode == 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--urls", type=int, default=100_000)
+    ap.add_argument("--split", action="store_true", help="one feed file per collection")
+    args = ap.parse_args()
+    xml_paths = has_xml_parser()
+    if not xml_paths:
+        print("fast-xml-parser is not on NODE_PATH: timing the feed path only (see --help)", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_dir, feed_dir = Path(tmp, "xml"), Path(tmp, "feed")
+        xml_dir.mkdir(), feed_dir.mkdir()
+
+        with open(xml_dir / "sitemap.xml", "wb") as out:
+            write_sitemap(list(synthetic_groups(args.urls)), out, "2025-06-20", "2025-06-21")
+        os.link(xml_dir / "sitemap.xml", feed_dir / "sitemap.xml")
+
+        t0 = time.perf_counter()
+        records = list(site_manifest.sitemap_records(feed_dir))
+        maps    = data_feed.group_records(records, ["date", "oj_collection", "resource_type"])
+        data_feed.write_feed(feed_dir, maps, split=args.split)
+        feed_ms = (time.perf_counter() - t0) * 1000
+
+        xml_mb  = (xml_dir / "sitemap.xml").stat().st_size / 2**20
+        feed_mb = sum(p.stat().st_size for p in feed_dir.glob("sitemap*.json")) / 2**20
+        runs = {"baseline": node_load(xml_dir, BASELINE_LOAD),
+                "xml":      node_load(xml_dir)} if xml_paths else {}
+        runs["feed"] = node_load(feed_dir)
+
+    print(f"{args.urls} URLs, sitemap.xml {xml_mb:.1f} MB, feed {feed_mb:.1f} MB")
+    for name, run in runs.items():
+        print(f"  {name:8} in Node : {run['ms']:9.1f} ms  rss {run['rss_mb']:4.0f} MB"
+              f"  ({run['pages']} pages, {run['records']} records)")
+    print(f"  feed build in Python: {feed_ms:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Producer throughput and bytes on the wire, before / after batching.
+
+Runs against librdkafka's built-in mock cluster (`test.mock.num.brokers`),
+so no broker is needed:
+
+    python misc/bench_producer.py --messages 20000 --size 2048
+
+  before  linger 0, 16 KiB batches, no compression, flush() per message
+          (what the agents used to do)
+  after   the `producers.default` settings of config/base_config.yaml,
+          asynchronous produce() with delivery callbacks, one flush at the end
+
+Bytes on the wire are librdkafka's `tx_bytes` statistic.
+"""
+
+import argparse, json, random, sys, time
+from pathlib import Path
+
+import yaml
+from confluent_kafka import Producer
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from agents.common.kafka_utils import producer_settings
+
+BASELINE = {"linger.ms": 0, "batch.size": 16384, "compression.type": "none"}
+
+
+def synthetic_messages(n: int, size: int):
+    """SPARQL-result-like JSON values (heartbeats, logs, small payloads)."""
+    rnd = random.Random(0)
+    for i in range(n):
+        body = "".join(f'<result><binding name="eli"><literal>http://data.europa.eu/eli/C/2025/{rnd.randrange(99999)}/oj'
+                       f'</literal></binding></result>' for _ in range(size // 100 + 1))[:size]
+        yield json.dumps({"run_id": f"2025-06-20_{i // 100:06d}", "xml": body}).encode()
+
+
+def run(settings: dict, messages, flush_each: bool) -> dict:
+    stats = {}
+    producer = Producer({
+        "test.mock.num.brokers": 1,
+        "enable.idempotence": True,
+        "delivery.timeout.ms": 30000,
+        "statistics.interval.ms": 100,
+        "stats_cb": lambda s: stats.update(json.loads(s)),
+        **settings,
+    })
+    delivered = failed = 0
+
+    def on_delivery(err, msg):
+        nonlocal delivered, failed
+        if err is None:
+            delivered += 1
+        else:
+            failed += 1
+
+    t0 = time.perf_counter()
+    for value in messages:
+        while True:
+            try:
+                producer.produce("bench", value=value, on_delivery=on_delivery)
+                break
+            except BufferError:             # local queue full → serve callbacks
+                producer.poll(0.05)
+        if flush_each:
+            producer.flush()
+        else:
+            producer.poll(0)
+    producer.flush()
+    elapsed = time.perf_counter() - t0
+
+    deadline = time.time() + 1              # let a final statistics callback through
+    while time.time() < deadline:
+        producer.poll(0.1)
+    return {"seconds": elapsed, "delivered": delivered, "failed": failed,
+            "txbytes": stats.get("tx_bytes", 0)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--messages", type=int, default=20_000)
+    ap.add_argument("--size", type=int, default=2048, help="approximate value size in bytes")
+    ap.add_argument("--config", default=str(ROOT / "config/base_config.yaml"))
+    ap.add_argument("--topic-key", default=None, help="per-topic override of `producers`")
+    args = ap.parse_args()
+
+    config  = yaml.safe_load(Path(args.config).read_text())
+    tuned   = producer_settings(config.get("producers"), args.topic_key)
+    payload = list(synthetic_messages(args.messages, args.size))
+    raw     = sum(len(v) for v in payload)
+
+    before = run(BASELINE, payload, flush_each=True)
+    after  = run(tuned, payload, flush_each=False)
+
+    print(f"{args.messages} messages, {raw / 2**20:.1f} MiB of values; tuned = {tuned}")
+    for name, r in (("before", before), ("after", after)):
+        print(f"  {name:6}  {r['seconds']:7.2f} s  {args.messages / r['seconds']:9.0f} msg/s"
+              f"  {r['txbytes'] / 2**20:7.2f} MiB on the wire"
+              f"  delivered {r['delivered']}, failed {r['failed']}")
+
+
+if __name__ == "__main__":
+    main()
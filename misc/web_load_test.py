@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Small load test for the web agent: N concurrent keep-alive clients request
+the given paths in a loop for a fixed duration, then requests/sec and latency
+percentiles are reported.
+
+    python misc/web_load_test.py --url http://localhost:8080 --clients 32 \
+        --duration 10 / /2025-06-20/oj-l/ /assets/site.css
+"""
+
+import argparse, http.client, statistics, threading, time
+from urllib.parse import urlsplit
+
+
+def client(host, port, paths, deadline, gzip, latencies, errors):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    headers = {"Accept-Encoding": "gzip"} if gzip else {}
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status >= 400:
+                errors.append(resp.status)
+        except (OSError, http.client.HTTPException):
+            errors.append("conn")
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+            continue
+        latencies.append(time.perf_counter() - t0)
+    conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("paths", nargs="*", default=["/"])
+    ap.add_argument("--url", default="http://localhost:8080")
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--gzip", action="store_true", help="send Accept-Encoding: gzip")
+    args = ap.parse_args()
+
+    target = urlsplit(args.url)
+    latencies, errors = [], []
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=client,
+                                args=(target.hostname, target.port or 80, args.paths,
+                                      deadline, args.gzip, latencies, errors))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    if not latencies:
+        print(f"no successful requests ({len(errors)} errors)")
+        return
+    q = statistics.quantiles(latencies, n=100)
+    print(f"{len(latencies)} requests in {elapsed:.1f}s with {args.clients} clients, {len(errors)} errors")
+    print(f"  {len(latencies) / elapsed:10.1f} req/s")
+    print(f"  p50 {q[49] * 1000:8.2f} ms   p99 {q[98] * 1000:8.2f} ms   max {max(latencies) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,29 @@
 const { DateTime } = require('luxon');     // for pretty dates
-const sitemap      = require('./_data/sitemap.js')();
+const sitemap      = require('./_data/sitemap.js');
+const fs           = require('fs');
 const slugify      = s => s.toLowerCase()
                             .replace(/\W+/g,'-')
                             .replace(/(^-|-$)/g,'');
 
+/* Incremental builds: web_builder lists the pages to render (same keys as
+   site_manifest.page_key) in the file named by RENDER_PAGES. */
+const renderOnly   = process.env.RENDER_PAGES
+  ? new Set(JSON.parse(fs.readFileSync(process.env.RENDER_PAGES, 'utf8')))
+  : null;
+const pageKey      = m => `${m.issued}/${slugify(m.collection)}`;
+
+// [{ issued, collection, items: {docType: [records]} }, ...], read once per build
+const groupMaps    = () => sitemap.maps();   // <-- array; pagination-friendly
+
 module.exports = eleventyConfig => {
 
   /* ---------- Collections ---------- */
-  eleventyConfig.addCollection('maps', collectionApi => {
-    // const first = collectionApi.getAll()[0];
-    // const items = first ? first.data.sitemap : [];
-    // const items = sitemap;
-    const sitemap = require('./_data/sitemap.js')(); 
-
-    // Build nested {issued -> collection -> docType -> [records]}
-    //const tree = {};
-    //for (const r of items) {
-    //  (tree[r.issued]          ??= {});
-    //  (tree[r.issued][r.collection]           ??= {});
-    //  (tree[r.issued][r.collection][r.docType]??= []).push(r);
-    //}
-    //return tree;
-
-
-      // Build: [{ issued, collection, docTypeMap }, ...]
-      const out = [];
-      for (const r of sitemap) {
-        let issued      = r.issued;
-        let collection  = r.collection;
-        let docTypeMap  = out.find(o => o.issued === issued && o.collection === collection);
-
-        if (!docTypeMap) {
-          docTypeMap = { issued, collection, items: {} };
-          out.push(docTypeMap);
-        }
-        (docTypeMap.items[r.docType] ??= []).push(r);
-      }
-      return out;   // <-- array; pagination-friendly
-  });
+  // every page, for the index
+  eleventyConfig.addCollection('allMaps', () => groupMaps());
+
+  // pages to render: all of them, or only the changed ones
+  eleventyConfig.addCollection('maps', () =>
+    renderOnly ? groupMaps().filter(m => renderOnly.has(pageKey(m))) : groupMaps());
 
   /* ---------- Filters ---------- */
   eleventyConfig.addFilter('prettyDate', d =>
@@ -45,6 +31,10 @@ module.exports = eleventyConfig => {
 
   eleventyConfig.addFilter('slug', slugify);
 
+  /* ---------- Global data ---------- */
+  // the search box, when web_builder writes search/ (web.search.enabled)
+  eleventyConfig.addGlobalData('search', process.env.SEARCH === '1');
+
   /* ---------- Passthrough ---------- */
   eleventyConfig.addPassthroughCopy({ './templates/assets': 'assets' });
 
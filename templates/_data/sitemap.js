@@ -2,6 +2,15 @@
  * Reads sitemap.xml (written by Web-Builder) and converts it into
  * an array of JS objects so Nunjucks/Liquid templates can iterate.
  *
+ * Sharded runs ship sitemap_index.xml + sitemap-N.xml.gz instead: shards
+ * are then read, inflated and parsed one at a time, so only one shard's
+ * XML is ever held in memory. Backfill sites list one (plain or gzipped)
+ * sitemap per date in the same index.
+ *
+ * When Web-Builder wrote the pre-grouped sitemap.json feed, no XML is parsed
+ * at all: `.maps()` returns its pages as-is and the flat records are derived
+ * from them.
+ *
  * Returns e.g.
  * [
  *   {
@@ -16,39 +25,103 @@
  * ]
  */
 const fs = require('fs');
-const { XMLParser } = require('fast-xml-parser');
+const zlib = require('zlib');
 const path = require('path');
 const runDir  = process.env.RUN_DIR || process.cwd();
 
-module.exports = () => {
+// fast-xml-parser is only loaded when there is XML to parse (no JSON feed)
+let xmlParser = null;
+const parser = {
+  parse: xml => (xmlParser ??= new (require('fast-xml-parser').XMLParser)({
+    ignoreAttributes: false,
+    isArray: name => name === 'url' || name === 'sitemap'
+  })).parse(xml)
+};
+
+const toRecord = u => ({
+  loc:           u.loc,
+  title:         u['akn4eu:docTitle']?.literal ?? '',
+  num:           u['akn4eu:num'],
+  issued:        u['dcterms:issued'],
+  collection:    u['dcterms:isPartOf']['@_rdf:datatype']
+                   ? u['dcterms:isPartOf']['#text']
+                   : u['dcterms:isPartOf'],
+  docType:       u['akn4eu:docType']['#text'] ?? u['akn4eu:docType']
+});
+
+/* Yields the <url> entries of every shard listed in the index, lazily */
+function* shardUrls(indexPath) {
+  const index = parser.parse(fs.readFileSync(indexPath, 'utf8'));
+  for (const s of index.sitemapindex.sitemap || []) {
+    const raw = fs.readFileSync(path.join(runDir, s.loc));
+    const xml = (s.loc.endsWith('.gz') ? zlib.gunzipSync(raw) : raw).toString('utf8');
+    yield* (parser.parse(xml).urlset.url || []);
+  }
+}
+
+/* Pages of the JSON feed ({maps} or {parts: [files with {maps}]}), or null */
+function readFeed() {
+  const feedPath = path.join(runDir, 'sitemap.json');
+  if (!fs.existsSync(feedPath)) return null;
+  const feed = JSON.parse(fs.readFileSync(feedPath, 'utf8'));
+  if (!feed.parts) return feed.maps;
+  return feed.parts.flatMap(p =>
+    JSON.parse(fs.readFileSync(path.join(runDir, p), 'utf8')).maps);
+}
+
+function readXml() {
+  const indexPath = path.join(runDir, 'sitemap_index.xml');
   const xmlPath = path.join(runDir, 'sitemap.xml');
 
-  if (!fs.existsSync(xmlPath)) {
+  let urls;
+  if (fs.existsSync(indexPath)) {
+    urls = shardUrls(indexPath);
+  } else if (fs.existsSync(xmlPath)) {
+    urls = parser.parse(fs.readFileSync(xmlPath, 'utf8')).urlset.url || [];
+  } else {
     throw new Error(
-      `[sitemap.js] sitemap.xml not found at ${xmlPath} — aborting build.`
+      `[sitemap.js] neither sitemap_index.xml nor sitemap.xml found in ${runDir} — aborting build.`
     );
   }
 
-  const xml = fs.readFileSync(xmlPath, 'utf8');
-  const parser = new XMLParser({ ignoreAttributes:false });
-  const data = parser.parse(xml);
-
-  const urlset = data.urlset.url || [];
+  const records = [];
+  for (const u of urls) records.push(toRecord(u));
 
-  if (urlset.length === 0) {
+  if (records.length === 0) {
     throw new Error(
-      "[sitemap.js] sitemap.xml parsed OK but contains no <url> entries."
+      "[sitemap.js] sitemap parsed OK but contains no <url> entries."
     );
   }
+  return records;
+}
+
+// Build: [{ issued, collection, items: {docType: [records]} }, ...]
+function groupRecords(records) {
+  const byPage = new Map();
+  for (const r of records) {
+    const key = `${r.issued}\u0000${r.collection}`;
+    let page  = byPage.get(key);
+    if (!page) {
+      page = { issued: r.issued, collection: r.collection, items: {} };
+      byPage.set(key, page);
+    }
+    (page.items[r.docType] ??= []).push(r);
+  }
+  return [...byPage.values()];
+}
 
-  return urlset.map(u => ({
-    loc:           u.loc,
-    title:         u['akn4eu:docTitle']?.literal ?? '',
-    num:           u['akn4eu:num'],
-    issued:        u['dcterms:issued'],
-    collection:    u['dcterms:isPartOf']['@_rdf:datatype']
-                     ? u['dcterms:isPartOf']['#text']
-                     : u['dcterms:isPartOf'],
-    docType:       u['akn4eu:docType']['#text'] ?? u['akn4eu:docType']
-  }));
+let cachedMaps = null;
+
+/* Pages, pre-grouped: straight from the feed when present */
+function maps() {
+  return cachedMaps ??= (readFeed() ?? groupRecords(readXml()));
+}
+
+/* Flat records (global `sitemap` data) */
+module.exports = () => {
+  const feed = readFeed();
+  if (!feed) return readXml();
+  return feed.flatMap(m => Object.entries(m.items).flatMap(([docType, recs]) =>
+    recs.map(r => ({ ...r, issued: m.issued, collection: m.collection, docType }))));
 };
+module.exports.maps = maps;
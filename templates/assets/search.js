@@ -0,0 +1,105 @@
+/* Site search over the static index written by agents/common/search_index.py:
+   search/meta.json, search/shards/<key>.json ({token: {date: [doc…]}}) and
+   search/docs/<date>.json. Only the shards of the typed words are fetched,
+   then the documents of the dates they hit. Words must all match; the last
+   one as a prefix, while it is being typed. */
+(() => {
+  const form = document.querySelector('[data-search]');
+  if (!form) return;
+  const base    = form.dataset.search;        // relative URL of search/
+  const input   = form.querySelector('input');
+  const results = document.getElementById('search-results');
+  const LIMIT   = 50;
+
+  // same as search_index.tokens / STOPWORDS / shard_key
+  const STOPWORDS = new Set(('a an and are as at be by for from in into is it its of on or ' +
+                             'that the their this to which with').split(' '));
+  const tokens = text => (text.normalize('NFKD').replace(/\p{M}/gu, '').toLowerCase()
+                              .match(/[\p{L}\p{N}]+/gu) || [])
+    .filter(t => (t.length > 1 || /^\p{N}$/u.test(t)) && !STOPWORDS.has(t));
+  const hex = s => Array.from(new TextEncoder().encode(s), b => b.toString(16).padStart(2, '0')).join('');
+  const shardKey = (t, prefix) => {
+    const key = Array.from(t).slice(0, prefix).join('');
+    return /^[a-z0-9]+$/.test(key) ? key : '_' + hex(key);
+  };
+
+  const cache = new Map();                    // URL → promise of its JSON
+  const load  = url => {
+    if (!cache.has(url)) cache.set(url, fetch(base + url).then(r => r.ok ? r.json() : null)
+                                                       .catch(() => null));
+    return cache.get(url);
+  };
+
+  // {date: Set(doc)} of one word: exact token, or every token it starts (prefix)
+  async function postings(word, prefix, meta) {
+    const key = shardKey(word, meta.prefix);
+    if (!(key in meta.shards)) return {};
+    const shard = await load(`shards/${key}.json`) || {};
+    const hits  = {};
+    for (const [token, dates] of Object.entries(shard)) {
+      if (token !== word && !(prefix && token.startsWith(word))) continue;
+      for (const [day, docs] of Object.entries(dates))
+        docs.forEach(d => (hits[day] ||= new Set()).add(d));
+    }
+    return hits;
+  }
+
+  function intersect(a, b) {
+    const out = {};
+    for (const day in a) {
+      if (!b[day]) continue;
+      const docs = new Set([...a[day]].filter(d => b[day].has(d)));
+      if (docs.size) out[day] = docs;
+    }
+    return out;
+  }
+
+  async function search(text) {
+    const words = tokens(text);
+    const meta  = await load('meta.json');
+    // a word shorter than the shard prefix would need several shards: wait for more
+    const last  = words[words.length - 1];
+    if (!meta || !last || (Array.from(last).length < meta.prefix && !/^\p{N}+$/u.test(last)))
+      return null;
+    const lists = await Promise.all(words.map((w, i) => postings(w, i === words.length - 1, meta)));
+    const hits  = lists.reduce(intersect);
+    const found = [];
+    for (const day of Object.keys(hits).sort().reverse()) {
+      const docs = await load(`docs/${day}.json`) || [];
+      for (const d of [...hits[day]].sort((x, y) => x - y)) {
+        if (docs[d]) found.push({issued: day,
+                                 ...Object.fromEntries(meta.fields.map((f, i) => [f, docs[d][i]]))});
+        if (found.length >= LIMIT) return found;
+      }
+    }
+    return found;
+  }
+
+  function show(found) {
+    results.replaceChildren();
+    if (found === null) return;
+    if (!found.length) {
+      results.textContent = 'No match';
+      return;
+    }
+    for (const doc of found) {
+      const li = document.createElement('li');
+      const a  = document.createElement('a');
+      a.href = doc.loc;
+      a.textContent = doc.title || doc.loc;
+      li.append(a, ` — ${doc.issued} ${doc.celex}${doc.num ? ' · OJ ' + doc.num : ''}`);
+      results.append(li);
+    }
+  }
+
+  let timer, latest = 0;
+  input.addEventListener('input', () => {
+    clearTimeout(timer);
+    timer = setTimeout(async () => {
+      const ticket = ++latest;
+      const found  = await search(input.value);
+      if (ticket === latest) show(found);     // answers of older keystrokes are dropped
+    }, 150);
+  });
+  form.addEventListener('submit', e => e.preventDefault());
+})();
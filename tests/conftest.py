@@ -0,0 +1,28 @@
+"""
+Agent modules read CONFIG_FILE at import: point it to a copy of
+config/base_config.yaml whose directories are in a scratch dir, and run
+without a broker.
+"""
+
+import os, sys, tempfile
+from pathlib import Path
+
+import yaml
+
+ROOT    = Path(__file__).resolve().parents[1]
+SCRATCH = Path(tempfile.mkdtemp(prefix="c2x-tests-"))
+sys.path.insert(0, str(ROOT))
+
+config = yaml.safe_load((ROOT / "config/base_config.yaml").read_text())
+config["runs_dir"] = str(SCRATCH / "runs")
+config["query_cache"]["root"]          = str(SCRATCH / "runs/_cache/sparql")
+config["payload_store"]["root"]        = str(SCRATCH / "runs/_payloads")
+config["xslt"]["raw_to_sitemap"]       = str(ROOT / "xslt/raw_to_sitemap.xslt")
+config["web"]["eleventy_template_dir"] = str(ROOT / "templates")
+config["web"]["output_dir"]            = str(SCRATCH / "output")
+for agent in (config.get("metrics") or {}).values():
+    agent.pop("port", None)
+(SCRATCH / "base_config.yaml").write_text(yaml.safe_dump(config, sort_keys=False))
+
+os.environ["CONFIG_FILE"]     = str(SCRATCH / "base_config.yaml")
+os.environ["KAFKA_BOOTSTRAP"] = ""
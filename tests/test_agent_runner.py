@@ -0,0 +1,93 @@
+"""AgentRunner: handler failures are skipped, output failures hold the partition's commits."""
+
+import logging, threading, time
+
+from agents.common.agent_runner import AgentRunner
+
+log = logging.getLogger("test_agent_runner")
+
+
+class _Msg:
+    def __init__(self, offset, value):
+        self._offset, self._value = offset, value
+
+    def topic(self):     return "in"
+    def partition(self): return 0
+    def offset(self):    return self._offset
+    def value(self):     return self._value
+    def headers(self):   return None
+    def error(self):     return None
+    def timestamp(self): return (1, int(time.time() * 1000))
+
+
+class _Consumer:
+    def __init__(self, values):
+        self.messages = [_Msg(i, v) for i, v in enumerate(values)]
+        self.commits  = []
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None): pass
+    def assignment(self):          return []
+    def pause(self, partitions):   pass
+    def resume(self, partitions):  pass
+    def close(self):               pass
+
+    def poll(self, timeout):
+        if self.messages:
+            return self.messages.pop(0)
+        time.sleep(0.01)
+
+    def commit(self, offsets, asynchronous):
+        self.commits.append(max(tp.offset for tp in offsets))
+
+
+def _run(runner, until, limit=5.0):
+    thread = threading.Thread(target=runner.run)
+    thread.start()
+    deadline = time.monotonic() + limit
+    while not until() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    runner.stop()
+    thread.join()
+
+
+def test_output_failure_is_retried_before_commit():
+    consumer, published, failures = _Consumer([{"n": 0}, {"n": 1}, {"n": 2}]), [], {"left": 2}
+
+    def on_result(topic, value, result):
+        if value["n"] == 1 and failures["left"]:
+            failures["left"] -= 1
+            assert consumer.commits == [] or consumer.commits[-1] <= 1   # never past offset 1
+            raise RuntimeError("broker down")
+        published.append(result)
+
+    runner = AgentRunner(consumer, ["in"], lambda topic, value: value["n"] * 10, log,
+                         workers=2, commit_interval=0.0, retry_interval=0.05, on_result=on_result)
+    _run(runner, lambda: len(published) == 3)
+    assert failures["left"] == 0
+    assert sorted(published) == [0, 10, 20]
+    assert consumer.commits[-1] == 3
+
+
+def test_output_failing_at_shutdown_is_not_committed():
+    consumer = _Consumer([{"n": 0}, {"n": 1}])
+
+    def on_result(topic, value, result):
+        if value["n"] == 1:
+            raise RuntimeError("broker down")
+
+    runner = AgentRunner(consumer, ["in"], lambda topic, value: None, log,
+                         commit_interval=0.0, retry_interval=0.05, on_result=on_result)
+    _run(runner, lambda: consumer.commits and consumer.commits[-1] == 1, limit=2.0)
+    assert max(consumer.commits) == 1                 # offset 1 is re-delivered after a restart
+
+
+def test_handler_failure_is_committed_past():
+    consumer = _Consumer([{"n": 0}, {"n": 1}])
+
+    def handler(topic, value):
+        if value["n"] == 0:
+            raise ValueError("bad message")
+
+    runner = AgentRunner(consumer, ["in"], handler, log, commit_interval=0.0)
+    _run(runner, lambda: consumer.commits and consumer.commits[-1] == 2)
+    assert consumer.commits[-1] == 2
@@ -0,0 +1,64 @@
+"""DeliveryTracker: failed deliveries hold checkpoints back until re-sent and delivered."""
+
+import logging
+
+from agents.common.kafka_utils import DeliveryTracker, _LazyProducer
+
+log = logging.getLogger("test_delivery")
+
+
+class _Msg:
+    def __init__(self, topic, key, value, headers=None):
+        self._fields = topic, key, value, headers
+
+    def topic(self):     return self._fields[0]
+    def key(self):       return self._fields[1]
+    def value(self):     return self._fields[2]
+    def headers(self):   return self._fields[3]
+    def partition(self): return 0
+    def offset(self):    return 0
+
+
+class _Producer:
+    """Delivers through produce_serialized(); the first *failures* deliveries fail."""
+    def __init__(self, failures: int):
+        self.failures, self.queue, self.sent = failures, [], []
+
+    def produce_serialized(self, topic, value, key=None, headers=None, on_delivery=None):
+        self.queue.append((_Msg(topic, key, value, headers), on_delivery))
+
+    def flush(self, timeout=None) -> int:
+        queue, self.queue = self.queue, []
+        for msg, on_delivery in queue:
+            err = None
+            if self.failures:
+                self.failures -= 1
+                err = "broker rejected"
+            else:
+                self.sent.append(msg.value())
+            on_delivery(err, msg)
+        return 0
+
+
+def test_failed_delivery_blocks_checkpoint_until_resent():
+    tracker  = DeliveryTracker(log)
+    producer = _Producer(failures=2)
+    producer.produce_serialized("raw.out", b"avro", key=b"k", on_delivery=tracker.callback("run-1"))
+    assert tracker.checkpoint(producer) == 1        # failed: not settled
+    assert tracker.checkpoint(producer) == 1        # re-sent, failed again
+    assert tracker.checkpoint(producer) == 0        # re-sent and delivered
+    assert producer.sent == [b"avro"]
+    assert tracker.runs["run-1"] == {"delivered": 1, "failed": 2}
+    assert tracker.checkpoint(producer) == 0 and producer.sent == [b"avro"]
+
+
+def test_resend_skips_the_serializer():
+    """produce_serialized() on a real SerializingProducer (librdkafka's mock cluster)."""
+    def serializer(obj, ctx):
+        raise AssertionError("serialized twice")
+    producer = _LazyProducer({"test.mock.num.brokers": 1, "value.serializer": serializer})
+    delivered = []
+    producer.produce_serialized("raw.out", b"avro", key=b"k",
+                                on_delivery=lambda err, msg: delivered.append((err, msg.value())))
+    assert producer.flush(10) == 0
+    assert delivered == [(None, b"avro")]
@@ -0,0 +1,12 @@
+"""PayloadStore.offload(): the inline threshold counts encoded bytes."""
+
+from agents.common.payload_store import FilesystemBackend, PayloadStore, is_ref
+
+
+def test_offload_counts_bytes(tmp_path):
+    store = PayloadStore(FilesystemBackend(tmp_path), inline_threshold=1000)
+    ascii_, accented = "a" * 999, "é" * 600          # 999 bytes; 600 characters, 1200 bytes
+    out = store.offload({"xml": ascii_, "sitemap": accented, "date": "2025-06-20"}, ("xml", "sitemap"))
+    assert out["xml"] == ascii_
+    assert is_ref(out["sitemap"]) and out["sitemap"]["size"] == 1200
+    assert store.get(out["sitemap"]) == accented
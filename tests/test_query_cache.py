@@ -0,0 +1,20 @@
+"""QueryCache lookups from several threads, as the query agent's runner makes them."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from agents.common.query_cache import QueryCache
+
+
+def test_counters_from_threads(tmp_path):
+    cache = QueryCache(tmp_path / "cache")
+    (tmp_path / "results.xml").write_text("<sparql/>")
+    cache.put("hit", tmp_path / "results.xml", 0, None)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda i: cache.get("hit" if i % 2 else "miss", tmp_path / f"out-{i}.xml"),
+                      range(4000)))
+    assert (cache.hits, cache.misses) == (2000, 2000)
+
+
+def test_expiry_of_recent_dates():
+    assert QueryCache.expiry({"ttl": 0, "immutable_after_days": 30}, "2000-01-01") is None
+    assert QueryCache.expiry({"ttl": 0, "immutable_after_days": 30}, "2999-01-01") == 0
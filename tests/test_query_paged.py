@@ -0,0 +1,82 @@
+"""run_query_paged() against a local endpoint whose first answer for a page is cut short."""
+
+import http.server, os, re, threading
+from urllib.parse import parse_qs
+
+import lxml.etree as ET
+import pytest
+
+from agents import query_agent
+from agents.common.sparql_pages import SPARQL_NS, merge_pages
+
+N_RESULTS = 2_500
+PAGE_SIZE = 1_000
+QUERY     = "select ?eli where { ?act ?p ?eli } order by ?eli"
+_PAGE_RE  = re.compile(r"LIMIT\s+(\d+)\s+OFFSET\s+(\d+)\s*$")
+
+
+def results_xml(ids) -> bytes:
+    rows = "".join(f'<result><binding name="eli"><literal>eli/{i}</literal></binding></result>'
+                   for i in ids)
+    return (f'<?xml version="1.0"?><sparql xmlns="{SPARQL_NS}"><head><variable name="eli"/>'
+            f'</head><results>{rows}</results></sparql>').encode()
+
+
+@pytest.fixture
+def endpoint():
+    cut = {"offset": PAGE_SIZE, "left": 1}       # the second page fails once
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            form  = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+            limit, offset = map(int, _PAGE_RE.search(form["query"][0]).groups())
+            body  = results_xml(range(offset, min(offset + limit, N_RESULTS)))
+            if offset == cut["offset"] and cut["left"]:
+                cut["left"] -= 1
+                body = body[:len(body) // 2]     # connection closed mid-document
+            self.send_response(200)
+            self.send_header("Content-Type", "application/sparql-results+xml")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/sparql", cut
+    server.shutdown()
+
+
+def test_truncated_page_is_retried(endpoint, tmp_path, monkeypatch):
+    url, cut = endpoint
+    monkeypatch.setattr(query_agent.time, "sleep", lambda s: None)
+    dest, count = query_agent.run_query_paged(QUERY, url, "2025-06-20", tmp_path,
+                                              {"page_size": PAGE_SIZE, "workers": 2, "max_retries": 2})
+    assert cut["left"] == 0
+    assert count == N_RESULTS
+    elis = [e.text for e in ET.parse(str(dest)).iter(f"{{{SPARQL_NS}}}literal")]
+    assert elis == [f"eli/{i}" for i in range(N_RESULTS)]
+
+
+def test_merge_takes_first_head(tmp_path):
+    pages = []
+    for n, ids in enumerate([range(3), range(3, 5)]):
+        pages.append(tmp_path / f"page-{n}.xml")
+        pages[-1].write_bytes(results_xml(ids))
+    assert merge_pages(pages, tmp_path / "merged.xml") == 5
+    root = ET.parse(str(tmp_path / "merged.xml")).getroot()
+    head = root.find(f"{{{SPARQL_NS}}}head")
+    assert [v.get("name") for v in head] == ["eli"]
+    assert len(root.find(f"{{{SPARQL_NS}}}results")) == 5
+
+
+def test_merge_closes_its_files(tmp_path):
+    pages = [tmp_path / "page-0.xml"]
+    pages[0].write_bytes(results_xml(range(3)))
+    open_fds = lambda: len(os.listdir("/proc/self/fd"))
+    merge_pages(pages, tmp_path / "merged.xml")
+    before = open_fds()
+    for _ in range(20):
+        merge_pages(pages, tmp_path / "merged.xml")
+    assert open_fds() == before
@@ -0,0 +1,68 @@
+"""run_query_stream() against a local endpoint serving a large chunked SPARQL XML document; fetch() of an unknown collection."""
+
+import http.server, threading
+from pathlib import Path
+
+import pytest
+
+from agents import query_agent
+
+N_RESULTS = 20_000
+CHUNK     = 64 * 1024
+
+
+def synthetic_results(n: int) -> bytes:
+    parts = ['<?xml version="1.0"?>\n<sparql xmlns="http://www.w3.org/2005/sparql-results#">\n'
+             '<head><variable name="eli"/><variable name="title"/></head>\n<results>\n']
+    for i in range(n):
+        parts.append(f'<result><binding name="eli"><literal>http://data.europa.eu/eli/reg/2025/{i}/oj'
+                     f'</literal></binding><binding name="title"><literal xml:lang="en">Act {i} &amp; '
+                     f'annex</literal></binding></result>\n')
+    parts.append("</results>\n</sparql>\n")
+    return "".join(parts).encode()
+
+
+@pytest.fixture(scope="module")
+def endpoint():
+    body = synthetic_results(N_RESULTS)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/sparql-results+xml")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(body), CHUNK):
+                chunk = body[i:i + CHUNK]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/sparql", body
+    server.shutdown()
+
+
+def test_stream_to_file(endpoint, tmp_path):
+    url, body = endpoint
+    assert len(body) > 2 * 1024 * 1024            # many chunks, well above STREAM_CHUNK
+    dest = tmp_path / "sparql_results.xml"
+    path, count = query_agent.run_query_stream("SELECT * WHERE {} # <date>", url, "2025-06-20", dest)
+    assert count == N_RESULTS
+    assert isinstance(path, Path) and path == dest
+    assert path.read_bytes() == body
+
+
+def test_unknown_collection_starts_no_run(monkeypatch):
+    started = []
+    monkeypatch.setattr(query_agent.RUNS, "start", lambda *a, **k: started.append(a))
+    before = set(query_agent.SHARED_DIR.iterdir()) if query_agent.SHARED_DIR.exists() else set()
+    assert query_agent.fetch({"date": "2025-06-20", "collection": "no-such-collection"}) is None
+    assert started == []
+    assert (set(query_agent.SHARED_DIR.iterdir()) if query_agent.SHARED_DIR.exists() else set()) == before
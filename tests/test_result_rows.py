@@ -0,0 +1,196 @@
+"""
+result_rows: JSON / TSV results fed in small chunks → row batch file, and
+write_xml() back to the SPARQL XML the XSLT engine reads.
+"""
+
+import io, json
+from pathlib import Path
+
+import lxml.etree as ET
+import pytest
+
+from agents.common import result_rows
+from agents.common.result_rows import SPARQL_NS, XSD
+from agents.common.sitemap_stream import group_results, group_rows, write_sitemap
+
+XSLT = ET.XSLT(ET.parse(str(Path(__file__).resolve().parents[1] / "xslt/raw_to_sitemap.xslt")))
+VARS = ["eli", "oj_collection", "celex", "title", "creating_agents", "count", "date", "blank"]
+
+ELI   = "http://data.europa.eu/eli/reg/2025/{}/oj"
+AGENT = "http://publications.europa.eu/resource/authority/corporate-body/A{}"
+
+# (kind, value, lang, datatype) per variable, unbound left out
+RESULTS = [
+    {"eli": ("l", ELI.format(1), "", ""), "oj_collection": ("u", "http://x/OJ-L", "", ""),
+     "celex": ("l", "32025R0001", "", ""), "title": ("l", "Règlement — café \"A\" & <B>", "fr", ""),
+     "creating_agents": ("u", AGENT.format(1), "", ""), "count": ("l", "42", "", XSD + "integer"),
+     "date": ("l", "2025-06-20", "", XSD + "date")},
+    {"eli": ("l", ELI.format(1), "", ""), "oj_collection": ("u", "http://x/OJ-L", "", ""),
+     "title": ("l", "Regulation\ton tabs\nand lines \\ backslash", "en", ""),
+     "creating_agents": ("u", AGENT.format(2), "", ""), "blank": ("b", "b0", "", "")},
+    {"eli": ("l", ELI.format(2), "", ""), "oj_collection": ("u", "http://x/OJ-C", "", ""),
+     "celex": ("l", "", "", ""), "title": ("l", "Ελληνικά 𝔘nicode", "el", ""),
+     "count": ("l", "-1.5e3", "", XSD + "double"), "date": ("l", "true", "", XSD + "boolean")},
+    {"eli": ("l", ELI.format(3), "", ""), "title": ("l", "Decision (EU) 2025/3", "en-GB", "")},
+]
+
+
+def as_json(results, variables=VARS) -> bytes:
+    def term(t):
+        out = {"type": {"u": "uri", "l": "literal", "b": "bnode"}[t[0]], "value": t[1]}
+        if t[2]:
+            out["xml:lang"] = t[2]
+        if t[3]:
+            out["datatype"] = t[3]
+        return out
+    return json.dumps({"head": {"vars": variables},
+                       "results": {"bindings": [{v: term(t) for v, t in r.items()} for r in results]}},
+                      indent=1).encode()        # ensure_ascii: \u escapes, surrogate pairs
+
+
+def _tsv_escape(text: str) -> str:
+    return (text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+                .replace('"', '\\"').replace("é", "\\u00E9"))
+
+
+def as_tsv(results, variables=VARS) -> bytes:
+    def cell(t):
+        if t is None:
+            return ""
+        kind, value, lang, datatype = t
+        if kind == "u":
+            return f"<{value}>"
+        if kind == "b":
+            return f"_:{value}"
+        if datatype in (XSD + "integer", XSD + "double", XSD + "boolean"):
+            return value                # bare Turtle numbers / booleans
+        text = f'"{_tsv_escape(value)}"'
+        return text + (f"@{lang}" if lang else "") + (f"^^<{datatype}>" if datatype else "")
+    lines = ["\t".join("?" + v for v in variables)]
+    lines += ["\t".join(cell(r.get(v)) for v in variables) for r in results]
+    return ("\r\n".join(lines) + "\r\n").encode()
+
+
+def as_xml(results, variables=VARS) -> bytes:
+    """The SPARQL XML an endpoint sends for *results*."""
+    ns   = f"{{{SPARQL_NS}}}"
+    root = ET.Element(ns + "sparql", nsmap={None: SPARQL_NS})
+    head = ET.SubElement(root, ns + "head")
+    for v in variables:
+        ET.SubElement(head, ns + "variable", name=v)
+    body = ET.SubElement(root, ns + "results")
+    for r in results:
+        result = ET.SubElement(body, ns + "result")
+        for v, (kind, value, lang, datatype) in r.items():
+            el = ET.SubElement(ET.SubElement(result, ns + "binding", name=v),
+                               ns + result_rows.KINDS[kind])
+            el.text = value
+            if lang:
+                el.set("{http://www.w3.org/XML/1998/namespace}lang", lang)
+            if datatype:
+                el.set("datatype", datatype)
+    return ET.tostring(root, xml_declaration=True, encoding="utf-8")
+
+
+def parse(fmt: str, data: bytes, chunk: int, **writer_args) -> tuple[bytes, int]:
+    out    = io.BytesIO()
+    parser = result_rows.PARSERS[fmt](out, **writer_args)
+    for i in range(0, len(data), chunk):
+        parser.feed(data[i:i + chunk])
+    count = parser.close()
+    return out.getvalue(), count
+
+
+def to_xml(rows_file: bytes) -> bytes:
+    out = io.BytesIO()
+    result_rows.write_xml(io.BytesIO(rows_file), out)
+    return out.getvalue()
+
+
+def c14n(xml: bytes) -> bytes:
+    return ET.tostring(ET.parse(io.BytesIO(xml)), method="c14n")
+
+
+# ─── Parsing ──────────────────────────────────────────────────────────────────
+@pytest.mark.parametrize("fmt, encode", [("json", as_json), ("tsv", as_tsv)])
+@pytest.mark.parametrize("chunk", [1, 3, 7, 64, 1 << 20])
+def test_parse_across_chunks(fmt, encode, chunk):
+    data, count = parse(fmt, encode(RESULTS), chunk, batch_size=3)
+    assert count == len(RESULTS)
+    assert list(result_rows.rows(io.BytesIO(data))) == RESULTS
+
+
+def test_interned_columns_across_batches():
+    results   = [{"eli": ("l", ELI.format(i), "", ""), "oj_collection": ("u", f"http://x/OJ-{i % 2}", "", "")}
+                 for i in range(10)]
+    data, _   = parse("json", as_json(results, ["eli", "oj_collection"]), 5, batch_size=4)
+    lines     = [json.loads(line) for line in data.splitlines()]
+    assert lines[0]["interned"] == ["oj_collection"]
+    assert [len(batch["strings"]) for batch in lines[1:]] == [2, 0, 0]    # each string stored once
+    assert list(result_rows.rows(io.BytesIO(data))) == results
+
+
+@pytest.mark.parametrize("fmt, encode", [("json", as_json), ("tsv", as_tsv)])
+def test_empty_results(fmt, encode):
+    data, count = parse(fmt, encode([]), 4)
+    assert count == 0
+    assert list(result_rows.rows(io.BytesIO(data))) == []
+    assert result_rows.read(io.BytesIO(data))[0] == VARS
+    assert c14n(to_xml(data)) == c14n(as_xml([]))
+
+
+@pytest.mark.parametrize("fmt, data", [("json", b'{"head":{"vars":["eli"]},"results":{"bindings":[{"eli":'),
+                                       ("tsv", b"")])
+def test_truncated_results(fmt, data):
+    with pytest.raises(ValueError):
+        parse(fmt, data, 8)
+
+
+def test_tsv_terms():
+    assert result_rows.tsv_term("") is None
+    assert result_rows.tsv_term('"caf\\u00E9 \\U0001D518"@fr') == ("l", "café 𝔘", "fr", "")
+    assert result_rows.tsv_term('"5"^^<http://www.w3.org/2001/XMLSchema#int>') == \
+        ("l", "5", "", XSD + "int")
+    assert result_rows.tsv_term(".5") == ("l", ".5", "", XSD + "decimal")
+    assert result_rows.tsv_term("1E9") == ("l", "1E9", "", XSD + "double")
+    with pytest.raises(ValueError):
+        result_rows.tsv_term("not-a-term")
+
+
+def test_merge(tmp_path):
+    pages = []
+    for i, part in enumerate((RESULTS[:2], RESULTS[2:], [])):
+        pages.append(tmp_path / f"page-{i}.rows")
+        pages[-1].write_bytes(parse("json", as_json(part), 16)[0])
+    assert result_rows.merge(pages, tmp_path / "all.rows") == len(RESULTS)
+    assert list(result_rows.rows(tmp_path / "all.rows")) == RESULTS
+
+
+# ─── Back to SPARQL XML ───────────────────────────────────────────────────────
+@pytest.mark.parametrize("fmt, encode", [("json", as_json), ("tsv", as_tsv)])
+def test_write_xml_is_the_endpoint_xml(fmt, encode):
+    data, _ = parse(fmt, encode(RESULTS), 5, batch_size=2)
+    xml     = to_xml(data)
+    assert c14n(xml) == c14n(as_xml(RESULTS))
+
+    params  = {"issuedDate": ET.XSLT.strparam("2025-06-20"), "lastmodDate": ET.XSLT.strparam("2025-06-21")}
+    assert str(XSLT(ET.parse(io.BytesIO(xml)), **params)) == \
+        str(XSLT(ET.parse(io.BytesIO(as_xml(RESULTS))), **params))
+
+
+def test_literal_xml_matches_lxml():
+    doc = ET.parse(io.BytesIO(as_xml(RESULTS)))
+    for el in doc.iter(f"{{{SPARQL_NS}}}literal"):
+        lang = el.get("{http://www.w3.org/XML/1998/namespace}lang", "")
+        assert result_rows.literal_xml(el.text or "", lang, el.get("datatype", "")) == \
+            ET.tostring(el, encoding="unicode")
+
+
+def test_group_rows_matches_group_results():
+    data, _ = parse("json", as_json(RESULTS), 11, batch_size=2)
+
+    def sitemap(groups) -> bytes:
+        out = io.BytesIO()
+        write_sitemap(list(groups.values()), out, "2025-06-20", "2025-06-21")
+        return out.getvalue()
+    assert sitemap(group_rows(io.BytesIO(data))) == sitemap(group_results(io.BytesIO(as_xml(RESULTS))))
@@ -0,0 +1,61 @@
+"""RunStore: sealing records a run's files, packing stores them as blobs, restoring brings them back."""
+
+import os
+
+from agents.common.payload_store import FilesystemBackend, PayloadStore
+from agents.common.run_store import MANIFEST, RunStore
+
+RUN = "2025-06-20_01TEST"
+
+
+def store(tmp_path) -> RunStore:
+    payloads = PayloadStore(FilesystemBackend(tmp_path / "_payloads"))
+    return RunStore(tmp_path / "runs", payloads, sites=tmp_path / "output", min_age=0)
+
+
+def make_run(tmp_path) -> dict:
+    run_dir = tmp_path / "runs" / RUN
+    (run_dir / "pages").mkdir(parents=True)
+    (run_dir / "build").mkdir()
+    (tmp_path / "output" / RUN).mkdir(parents=True)
+    files = {"sparql_results.xml": b"<sparql/>" * 500, "pages/page-00000.xml": b"<page/>",
+             "site.tar.gz": os.urandom(4096)}
+    for name, data in files.items():
+        (run_dir / name).write_bytes(data)
+    (run_dir / "timings.json").write_text("{}")
+    return files
+
+
+def blobs(tmp_path) -> list:
+    return sorted(p.name for p in (tmp_path / "_payloads").glob("??/*"))
+
+
+def test_seal_records_without_storing(tmp_path):
+    runs, files = store(tmp_path), make_run(tmp_path)
+    runs.start(RUN, "2025-06-20", "L")
+    refs = runs.seal(RUN)
+    assert refs.keys() == files.keys()
+    assert blobs(tmp_path) == []                        # an expanded run: one copy, its files
+    run = runs.get(RUN)
+    assert run["status"] == "done" and run["bytes"] == sum(map(len, files.values()))
+    assert run["stored_bytes"] == 0
+
+
+def test_pack_then_restore(tmp_path):
+    runs, files = store(tmp_path), make_run(tmp_path)
+    runs.start(RUN, "2025-06-20", "L")
+    runs.seal(RUN)
+    runs.pack(RUN)
+    run_dir = tmp_path / "runs" / RUN
+    assert len(blobs(tmp_path)) == len(files)
+    assert sorted(p.name for p in run_dir.iterdir()) == sorted([MANIFEST, "timings.json"])
+    assert not (tmp_path / "output" / RUN).exists()
+    assert runs.get(RUN)["storage"] == "packed" and runs.get(RUN)["stored_bytes"] > 0
+
+    assert runs.restore(RUN)
+    assert {n: (run_dir / n).read_bytes() for n in files} == files
+    assert runs.get(RUN)["storage"] == "files"
+
+
+def test_retention_is_opt_in(tmp_path):
+    assert not store(tmp_path).enabled
@@ -0,0 +1,56 @@
+"""search_index.update(): running size totals against a scan of the files; link_into() as one symlink."""
+
+import json
+
+from agents.common import search_index
+
+
+def records(day: str, n: int, word: str = "regulation"):
+    return [{"issued": day, "loc": f"https://example.org/{day}/{i}", "celex": f"3{day[:4]}R{i:04d}",
+             "num": f"L {i}", "title": f"Commission {word} {i} on café imports", "collection": "oj",
+             "docType": "REG"} for i in range(n)]
+
+
+def scanned(root):
+    total = gz = 0
+    for p in root.rglob("*.json*"):
+        if p.name.startswith("."):
+            continue
+        if p.name.endswith(".gz"):
+            gz += p.stat().st_size
+        else:
+            total += p.stat().st_size
+    return total, gz
+
+
+def test_totals_follow_updates(tmp_path):
+    root = tmp_path / "_search"
+    for recs in (records("2025-06-20", 300), records("2025-06-21", 50),
+                 records("2025-06-20", 120, word="decision"), records("2025-06-21", 50)):
+        stats = search_index.update(root, recs)
+        assert (stats["bytes"], stats["gz_bytes"]) == scanned(root)
+        shards = {p.name[:-5]: p.stat().st_size for p in (root / "shards").glob("*.json")}
+        assert stats["shards"] == len(shards)
+        assert stats["largest_bytes"] == max(shards.values())
+    assert stats["changed"] == [] and stats["shards_written"] == 0
+
+
+def test_totals_of_an_index_without_them(tmp_path):
+    root = tmp_path / "_search"
+    search_index.update(root, records("2025-06-20", 100))
+    (root / search_index.SIZES).unlink()
+    stats = search_index.update(root, records("2025-06-20", 100))
+    assert (stats["bytes"], stats["gz_bytes"]) == scanned(root)
+    assert (root / search_index.SIZES).exists()
+
+
+def test_link_into_is_one_relative_symlink(tmp_path):
+    root = tmp_path / "_search"
+    search_index.update(root, records("2025-06-20", 10))
+    site = tmp_path / "run-1"
+    (site / search_index.SITE_DIR).mkdir(parents=True)            # replaced, whatever was there
+    search_index.link_into(root, site)
+    link = site / search_index.SITE_DIR
+    assert link.is_symlink() and not link.readlink().is_absolute()
+    search_index.update(root, records("2025-06-21", 10))
+    assert "2025-06-21" in json.loads((link / search_index.META).read_text())["dates"]
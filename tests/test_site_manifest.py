@@ -0,0 +1,43 @@
+"""site_manifest: an incremental build renders every page again once the templates changed."""
+
+from agents.common import site_manifest
+
+
+def records(titles):
+    return [{"loc": f"https://example.org/{i}", "num": str(i), "issued": "2025-06-20",
+             "collection": "http://x/OJ-L" if i % 2 else "http://x/OJ-C", "docType": "REG",
+             "title": title, "celex": ""} for i, title in enumerate(titles)]
+
+
+def templates(tmp_path):
+    root = tmp_path / "templates"
+    (root / "_data").mkdir(parents=True)
+    (root / "node_modules/pkg").mkdir(parents=True)
+    (root / "maps.njk").write_text("{{ title }}")
+    (root / ".eleventy.js").write_text("module.exports = () => ({});")
+    (root / "_data/sitemap.js").write_text("module.exports = {};")
+    (root / "node_modules/pkg/index.js").write_text("1")
+    return root
+
+
+def test_templates_hash(tmp_path):
+    root  = templates(tmp_path)
+    first = site_manifest.templates_hash(root)
+    (root / "node_modules/pkg/index.js").write_text("2")        # not a template
+    (root / "_site").mkdir()
+    (root / "_site/index.html").write_text("out")
+    assert site_manifest.templates_hash(root) == first
+    for name in (".eleventy.js", "maps.njk", "_data/sitemap.js"):
+        (root / name).write_text((root / name).read_text() + "\n")
+        assert site_manifest.templates_hash(root) != first
+        first = site_manifest.templates_hash(root)
+
+
+def test_diff_pages(tmp_path):
+    old = site_manifest.build_manifest(records(["a", "b", "c"]), "t1")
+    new = site_manifest.build_manifest(records(["a", "B", "c"]), "t1")
+    assert site_manifest.diff_pages(old, new) == ({"2025-06-20/http-x-oj-l"}, set())
+
+    relaid = site_manifest.build_manifest(records(["a", "b", "c"]), "t2")
+    assert site_manifest.diff_pages(old, relaid) == (set(relaid["pages"]), set())
+    assert site_manifest.diff_pages(None, new) == (set(new["pages"]), set())
@@ -0,0 +1,133 @@
+"""
+The stream engine against xslt/raw_to_sitemap.xslt: byte-identical sitemaps
+on randomized SPARQL XML documents, stylesheet quirks included.
+"""
+
+import io, random
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+
+import lxml.etree as ET
+import pytest
+
+from agents.common.sitemap_stream import SPARQL_NS, build_sitemap
+
+XSLT = ET.XSLT(ET.parse(str(Path(__file__).resolve().parents[1] / "xslt/raw_to_sitemap.xslt")))
+
+TEXTS = ["", "Regulation (EU) 2025/1", "A & B <annex>", "Décision — café", "x > y", "  spaced  ",
+         "line\nbreak", "quote \"'"]
+LANGS = ["en", "fr", "de", None]
+
+
+def _literal(text, lang=None):
+    attr = f" xml:lang={quoteattr(lang)}" if lang else ""
+    return f"<literal{attr}>{escape(text)}</literal>"
+
+
+def _uri(text):
+    return f"<uri>{escape(text)}</uri>"
+
+
+def random_document(rng: random.Random, n_results: int) -> bytes:
+    elis     = [f"http://data.europa.eu/eli/reg/2025/{i}/oj" for i in range(max(1, n_results // 3))]
+    agents   = [f"http://publications.europa.eu/resource/authority/corporate-body/A{i}" for i in range(6)]
+    bindings = {
+        "eli":             lambda: _literal(rng.choice(elis)),
+        "oj_collection":   lambda: _uri(rng.choice(["", "http://x/OJ-L", "http://x/OJ-C"])),
+        "celex":           lambda: _literal(rng.choice(["", "32025R0001", "32025D0002"])),
+        "oj_number":       lambda: _literal(rng.choice(["", "1", "L 202"])),
+        "resource_type":   lambda: _uri(rng.choice(["", "http://x/REG", "http://x/DEC"])),
+        "creating_agents": lambda: _uri(rng.choice(agents)),
+        "title":           lambda: "".join(_literal(rng.choice(TEXTS), rng.choice(LANGS))
+                                           for _ in range(rng.randint(1, 3))),
+    }
+    results = []
+    for _ in range(n_results):
+        parts = []
+        for name, value in bindings.items():
+            # results without an eli, or missing other bindings, are part of the input space
+            if rng.random() < (0.05 if name == "eli" else 0.15):
+                continue
+            parts.append(f'<binding name="{name}">{value()}</binding>')
+        rng.shuffle(parts)
+        results.append(f"<result>{''.join(parts)}</result>")
+    return (f'<?xml version="1.0"?>\n<sparql xmlns="{SPARQL_NS}"><head/><results>'
+            f'{"".join(results)}</results></sparql>').encode()
+
+
+def xslt_sitemap(doc: bytes, issued: str, lastmod: str) -> bytes:
+    out = XSLT(ET.parse(io.BytesIO(doc)),
+               issuedDate=ET.XSLT.strparam(issued), lastmodDate=ET.XSLT.strparam(lastmod))
+    return str(out).encode()
+
+
+def stream_sitemap(doc: bytes, issued: str, lastmod: str) -> bytes:
+    out = io.BytesIO()
+    build_sitemap(io.BytesIO(doc), out, issued, lastmod)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_documents(seed):
+    rng = random.Random(seed)
+    doc = random_document(rng, rng.randint(0, 40))
+    issued = "" if seed % 10 == 0 else "2025-06-20"
+    assert stream_sitemap(doc, issued, "2025-06-21") == xslt_sitemap(doc, issued, "2025-06-21")
+
+
+def _doc(*results) -> bytes:
+    return (f'<?xml version="1.0"?>\n<sparql xmlns="{SPARQL_NS}"><head/><results>'
+            + "".join(f"<result>{r}</result>" for r in results) + "</results></sparql>").encode()
+
+
+def _b(name, value):
+    return f'<binding name="{name}">{value}</binding>'
+
+
+QUIRKS = {
+    # a creator is listed only under the act where it first occurs in the document
+    "first_appearance_creators": _doc(
+        _b("eli", _literal("e1")) + _b("creating_agents", _uri("A")),
+        _b("eli", _literal("e2")) + _b("creating_agents", _uri("A")),
+        _b("eli", _literal("e2")) + _b("creating_agents", _uri("B")),
+        _b("eli", _literal("e1")) + _b("creating_agents", _uri("B"))),
+    # no English title: the first literal of every title binding is copied
+    "no_english_title": _doc(
+        _b("eli", _literal("e1")) + _b("title", _literal("Titre", "fr") + _literal("Zweite", "de")),
+        _b("eli", _literal("e1")) + _b("title", _literal("Titel", "de")),
+        _b("eli", _literal("e2")) + _b("title", _literal("Titre", "fr")),
+        _b("eli", _literal("e2")) + _b("title", _literal("Title", "en"))),
+    # empty values come out as self-closing elements
+    "empty_values": _doc(
+        _b("eli", _literal("e1")) + _b("celex", _literal("")) + _b("oj_number", _literal(""))
+        + _b("oj_collection", _uri("")) + _b("resource_type", _uri(""))
+        + _b("creating_agents", _uri("")) + _b("title", _literal("", "en"))),
+    "result_without_eli": _doc(
+        _b("creating_agents", _uri("A")),
+        _b("eli", _literal("e1")) + _b("creating_agents", _uri("A"))),
+    "empty_document": _doc(),
+}
+
+
+@pytest.mark.parametrize("name", QUIRKS)
+def test_quirks(name):
+    doc = QUIRKS[name]
+    stream = stream_sitemap(doc, "2025-06-20", "2025-06-21")
+    assert stream == xslt_sitemap(doc, "2025-06-20", "2025-06-21")
+    if name == "empty_values":
+        assert b"<dcterms:identifier/>" in stream and b"<akn4eu:num/>" in stream
+    if name == "first_appearance_creators":
+        urls = ET.fromstring(stream).findall("{http://www.sitemaps.org/schemas/sitemap/0.9}url")
+        assert [[c.text for c in u.iter("{http://purl.org/dc/terms/}creator")] for u in urls] \
+            == [["A"], ["B"]]
+
+
+def test_both_engines_read_a_payload_ref(tmp_path):
+    """The consumer leaves `xml` as a PayloadRef whatever the engine (hot reloads switch it)."""
+    from agents import sitemap_builder
+    doc     = random_document(random.Random(3), 60).decode()
+    payload = {"xml": sitemap_builder.PAYLOADS.put(doc), "date": "2025-06-20"}
+    assert isinstance(payload["xml"], dict)
+    sitemap_builder.sitemap_xslt(payload, tmp_path / "xslt.xml")
+    sitemap_builder.sitemap_stream(payload, tmp_path / "stream.xml")
+    assert (tmp_path / "xslt.xml").read_bytes() == (tmp_path / "stream.xml").read_bytes()
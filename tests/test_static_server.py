@@ -0,0 +1,36 @@
+"""CachingHandler: 200 and 304 answers carry the same caching headers."""
+
+import functools, http.client, http.server, threading
+
+import pytest
+
+from agents.common.static_server import CachingHandler, precompress
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "page.html").write_text("<p>page</p>" * 200)
+    precompress(tmp_path / "page.html")
+    handler = functools.partial(CachingHandler, directory=str(tmp_path))
+    httpd   = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd.server_address[1]
+    httpd.shutdown()
+
+
+def get(port, headers):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.request("GET", "/page.html", headers=headers)
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    return resp
+
+
+def test_not_modified_keeps_vary_and_etag(server):
+    ok = get(server, {"Accept-Encoding": "gzip"})
+    assert ok.status == 200 and ok.getheader("Content-Encoding") == "gzip"
+    again = get(server, {"Accept-Encoding": "gzip", "If-None-Match": ok.getheader("ETag")})
+    assert again.status == 304
+    for name in ("ETag", "Last-Modified", "Vary"):
+        assert again.getheader(name) == ok.getheader(name)
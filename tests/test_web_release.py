@@ -0,0 +1,98 @@
+"""web_agent._build_release(): which files of a staged site are linked from the previous release."""
+
+import os, shutil
+
+import pytest
+
+from agents import web_agent
+from agents.common import site_manifest
+
+PAGES = {"2025-06-20/oj-l/index.html": "<p>L</p>" * 200,
+         "2025-06-20/oj-c/index.html": "<p>C</p>" * 200,
+         "index.html": "<h1>index</h1>"}
+
+
+def write_site(site, pages, manifest=None):
+    for name, text in pages.items():
+        (site / name).parent.mkdir(parents=True, exist_ok=True)
+        (site / name).write_text(text)
+    if manifest is not None:
+        site_manifest.write_manifest(site, manifest)
+
+
+def manifest(hashes, templates="t"):
+    return {"templates": templates, "pages": {k: {"hash": h, "resource_types": {}} for k, h in hashes.items()}}
+
+
+def tree(root):
+    return {p.relative_to(root).as_posix(): p.read_bytes() for p in root.rglob("*")
+            if p.is_file() and not p.name.endswith(".gz")}
+
+
+@pytest.fixture
+def first(tmp_path):
+    site = tmp_path / "staging/run-1"
+    write_site(site, PAGES)
+    release = tmp_path / "releases/run-1"
+    release.parent.mkdir()
+    assert web_agent._build_release(site, release, None) == (3, 0)
+    return site, release
+
+
+def test_links_files_of_a_linked_build(tmp_path, first):
+    site, release = first
+    site2 = tmp_path / "staging/run-2"
+    shutil.copytree(site, site2, copy_function=os.link)         # as an incremental build links them
+    (site2 / "index.html").unlink()
+    (site2 / "index.html").write_text("<h1>INDEX</h1>")          # same size, new content
+    release2 = tmp_path / "releases/run-2"
+    assert web_agent._build_release(site2, release2, release) == (1, 2)
+    assert tree(release2) == tree(site2)
+    assert os.path.samefile(release2 / "2025-06-20/oj-l/index.html", release / "2025-06-20/oj-l/index.html")
+    assert (release2 / "2025-06-20/oj-l/index.html.gz").exists()
+
+
+@pytest.mark.parametrize("templates, linked", [("t", 2), ("t2", 0)])
+def test_links_pages_of_the_same_hash(tmp_path, templates, linked):
+    site, release = tmp_path / "staging/run-1", tmp_path / "releases/run-1"
+    write_site(site, PAGES, manifest({"2025-06-20/oj-l": "a", "2025-06-20/oj-c": "b"}))
+    release.parent.mkdir()
+    web_agent._build_release(site, release, None)
+
+    site2 = tmp_path / "staging/run-2"
+    write_site(site2, PAGES, manifest({"2025-06-20/oj-l": "a", "2025-06-20/oj-c": "b"}, templates))
+    for p in site2.rglob("*"):                                  # re-rendered: newer files
+        os.utime(p, ns=(p.stat().st_atime_ns, p.stat().st_mtime_ns + 10**9))
+    copied, n = web_agent._build_release(site2, tmp_path / "releases/run-2", release)
+    assert n == linked and copied == 4 - linked                 # pages, index, manifest
+
+
+@pytest.fixture
+def prod(tmp_path, monkeypatch):
+    prod = tmp_path / "prod"
+    monkeypatch.setattr(web_agent, "PROD_DIR", prod)
+    monkeypatch.setattr(web_agent, "RELEASES_DIR", prod / "releases")
+    monkeypatch.setattr(web_agent, "CURRENT", prod / "current")
+    monkeypatch.setattr(web_agent, "HISTORY", prod / "releases.json")
+    return prod
+
+
+def test_legacy_site_becomes_a_release(prod):
+    write_site(prod, PAGES)
+    web_agent.migrate_legacy()
+    assert sorted(p.name for p in prod.iterdir()) == ["current", "releases", "releases.json"]
+    assert tree(prod / "current") == {k: v.encode() for k, v in PAGES.items()}
+    assert web_agent._history() == ["legacy"]
+    web_agent.migrate_legacy()                                  # nothing left to move
+    assert [p.name for p in (prod / "releases").iterdir()] == ["legacy"]
+
+
+def test_legacy_files_next_to_a_release(prod):
+    write_site(prod / "releases/run-1", PAGES)
+    web_agent._switch(prod / "releases/run-1")
+    web_agent._record("run-1")
+    (prod / "index.html").write_text("old")
+    web_agent.migrate_legacy()
+    assert web_agent._current_release().name == "run-1"
+    assert (prod / "releases/legacy/index.html").read_text() == "old"
+    assert not (prod / "index.html").exists()